@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+def active_cache_key(user_id):
+    return f"accounts:user-active:{user_id}"
+
+# Deactivated or deleted users are rejected at most JWT_REVOCATION_CACHE_SECONDS after the change,
+# in between the answer comes from the cache instead of the database
+def is_user_active(user_id):
+    key = active_cache_key(user_id)
+    active = cache.get(key)
+    
+    if active is None:
+        active = get_user_model().objects.filter(pk=user_id, is_active=True).exists()
+        cache.set(key, active, settings.JWT_REVOCATION_CACHE_SECONDS)
+    
+    return active
+
+def forget_user(user_id):
+    cache.delete(active_cache_key(user_id))
+
+
+# User built from the claims of the access token (user_id, username, roles).
+# Anything not in the claims loads the real user row on first access. It is read-only: code that writes the user or
+# needs the model (_meta, serializers) uses .user, like accounts.views.UserViewSet does for djoser's endpoints.
+class ClaimsUser(TokenUser):
+    # The claim is a string, the primary key has the type of the model so comparisons with user rows work
+    @cached_property
+    def id(self):
+        return get_user_model()._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+    
+    @cached_property
+    def pk(self):
+        return self.id
+    
+    @cached_property
+    def roles(self):
+        return list(self.token.get("roles", []))
+    
+    @cached_property
+    def user(self):
+        return get_user_model().objects.get(pk=self.id)
+    
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        return getattr(self.user, attr)
+    
+    def save(self, *args, **kwargs):
+        return self.user.save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        return self.user.delete(*args, **kwargs)
+    
+    def set_password(self, raw_password):
+        return self.user.set_password(raw_password)
+    
+    def check_password(self, raw_password):
+        return self.user.check_password(raw_password)
+
+
+# Trusts the signed claims added by accounts.serializers.TokenObtainPairSerializer instead of loading the user on every request
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    def get_user(self, validated_token):
+        user = ClaimsUser(super().get_user(validated_token).token)
+        
+        if not is_user_active(user.id):
+            raise AuthenticationFailed("User is inactive or deleted", code="user_inactive")
+        
+        return user
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-19 14:46
+
+from django.db import migrations
+
+# The roles used by settings.ROLE_ACTION_PERMISSIONS, a user gets a role by joining the group of that name
+ROLES = ["admin", "planner", "store", "production", "qc", "wet_process"]
+
+
+# Creates the role groups and puts the superusers in "admin", so the existing accounts that manage the site keep
+# their write access. Everybody else gets their roles assigned in the admin.
+def create_role_groups(apps, schema_editor):
+    Group = apps.get_model("auth", "Group")
+    User = apps.get_model("accounts", "User")
+
+    for name in ROLES:
+        Group.objects.get_or_create(name=name)
+
+    admin = Group.objects.get(name="admin")
+    admin.user_set.add(*User.objects.filter(is_superuser=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_role_groups, migrations.RunPython.noop),
+    ]
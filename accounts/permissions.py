@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.permissions import SAFE_METHODS, BasePermission
+
+# Role meaning "any authenticated user"
+ANY_ROLE = "*"
+
+# Rule key covering every GET/HEAD/OPTIONS action of a viewset that has no rule of its own
+READ_ACTIONS = "read"
+
+# {basename: {action: frozenset of roles}}, compiled once from settings.ROLE_ACTION_PERMISSIONS by AccountsConfig.ready()
+compiled_rules = {}
+
+
+def compile_rules(table):
+    rules = {}
+    
+    for basename, actions in table.items():
+        rules[basename] = {}
+        
+        for action, roles in actions.items():
+            if isinstance(roles, str) or not all(isinstance(role, str) for role in roles):
+                raise ImproperlyConfigured(
+                    f"ROLE_ACTION_PERMISSIONS[{basename!r}][{action!r}] must be a list of role names."
+                )
+            
+            for name in action.split(","):
+                rules[basename][name.strip()] = frozenset(roles)
+    
+    return rules
+
+def load_rules():
+    compiled_rules.clear()
+    compiled_rules.update(compile_rules(settings.ROLE_ACTION_PERMISSIONS))
+
+def get_roles(request):
+    # Roles come from the token claims (accounts.authentication.ClaimsUser),
+    # only session-authenticated users (browsable API) fall back to a group query
+    roles = getattr(request.user, "roles", None)
+    
+    if roles is None:
+        roles = request.user.groups.values_list("name", flat=True)
+    
+    return roles
+
+
+# Checks view.action against the roles in the JWT claims, without touching the database.
+# Viewsets whose basename is not in ROLE_ACTION_PERMISSIONS are left open as before.
+class RoleActionPermission(BasePermission):
+    message = "Your role is not allowed to perform this action."
+    
+    def has_permission(self, request, view):
+        rules = compiled_rules.get(getattr(view, "basename", None))
+        
+        if rules is None:
+            return True
+        
+        allowed = rules.get(view.action)
+        
+        if allowed is None and request.method in SAFE_METHODS:
+            allowed = rules.get(READ_ACTIONS)
+        
+        if allowed is None or not request.user.is_authenticated:
+            return False
+        
+        if ANY_ROLE in allowed:
+            return True
+        
+        return not allowed.isdisjoint(get_roles(request))
@@ -1,9 +1,22 @@
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as BaseTokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from django.contrib.auth.models import Group
 
 
 # This Serializer will be used for the endpoint auth/jwt/create/ which returns the tokens and roles during logging in.
 class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    # These claims are copied into every access token made from this refresh token,
+    # accounts.authentication.StatelessJWTAuthentication reads them instead of loading the user
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token["username"] = user.username
+        token["roles"] = list(user.groups.values_list("name", flat=True))
+        return token
+    
     def validate(self, attrs):
         data = super().validate(attrs) # gives 'access' and 'refresh'
         user = self.user
@@ -15,6 +28,16 @@ class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
         return data
 
 
+# Used by auth/jwt/refresh/. The roles of the new access token are read again from the groups, so a role change
+# reaches the API within one ACCESS_TOKEN_LIFETIME instead of living as long as the refresh token.
+class TokenRefreshSerializer(BaseTokenRefreshSerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        access = AccessToken(data["access"])
+        access["roles"] = list(Group.objects.filter(user__pk=access[api_settings.USER_ID_CLAIM]).values_list("name", flat=True))
+        data["access"] = str(access)
+        return data
+
 
 class GroupSerializer(serializers.Serializer):
     id = serializers.IntegerField()
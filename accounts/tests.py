@@ -1,3 +1,88 @@
+from django.conf import settings
+from django.contrib.auth.models import Group
 from django.test import TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .models import User
+
+
+class UserEndpointTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("alice", email="alice@example.com", password="secret-password-1")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {self.login()['access']}")
+
+    def login(self):
+        response = self.client.post("/auth/jwt/create/", {"username": "alice", "password": "secret-password-1"}, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_patch_me_updates_the_user(self):
+        response = self.client.patch("/auth/users/me/", {"email": "new@example.com"}, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["email"], "new@example.com")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, "new@example.com")
+
+    def test_get_own_user_by_id(self):
+        response = self.client.get(f"/auth/users/{self.user.id}/")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["email"], "alice@example.com")
+
+    # The refresh token comes back as a cookie of auth/jwt/create/ and the client sends it to auth/jwt/refresh/
+    def test_refresh_reads_the_roles_again(self):
+        self.user.groups.add(Group.objects.get(name="planner"))
+
+        response = self.client.post("/auth/jwt/refresh/")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(AccessToken(response.data["access"])["roles"], ["planner"])
+
+
+# Runs settings.ROLE_ACTION_PERMISSIONS against the roles of a real token, as the ClaimsUser of StatelessJWTAuthentication
+class RolePermissionTests(TestCase):
+    def client_for(self, username, *roles):
+        user = User.objects.create_user(username, password="secret-password-1")
+        user.groups.add(*Group.objects.filter(name__in=roles))
+        client = APIClient()
+        response = client.post("/auth/jwt/create/", {"username": username, "password": "secret-password-1"}, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        client.credentials(HTTP_AUTHORIZATION=f"JWT {response.data['access']}")
+        return client
+
+    def test_store_receives_bundles_only(self):
+        client = self.client_for("store", "store")
+        bundle = {
+            "so": "S1", "mpo": "M1", "buyer": "B", "style": "ST", "marker": "MK", "bundle_no": 1,
+            "bundle_barcode": "82200000M1000001001", "size": "M", "shade": "A", "color": "Blue", "quantity": 10,
+        }
+
+        self.assertEqual(client.post("/productions/received-bundles/", bundle, format="json").status_code, 201)
+        self.assertEqual(client.post("/productions/plannings/", {"mpo": "M1", "stages": []}, format="json").status_code, 403)
+        self.assertEqual(client.get("/productions/exports/").status_code, 403)
+
+    def test_user_without_roles_can_only_read(self):
+        client = self.client_for("nobody")
+
+        self.assertEqual(client.get("/productions/plannings/").status_code, 200)
+        self.assertEqual(client.post("/productions/plannings/", {"mpo": "M1", "stages": []}, format="json").status_code, 403)
+        self.assertEqual(client.post("/wet-process/first-wash-batches/", {"shade": "A"}, format="json").status_code, 403)
+
+    # jobs/jobs/ lets everyone in, the roles of the register() call decide
+    def test_job_roles_come_from_the_job(self):
+        data = {"name": "export", "params": {"dataset": "batches"}}
+
+        self.assertEqual(self.client_for("store", "store").post("/jobs/jobs/", data, format="json").status_code, 403)
+        self.assertEqual(self.client_for("planner", "planner").post("/jobs/jobs/", data, format="json").status_code, 202)
+
+    # Viewsets without a ROLE_ACTION_PERMISSIONS entry are deliberately left open to any logged in user
+    def test_unlisted_viewset_is_open(self):
+        self.assertNotIn("group", settings.ROLE_ACTION_PERMISSIONS)
+
+        response = self.client_for("nobody").get("/groups/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("store", [group["name"] for group in response.data])
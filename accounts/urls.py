@@ -5,6 +5,7 @@ from . import views
 
 router = DefaultRouter()
 router.register("groups", views.GroupViewSet, basename="group") # For returning the groups (in other words: roles)
+router.register("auth/users", views.UserViewSet, basename="user") # djoser's user endpoints, see views.UserViewSet
 
 urlpatterns = [path("", include(router.urls)),
                path("auth/jwt/create/", views.CookieTokenObtainPairView.as_view(), name="token_obtain_pair"),
@@ -10,11 +10,21 @@ from rest_framework import status, exceptions
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+from djoser.views import UserViewSet as DjoserUserViewSet
+from .authentication import ClaimsUser
 
 class GroupViewSet(ReadOnlyModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
 
+# djoser's users/ endpoints read the model metadata of request.user, set attributes on it and compare its pk,
+# so they work on the real User row instead of the ClaimsUser built from the token
+class UserViewSet(DjoserUserViewSet):
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if isinstance(request.user, ClaimsUser):
+            request.user = request.user.user
+
 # @method_decorator(ensure_csrf_cookie, name="dispatch") Commented cause don't want to use csrf protection here for simplicity
 class CookieTokenObtainPairView(TokenObtainPairView):
     # Automatically use the CustomSerializer that I defined in the settings Of SIMPLE_JWT["TOKEN_OBTAIN_SERIALIZER"]
@@ -0,0 +1,83 @@
+# Times the received bundle changelist of the admin on a large table, against a plain ModelAdmin with the same columns.
+# Run from the project root: python benchmarks/bench_admin.py
+import statistics
+import time
+
+from _setup import setup_django
+
+setup_django()
+
+from django.contrib import admin
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+from production.admin import ReceivedBundleAdmin
+from production.models import ReceivedBundle
+
+BUNDLES = 300000
+MPOS = 2000
+RUNS = 20
+
+
+def generate():
+    ReceivedBundle.objects.bulk_create([
+        ReceivedBundle(
+            so="SO1", mpo=f"MPO{number % MPOS}", buyer="B", style="ST", marker="MK", bundle_no=number,
+            bundle_barcode=f"8220{number:012d}001", size="M", shade="A", color="C", quantity=10, received_by="benchmark",
+        )
+        for number in range(BUNDLES)
+    ], batch_size=5000)
+
+
+class PlainReceivedBundleAdmin(admin.ModelAdmin):
+    list_display = ReceivedBundleAdmin.list_display
+    search_fields = ["bundle_barcode", "mpo"]
+
+
+def time_changelist(model_admin, user, params):
+    factory = RequestFactory()
+    timings = []
+    for _ in range(RUNS):
+        request = factory.get("/admin/production/receivedbundle/", params)
+        request.user = user
+
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            response = model_admin.changelist_view(request)
+            response.render()
+        timings.append(1000 * (time.perf_counter() - started))
+
+    assert response.status_code == 200, response.status_code
+    return statistics.median(timings), len(captured)
+
+
+def main():
+    generate()
+    user = User.objects.create_superuser("benchmark", password="benchmark")
+    site = admin.AdminSite()
+    admins = {
+        "plain": PlainReceivedBundleAdmin(ReceivedBundle, site),
+        "scalable": ReceivedBundleAdmin(ReceivedBundle, site),
+    }
+    cases = {
+        "first page": {},
+        "page 200": {"p": "200"},
+        "filtered": {"status__exact": "received"},
+        "search barcode": {"q": "8220000000123456001"},
+        "search mpo": {"q": "MPO17"},
+    }
+
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+    print(f"{BUNDLES} received bundles")
+    for case, params in cases.items():
+        for name, model_admin in admins.items():
+            median, queries = time_changelist(model_admin, user, params)
+            print(f"{case:15} {name:9} {queries} queries   median {median:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Compares database queries and time per request of JWTAuthentication and StatelessJWTAuthentication.
+# Run from the project root: python benchmarks/bench_auth.py
+import time
+
+from _setup import setup_django
+
+setup_django()
+
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from accounts.authentication import StatelessJWTAuthentication
+from accounts.models import User
+from accounts.serializers import TokenObtainPairSerializer
+from production.serializers import get_user_name
+
+REQUESTS = 2000
+
+
+def run(authenticator, token):
+    factory = APIRequestFactory()
+    request = factory.get("/productions/batches/", HTTP_AUTHORIZATION=f"JWT {token}")
+
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for _ in range(REQUESTS):
+            request.user, _ = authenticator.authenticate(request)
+            get_user_name(request)
+        elapsed = time.perf_counter() - started
+
+    return len(queries) / REQUESTS, elapsed / REQUESTS * 1_000_000
+
+
+def main():
+    user = User.objects.create_user("benchmark", password="benchmark")
+    user.groups.add(Group.objects.create(name="production"))
+    token = str(TokenObtainPairSerializer.get_token(user).access_token)
+
+    print(f"{REQUESTS} authenticated requests")
+    for authenticator in (JWTAuthentication(), StatelessJWTAuthentication()):
+        queries, micros = run(authenticator, token)
+        print(f"{type(authenticator).__name__:<30} {queries:.3f} queries/request {micros:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Times prefix lookups of the autocomplete index for growing numbers of distinct values.
+# Run from the project root: python benchmarks/bench_autocomplete.py
+import random
+import string
+import time
+
+from _setup import setup_django
+
+setup_django(migrate=False)
+
+from production.autocomplete import PrefixIndex
+
+SIZES = [1000, 100000, 1000000]
+LOOKUPS = 20000
+LIMIT = 10
+
+
+def random_value():
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=random.randint(6, 14)))
+
+
+def main():
+    random.seed(1)
+
+    for size in SIZES:
+        values = [random_value() for _ in range(size)]
+
+        started = time.perf_counter()
+        index = PrefixIndex(values)
+        built = time.perf_counter()
+
+        prefixes = [value[:random.randint(1, 4)].lower() for value in random.choices(values, k=LOOKUPS)]
+        searched = time.perf_counter()
+        for prefix in prefixes:
+            index.search(prefix, LIMIT)
+        finished = time.perf_counter()
+
+        started_adds = time.perf_counter()
+        for _ in range(1000):
+            index.add(random_value())
+        added = time.perf_counter()
+
+        print(
+            f"{size:>8} values   build {1000 * (built - started):8.1f} ms   "
+            f"search {1e6 * (finished - searched) / LOOKUPS:6.2f} us   "
+            f"add {1e6 * (added - started_adds) / 1000:7.2f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
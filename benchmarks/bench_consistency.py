@@ -0,0 +1,122 @@
+# Times check_consistency on generated production tables with a few broken rows of every kind, then repairs them.
+# Run from the project root: python benchmarks/bench_consistency.py
+import random
+import time
+
+from _setup import setup_django
+
+setup_django()
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from production.models import Batch, BatchBalance, BatchBundle, BatchQcStageSummary, BatchStage, BatchStageHistory, Planning, ReceivedBundle, Rejection, StageName
+from production.routes import get_route_template
+
+BATCHES = 200000
+BUNDLES_PER_BATCH = 2
+STAGES = ["Sewing", "QC", "Wash"]
+REJECTIONS = 100000
+# Rows broken per invariant
+BROKEN = 50
+
+
+def generate():
+    random.seed(1)
+    stages = [StageName.objects.create(stage=name) for name in STAGES]
+    planning = Planning.objects.create(mpo="BENCH", route=get_route_template(STAGES), updated_by="benchmark")
+    now = timezone.now()
+
+    ReceivedBundle.objects.bulk_create([
+        ReceivedBundle(
+            so="SO", mpo="BENCH", buyer="B", style="ST", marker="M", bundle_no=number,
+            bundle_barcode=f"8220{number:012d}001", size="M", shade="A", color="C", quantity=20,
+            status=ReceivedBundle.STATUS_ALLOCATED,
+        )
+        for number in range(BATCHES * BUNDLES_PER_BATCH)
+    ], batch_size=5000)
+    bundle_ids = list(ReceivedBundle.objects.order_by("id").values_list("id", flat=True))
+
+    batches = Batch.objects.bulk_create([
+        Batch(mpo="BENCH", size="M", color="C", planning=planning, status=Batch.STATUS_CLOSED, updated_by="benchmark")
+        for _ in range(BATCHES)
+    ], batch_size=5000)
+    BatchBundle.objects.bulk_create([
+        BatchBundle(batch=batch, received_id=bundle_ids[index * BUNDLES_PER_BATCH + offset])
+        for index, batch in enumerate(batches)
+        for offset in range(BUNDLES_PER_BATCH)
+    ], batch_size=5000)
+    BatchStage.objects.bulk_create([
+        BatchStage(batch=batch, current_stage=stages[-1], sequence=len(stages), current_status=BatchStage.STATUS_CLOSED)
+        for batch in batches
+    ], batch_size=5000)
+    BatchStageHistory.objects.bulk_create([
+        BatchStageHistory(batch=batch, stage=stage, sequence=index + 1, entered_at=now, closed_at=now, entered_by="benchmark", closed_by="benchmark")
+        for batch in batches
+        for index, stage in enumerate(stages)
+    ], batch_size=5000)
+
+    rejected = random.sample(range(BATCHES * BUNDLES_PER_BATCH), REJECTIONS)
+    Rejection.objects.bulk_create([
+        Rejection(individual_barcode=f"{number:012d}0001", batch=batches[number // BUNDLES_PER_BATCH], stage=stages[1], reason=Rejection.DEFECT_OTHER, rejected_by="benchmark")
+        for number in rejected
+    ], batch_size=5000)
+    rejections_per_batch = {}
+    for number in rejected:
+        batch = batches[number // BUNDLES_PER_BATCH]
+        rejections_per_batch[batch.id] = rejections_per_batch.get(batch.id, 0) + 1
+
+    BatchQcStageSummary.objects.bulk_create([
+        BatchQcStageSummary(batch_id=batch_id, stage=stages[1], rejection_count=count)
+        for batch_id, count in rejections_per_batch.items()
+    ], batch_size=5000)
+    BatchBalance.objects.bulk_create([
+        BatchBalance(
+            batch=batch,
+            produced_quantity=20 * BUNDLES_PER_BATCH,
+            rejected_quantity=rejections_per_batch.get(batch.id, 0),
+            available_quantity=20 * BUNDLES_PER_BATCH - rejections_per_batch.get(batch.id, 0),
+        )
+        for batch in batches
+    ], batch_size=5000)
+
+    return [batch.id for batch in batches]
+
+def break_rows(batch_ids):
+    sample = lambda: random.sample(batch_ids, BROKEN)
+    BatchStage.objects.filter(batch_id__in=sample()).update(current_status=BatchStage.STATUS_IN)
+    Batch.objects.filter(id__in=sample()).update(status=Batch.STATUS_IN)
+    BatchQcStageSummary.objects.filter(batch_id__in=sample()).update(rejection_count=F("rejection_count") + 1)
+    BatchBalance.objects.filter(batch_id__in=sample()).update(available_quantity=F("available_quantity") + 1)
+    ReceivedBundle.objects.filter(batch_bundle__batch_id__in=sample()).update(status=ReceivedBundle.STATUS_RECEIVED)
+
+
+def timed(**options):
+    started = time.perf_counter()
+    try:
+        call_command("check_consistency", **options)
+    except CommandError as error:
+        print(error)
+    return time.perf_counter() - started
+
+
+def main():
+    batch_ids = generate()
+    break_rows(batch_ids)
+
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+    rows = sum(model.objects.count() for model in (Batch, ReceivedBundle, BatchBundle, BatchStage, BatchStageHistory, Rejection, BatchQcStageSummary, BatchBalance))
+    print(f"{BATCHES} batches, {rows} rows in the checked tables, {BROKEN} broken rows per invariant")
+
+    print(f"check:  {timed(sample=3):.1f} s")
+    print(f"repair: {timed(repair=True):.1f} s")
+    print(f"check:  {timed():.1f} s")
+
+
+if __name__ == "__main__":
+    main()
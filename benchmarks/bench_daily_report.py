@@ -0,0 +1,150 @@
+# Times the daily report served from the snapshots against the same numbers aggregated from the history tables,
+# and the incremental snapshot update after a day's worth of stage changes against a full rebuild.
+# Run from the project root: python benchmarks/bench_daily_report.py
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from _setup import setup_django
+
+setup_django()
+
+from django.db import connection
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from production.events import build_event
+from production.models import Batch, BatchBalance, BatchStageHistory, ChangeEvent, Planning, Rejection, StageName
+from production.routes import get_route_template
+from production.snapshots import rebuild_snapshots, update_snapshots
+from production.views import DailyReportViewSet
+
+STAGE_NAMES = ["Cutting", "Sewing", "QC", "Wash", "Finishing", "Packing"]
+DAYS = 180
+BATCHES = 30000
+REJECTIONS = 60000
+# Stage changes made after the last snapshot update
+NEW_CHANGES = 2000
+REPORT_DAYS = 31
+RUNS = 20
+
+
+def generate():
+    random.seed(1)
+    stages = [StageName.objects.create(stage=name) for name in STAGE_NAMES]
+    template = get_route_template(STAGE_NAMES)
+    planning = Planning.objects.create(mpo="MPO1", route=template, updated_by="benchmark")
+    batches = Batch.objects.bulk_create([
+        Batch(mpo="MPO1", size="M", color="C", planning=planning, updated_by="benchmark")
+        for _ in range(BATCHES)
+    ], batch_size=5000)
+    BatchBalance.objects.bulk_create([
+        BatchBalance(batch=batch, produced_quantity=random.randint(20, 200), available_quantity=0)
+        for batch in batches
+    ], batch_size=5000)
+
+    now = timezone.now()
+    history = []
+    for batch in batches:
+        moment = now - timedelta(minutes=random.randint(0, 60 * 24 * DAYS))
+        for sequence, stage in enumerate(stages, 1):
+            entered = moment
+            moment = moment + timedelta(minutes=random.randint(10, 600))
+            history.append(BatchStageHistory(
+                batch=batch, stage=stage, sequence=sequence, entered_at=entered,
+                closed_at=moment if moment < now else None, entered_by="benchmark",
+            ))
+            if moment >= now:
+                break
+    BatchStageHistory.objects.bulk_create(history, batch_size=5000)
+
+    rejections = Rejection.objects.bulk_create([
+        Rejection(individual_barcode=f"G{number}", batch=random.choice(batches), stage=random.choice(stages),
+                  reason=Rejection.DEFECT_OTHER, rejected_by="benchmark")
+        for number in range(REJECTIONS)
+    ], batch_size=5000)
+    # rejected_at is auto_now, spread it over the period afterwards
+    for rejection in rejections:
+        rejection.rejected_at = now - timedelta(minutes=random.randint(0, 60 * 24 * DAYS))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "UPDATE production_rejection SET rejected_at = %s WHERE id = %s",
+            [(rejection.rejected_at, rejection.id) for rejection in rejections],
+        )
+    return len(history)
+
+def new_changes():
+    now = timezone.now()
+    rows = list(BatchStageHistory.objects.filter(closed_at__isnull=True)[:NEW_CHANGES])
+    for row in rows:
+        row.closed_at = now
+    BatchStageHistory.objects.bulk_update(rows, ["closed_at"], batch_size=1000)
+    ChangeEvent.objects.bulk_create([build_event(row, ChangeEvent.ACTION_UPDATED, "benchmark") for row in rows])
+    return len(rows)
+
+def live_report(start, end):
+    entered = list(
+        BatchStageHistory.objects.filter(entered_at__gte=start, entered_at__lt=end)
+        .annotate(day=TruncDate("entered_at")).order_by()
+        .values("day", "stage_id").annotate(batches=Count("id"), pieces=Sum("batch__balance__produced_quantity"))
+    )
+    closed = list(
+        BatchStageHistory.objects.filter(closed_at__gte=start, closed_at__lt=end)
+        .annotate(day=TruncDate("closed_at")).order_by()
+        .values("day", "stage_id").annotate(batches=Count("id"), pieces=Sum("batch__balance__produced_quantity"))
+    )
+    rejected = list(
+        Rejection.objects.filter(rejected_at__gte=start, rejected_at__lt=end)
+        .annotate(day=TruncDate("rejected_at")).order_by()
+        .values("day", "stage_id").annotate(pieces=Count("id"))
+    )
+    return entered, closed, rejected
+
+def median_ms(function, runs=RUNS):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        timings.append(1000 * (time.perf_counter() - started))
+    return statistics.median(timings)
+
+
+def main():
+    history = generate()
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    print(f"{BATCHES} batches, {history} history rows and {REJECTIONS} rejections over {DAYS} days")
+
+    started = time.perf_counter()
+    days = rebuild_snapshots()
+    print(f"full rebuild      {days} days in {time.perf_counter() - started:6.2f} s")
+
+    changed = new_changes()
+    started = time.perf_counter()
+    events, days = update_snapshots()
+    print(f"incremental       {events} events ({changed} stage closes), {days} days in {time.perf_counter() - started:6.2f} s")
+
+    user = User.objects.create_user("benchmark", password="benchmark")
+    factory = APIRequestFactory()
+    view = DailyReportViewSet.as_view({"get": "list"})
+    today = timezone.localdate()
+    params = {"from": str(today - timedelta(days=REPORT_DAYS - 1)), "to": str(today)}
+
+    def snapshot_report():
+        request = factory.get("/productions/daily-report/", params)
+        force_authenticate(request, user=user)
+        response = view(request)
+        assert response.status_code == 200, response.data
+
+    end = timezone.now()
+    start = end - timedelta(days=REPORT_DAYS)
+    print(f"{REPORT_DAYS} day report  snapshots median {median_ms(snapshot_report):8.2f} ms")
+    print(f"{REPORT_DAYS} day report  live      median {median_ms(lambda: live_report(start, end), runs=5):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Size of the stage-carrying tables and indexes, and GROUP BY stage time, on generated data.
+# Run from the project root: python benchmarks/bench_stage_columns.py
+import random
+import time
+
+from _setup import setup_django
+
+setup_django()
+
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from production.models import Batch, BatchQcStageSummary, BatchStageHistory, Planning, Rejection, StageName
+from production.routes import get_route_template
+
+BATCHES = 50000
+STAGE_NAMES = ["Cutting", "Sewing Line Input", "Sewing Line Output", "Quality Control Inline", "Quality Control Final", "Washing", "Finishing", "Packing"]
+REJECTIONS = 200000
+TIMING_RUNS = 5
+
+
+def generate():
+    random.seed(1)
+    stages = [StageName.objects.create(stage=name) for name in STAGE_NAMES]
+    planning = Planning.objects.create(mpo="BENCH", route=get_route_template(STAGE_NAMES), updated_by="benchmark")
+    batches = Batch.objects.bulk_create([
+        Batch(mpo="BENCH", size="M", color="C", planning=planning, status=Batch.STATUS_CLOSED, updated_by="benchmark")
+        for _ in range(BATCHES)
+    ], batch_size=5000)
+    now = timezone.now()
+
+    # Model instances are accepted by both a CharField (stored as the name) and a ForeignKey (stored as the id)
+    BatchStageHistory.objects.bulk_create([
+        BatchStageHistory(batch=batch, stage=stage, sequence=index + 1, entered_at=now, closed_at=now, entered_by="benchmark", closed_by="benchmark")
+        for batch in batches
+        for index, stage in enumerate(stages)
+    ], batch_size=5000)
+    Rejection.objects.bulk_create([
+        Rejection(individual_barcode=f"G{number}", batch=random.choice(batches), stage=random.choice(stages), reason=Rejection.DEFECT_OTHER, rejected_by="benchmark")
+        for number in range(REJECTIONS)
+    ], batch_size=5000)
+    BatchQcStageSummary.objects.bulk_create([
+        BatchQcStageSummary(batch=batch, stage=stage, rejection_count=1)
+        for batch in batches
+        for stage in stages[3:5]
+    ], batch_size=5000)
+
+
+def table_sizes(tables):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name, tbl_name FROM sqlite_master WHERE tbl_name IN (%s)" % ",".join("'%s'" % table for table in tables))
+        owners = dict(cursor.fetchall())
+        cursor.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")
+        sizes = {name: size for name, size in cursor.fetchall() if name in owners}
+
+    for table in tables:
+        data = sizes.get(table, 0)
+        indexes = sum(size for name, size in sizes.items() if owners[name] == table and name != table)
+        yield table, data, indexes
+
+def best_time(function):
+    timings = []
+    for _ in range(TIMING_RUNS):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return 1000 * min(timings)
+
+
+def main():
+    generate()
+
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+
+    print(f"{BATCHES} batches x {len(STAGE_NAMES)} stages of history, {REJECTIONS} rejections")
+    for table, data, indexes in table_sizes([model._meta.db_table for model in (BatchStageHistory, Rejection, BatchQcStageSummary)]):
+        print(f"{table:36} table {data / 1e6:7.2f} MB   indexes {indexes / 1e6:7.2f} MB")
+
+    for model in (BatchStageHistory, Rejection):
+        elapsed = best_time(lambda: list(model.objects.order_by().values("stage").annotate(total=Count("id"))))
+        print(f"GROUP BY stage on {model._meta.db_table:26} {elapsed:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
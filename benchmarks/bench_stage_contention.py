@@ -0,0 +1,117 @@
+# Many scanner threads pushing the same batches through their route at once, through the batch-stage endpoint.
+# Counts what each scan got back and checks the stage history of every batch afterwards.
+# Run from the project root: python benchmarks/bench_stage_contention.py
+import threading
+import time
+from collections import Counter
+
+from _setup import setup_django
+
+setup_django()
+
+from django.db import connection, connections
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from production.models import Batch, BatchStage, BatchStageHistory, Planning, StageName
+from production.routes import get_route_template
+from production.stages import stage_name
+from production.views import BatchStageViewSet
+
+# SQLite lets one writer in at a time, wait for the lock instead of failing with "database is locked"
+connections["default"].settings_dict["OPTIONS"].update({"timeout": 30, "transaction_mode": "IMMEDIATE"})
+
+STAGES = ["Cutting", "Sewing", "QC", "Wash", "Finishing", "Packing"]
+BATCHES = 4
+THREADS = 8
+ROUNDS = 5
+# A batch left in a state that no scan gets out of would keep its scanners busy forever
+MAX_SCANS = 100
+
+
+def setup():
+    for name in STAGES:
+        StageName.objects.create(stage=name)
+    planning = Planning.objects.create(mpo="BENCH", route=get_route_template(STAGES), updated_by="benchmark")
+    return planning, User.objects.create_user("benchmark", password="benchmark")
+
+# The scan a worker at the line would make next for this batch, None when the batch is done
+def next_scan(batch_id):
+    stage = BatchStage.objects.filter(batch_id=batch_id).values("sequence", "current_status", "current_stage_id").first()
+
+    if stage is None:
+        return STAGES[0], BatchStage.STATUS_IN
+    if stage["current_status"] == BatchStage.STATUS_IN:
+        return stage_name(stage["current_stage_id"]), BatchStage.STATUS_CLOSED
+    if stage["sequence"] < len(STAGES):
+        return STAGES[stage["sequence"]], BatchStage.STATUS_IN
+    return None
+
+def scanner(batch_ids, user, outcomes, lock):
+    factory = APIRequestFactory()
+    view = BatchStageViewSet.as_view({"post": "create"})
+    counts = Counter()
+
+    try:
+        while sum(counts.values()) < MAX_SCANS:
+            pending = [(batch_id, scan) for batch_id in batch_ids if (scan := next_scan(batch_id))]
+            if not pending:
+                break
+
+            for batch_id, (stage, stage_status) in pending:
+                request = factory.post("/productions/batch-stages/", {"batch": batch_id, "current_stage": stage, "current_status": stage_status}, format="json")
+                force_authenticate(request, user=user)
+                try:
+                    response = view(request)
+                    counts[response.status_code] += 1
+                except Exception as error:
+                    counts[type(error).__name__] += 1
+    finally:
+        connection.close()
+
+    with lock:
+        outcomes.update(counts)
+
+def check_history(batch_ids):
+    problems = []
+    for batch_id in batch_ids:
+        sequences = list(BatchStageHistory.objects.filter(batch_id=batch_id).order_by("sequence").values_list("sequence", "closed_at"))
+        if [sequence for sequence, _ in sequences] != list(range(1, len(STAGES) + 1)) or any(closed_at is None for _, closed_at in sequences):
+            problems.append(batch_id)
+    return problems
+
+
+def main():
+    planning, user = setup()
+    outcomes = Counter()
+    lock = threading.Lock()
+    broken = []
+    transitions = 0
+
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        batches = Batch.objects.bulk_create([
+            Batch(mpo="BENCH", size="M", color="C", planning=planning, updated_by="benchmark")
+            for _ in range(BATCHES)
+        ])
+        batch_ids = [batch.id for batch in batches]
+        transitions += 2 * len(STAGES) * BATCHES
+
+        threads = [threading.Thread(target=scanner, args=(batch_ids, user, outcomes, lock)) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        broken += check_history(batch_ids)
+    elapsed = time.perf_counter() - started
+
+    print(f"{ROUNDS} rounds of {BATCHES} batches x {len(STAGES)} stages, {THREADS} scanner threads, {elapsed:.1f} s")
+    print(f"transitions needed {transitions}, scans sent {sum(outcomes.values())}")
+    for outcome, count in sorted(outcomes.items(), key=lambda item: str(item[0])):
+        print(f"  {outcome!s:>20}  {count}")
+    print(f"batches with a broken stage history: {len(broken)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Validated stage transitions per second, in memory against the compiled table and end to end through the batch-stage endpoint.
+# Run from the project root: python benchmarks/bench_stage_machine.py
+import random
+import time
+
+from _setup import setup_django
+
+setup_django()
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from production.models import Batch, BatchStage, Planning, StageName
+from production.routes import get_route_template
+from production.stage_machine import STATUSES, StageMachine, get_stage_machine
+from production.views import BatchStageViewSet
+
+STAGES = ["Cutting", "Sewing Line Input", "Sewing Line Output", "Quality Control Inline", "Quality Control Final", "Washing", "Finishing", "Packing"]
+CHECKS = 500000
+BATCHES = 200
+
+
+def in_memory():
+    started = time.perf_counter()
+    machine = StageMachine(tuple(STAGES))
+    compiled = time.perf_counter() - started
+
+    random.seed(1)
+    steps = [(sequence, stage_status) for sequence in range(1, len(STAGES) + 1) for stage_status in STATUSES]
+    pairs = [(random.choice([None] + steps), random.choice(steps)) for _ in range(CHECKS)]
+
+    allowed = 0
+    started = time.perf_counter()
+    for state, requested in pairs:
+        try:
+            machine.check(state, requested)
+            allowed += 1
+        except ValidationError:
+            pass
+    elapsed = time.perf_counter() - started
+
+    print(f"route of {len(STAGES)} stages compiled into {len(machine.transitions)} transitions in {1000 * compiled:.2f} ms")
+    print(f"in memory: {CHECKS} checks ({allowed} allowed) in {elapsed:.2f} s, {CHECKS / elapsed:,.0f} checks/s")
+
+def end_to_end():
+    for name in STAGES:
+        StageName.objects.create(stage=name)
+    planning = Planning.objects.create(mpo="BENCH", route=get_route_template(STAGES), updated_by="benchmark")
+    user = User.objects.create_user("benchmark", password="benchmark")
+    batches = Batch.objects.bulk_create([
+        Batch(mpo="BENCH", size="M", color="C", planning=planning, updated_by="benchmark")
+        for _ in range(BATCHES)
+    ])
+    get_stage_machine(planning.route_id)
+
+    factory = APIRequestFactory()
+    view = BatchStageViewSet.as_view({"post": "create"})
+    results = {"accepted": [0, 0, 0.0], "rejected": [0, 0, 0.0]}
+
+    def scan(batch, stage, stage_status):
+        request = factory.post("/productions/batch-stages/", {"batch": batch.id, "current_stage": stage, "current_status": stage_status}, format="json")
+        force_authenticate(request, user=user)
+
+        # The query log is capped, start every scan from an empty one
+        connection.queries_log.clear()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            response = view(request)
+        elapsed = time.perf_counter() - started
+
+        result = results["accepted" if response.status_code < 300 else "rejected"]
+        result[0] += 1
+        result[1] += len(captured)
+        result[2] += elapsed
+
+    for batch in batches:
+        for stage in STAGES:
+            scan(batch, stage, BatchStage.STATUS_IN)
+            # Scanned twice by mistake, and closed
+            scan(batch, stage, BatchStage.STATUS_IN)
+            scan(batch, stage, BatchStage.STATUS_CLOSED)
+
+    for outcome, (count, queries, elapsed) in results.items():
+        print(f"endpoint {outcome}: {count} scans, {queries / count:.1f} queries per scan, {count / elapsed:,.0f} scans/s")
+
+
+def main():
+    in_memory()
+    end_to_end()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Times the per-stage queue endpoint on generated batches spread over several routes, and prints its query plan.
+# Run from the project root: python benchmarks/bench_stage_queue.py
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from _setup import setup_django
+
+setup_django()
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from production.models import Batch, BatchStage, Planning, StageName
+from production.routes import get_route_template
+from production.views import StageQueueViewSet
+
+STAGE_NAMES = ["Cutting", "Sewing", "QC", "Wash", "Finishing", "Packing"]
+ROUTES = [
+    ["Cutting", "Sewing", "QC", "Wash", "Finishing", "Packing"],
+    ["Cutting", "Sewing", "QC", "Finishing", "Packing"],
+    ["Cutting", "Sewing", "Wash", "QC", "Packing"],
+]
+PLANNINGS = 300
+BATCHES = 60000
+# Share of the batches that finished their route, the rest are somewhere along it
+FINISHED = 0.8
+RUNS = 50
+
+
+def generate():
+    random.seed(1)
+    stages = {name: StageName.objects.create(stage=name) for name in STAGE_NAMES}
+    templates = [get_route_template(route) for route in ROUTES]
+    plannings = Planning.objects.bulk_create([
+        Planning(mpo=f"MPO{number}", route=templates[number % len(templates)], updated_by="benchmark")
+        for number in range(PLANNINGS)
+    ])
+    routes = {template.id: route for template, route in zip(templates, ROUTES)}
+
+    batches = Batch.objects.bulk_create([
+        Batch(mpo=planning.mpo, size="M", color="C", planning=planning, updated_by="benchmark")
+        for planning in random.choices(plannings, k=BATCHES)
+    ], batch_size=5000)
+
+    now = timezone.now()
+    batch_stages = []
+    for batch in batches:
+        route = routes[batch.planning.route_id]
+        if random.random() < FINISHED:
+            sequence, stage_status = len(route), BatchStage.STATUS_CLOSED
+        else:
+            sequence, stage_status = random.randint(1, len(route)), random.choice([BatchStage.STATUS_IN, BatchStage.STATUS_CLOSED])
+        batch_stages.append(BatchStage(
+            batch=batch, current_stage=stages[route[sequence - 1]], sequence=sequence, current_status=stage_status,
+            updated_at=now - timedelta(minutes=random.randint(0, 60 * 24 * 90)),
+        ))
+    # bulk_create keeps the given updated_at, auto_now only applies on save()
+    BatchStage.objects.bulk_create(batch_stages, batch_size=5000)
+
+
+def main():
+    generate()
+    user = User.objects.create_user("benchmark", password="benchmark")
+    factory = APIRequestFactory()
+    view = StageQueueViewSet.as_view({"get": "list"})
+
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+    print(f"{BATCHES} batches over {PLANNINGS} plannings and {len(ROUTES)} routes, {int(FINISHED * 100)}% finished")
+    for stage in ["Sewing", "Wash", "Packing"]:
+        timings = []
+        for _ in range(RUNS):
+            request = factory.get("/productions/stage-queues/", {"stage": stage})
+            force_authenticate(request, user=user)
+
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as captured:
+                response = view(request)
+                response.render()
+            timings.append(1000 * (time.perf_counter() - started))
+
+        assert response.status_code == 200, response.content
+        print(f"{stage:10} {response.data['count']:6} waiting   {len(captured)} queries   median {statistics.median(timings):7.2f} ms")
+
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + captured[-1]["sql"])
+        print("plan of the page query:")
+        for row in cursor.fetchall():
+            print("   ", row[-1])
+
+
+if __name__ == "__main__":
+    main()
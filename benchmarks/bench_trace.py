@@ -0,0 +1,113 @@
+# Times the garment/bundle/batch trace endpoint against a throwaway database with production-sized tables.
+# Run from the project root: python benchmarks/bench_trace.py
+import random
+import statistics
+import time
+
+from _setup import setup_django
+
+setup_django()
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from production.models import Batch, BatchBalance, BatchBundle, BatchStage, BatchStageHistory, Planning, ReceivedBundle, Rejection, StageName
+from production.routes import get_route_template
+from production.views import TraceViewSet
+
+BATCHES = 50000
+BUNDLES_PER_BATCH = 4
+REJECTIONS = 20000
+STAGES = ["Sewing", "QC", "Wash"]
+SAMPLES = 300
+
+
+def bundle_barcode(number):
+    return f"8220{number:012d}001"
+
+def generate():
+    random.seed(1)
+    stages = [StageName.objects.create(stage=name) for name in STAGES]
+    planning = Planning.objects.create(mpo="BENCH", route=get_route_template(STAGES), updated_by="benchmark")
+    now = timezone.now()
+
+    ReceivedBundle.objects.bulk_create([
+        ReceivedBundle(
+            so="SO", mpo="BENCH", buyer="B", style="ST", marker="M", bundle_no=number,
+            bundle_barcode=bundle_barcode(number), size="M", shade="A", color="C", quantity=20,
+            status=ReceivedBundle.STATUS_ALLOCATED,
+        )
+        for number in range(BATCHES * BUNDLES_PER_BATCH)
+    ], batch_size=5000)
+    bundle_ids = list(ReceivedBundle.objects.order_by("id").values_list("id", flat=True))
+
+    batches = Batch.objects.bulk_create([
+        Batch(mpo="BENCH", size="M", color="C", planning=planning, status=Batch.STATUS_CLOSED, updated_by="benchmark")
+        for _ in range(BATCHES)
+    ], batch_size=5000)
+
+    BatchBundle.objects.bulk_create([
+        BatchBundle(batch=batch, received_id=bundle_ids[index * BUNDLES_PER_BATCH + offset])
+        for index, batch in enumerate(batches)
+        for offset in range(BUNDLES_PER_BATCH)
+    ], batch_size=5000)
+    BatchBalance.objects.bulk_create([
+        BatchBalance(batch=batch, produced_quantity=80, available_quantity=80)
+        for batch in batches
+    ], batch_size=5000)
+    BatchStage.objects.bulk_create([
+        BatchStage(batch=batch, current_stage=stages[-1], sequence=len(stages), current_status=BatchStage.STATUS_CLOSED)
+        for batch in batches
+    ], batch_size=5000)
+    BatchStageHistory.objects.bulk_create([
+        BatchStageHistory(batch=batch, stage=stage, sequence=index + 1, entered_at=now, closed_at=now, entered_by="benchmark", closed_by="benchmark")
+        for batch in batches
+        for index, stage in enumerate(stages)
+    ], batch_size=5000)
+
+    rejected = random.sample(range(BATCHES * BUNDLES_PER_BATCH), REJECTIONS)
+    Rejection.objects.bulk_create([
+        Rejection(
+            individual_barcode=f"{number:012d}0001", batch=batches[number // BUNDLES_PER_BATCH],
+            stage=stages[1], reason=Rejection.DEFECT_OTHER, rejected_by="benchmark",
+        )
+        for number in rejected
+    ], batch_size=5000)
+
+    return rejected
+
+
+def main():
+    rejected = generate()
+    user = User.objects.create_user("benchmark", password="benchmark")
+    factory = APIRequestFactory()
+    view = TraceViewSet.as_view({"get": "list"})
+
+    garments = [f"{number:012d}0001" for number in random.sample(rejected, SAMPLES)]
+    timings = []
+    queries = set()
+
+    for garment in garments:
+        request = factory.get("/productions/trace/", {"garment": garment})
+        force_authenticate(request, user=user)
+
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            response = view(request)
+            response.render()
+        timings.append(1000 * (time.perf_counter() - started))
+        queries.add(len(captured))
+
+        assert response.status_code == 200, response.content
+
+    timings.sort()
+    print(f"{BATCHES} batches, {BATCHES * BUNDLES_PER_BATCH} bundles, {REJECTIONS} rejections, {SAMPLES} garment traces")
+    print(f"queries per trace {sorted(queries)}")
+    print(f"median {statistics.median(timings):6.2f} ms   p95 {timings[int(len(timings) * 0.95)]:6.2f} ms   max {timings[-1]:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
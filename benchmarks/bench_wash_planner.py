@@ -0,0 +1,77 @@
+# Times the wash-load planner on generated data: candidate queries on a throwaway database and the bin packing itself.
+# Run from the project root: python benchmarks/bench_wash_planner.py
+import random
+import time
+
+from _setup import setup_django
+
+setup_django()
+
+from production.models import Batch, BatchBalance, BatchBundle, Planning, ReceivedBundle, StageName
+from production.routes import get_route_template
+from wet_process import planner
+
+BATCHES = 5000
+BUNDLES_PER_BATCH = 4
+LOOSE_BUNDLES = 20000
+SHADES = [f"S{number}" for number in range(40)]
+CAPACITIES = [1200, 1200, 800, 800, 600, 400] * 5
+
+
+def generate():
+    random.seed(1)
+    StageName.objects.create(stage="Sewing")
+    planning = Planning.objects.create(mpo="BENCH", route=get_route_template(["Sewing"]), updated_by="benchmark")
+    bundles = [
+        ReceivedBundle(
+            so="SO", mpo="BENCH", buyer="B", style="ST", marker=f"M{number // 1000}", bundle_no=number,
+            bundle_barcode=f"B{number}", size="M", shade=random.choice(SHADES), color="C",
+            quantity=random.randint(10, 40),
+        )
+        for number in range(BATCHES * BUNDLES_PER_BATCH + LOOSE_BUNDLES)
+    ]
+    batch_bundles = bundles[:BATCHES * BUNDLES_PER_BATCH]
+    for bundle in batch_bundles:
+        bundle.status = ReceivedBundle.STATUS_ALLOCATED
+    ReceivedBundle.objects.bulk_create(bundles, batch_size=2000)
+
+    batches = Batch.objects.bulk_create([
+        Batch(mpo="BENCH", size="M", color="C", planning=planning, status=Batch.STATUS_CLOSED, updated_by="benchmark")
+        for _ in range(BATCHES)
+    ], batch_size=2000)
+
+    # Keep the bundles of a batch on the same shade
+    links = []
+    for index, batch in enumerate(batches):
+        shade = random.choice(SHADES)
+        for bundle in batch_bundles[index * BUNDLES_PER_BATCH:(index + 1) * BUNDLES_PER_BATCH]:
+            bundle.shade = shade
+            links.append(BatchBundle(batch=batch, received=bundle))
+    ReceivedBundle.objects.bulk_update(batch_bundles, ["shade"], batch_size=2000)
+    BatchBundle.objects.bulk_create(links, batch_size=2000)
+
+    balances = []
+    for index, batch in enumerate(batches):
+        produced = sum(bundle.quantity for bundle in batch_bundles[index * BUNDLES_PER_BATCH:(index + 1) * BUNDLES_PER_BATCH])
+        balances.append(BatchBalance(batch=batch, produced_quantity=produced, available_quantity=produced))
+    BatchBalance.objects.bulk_create(balances, batch_size=2000)
+
+
+def main():
+    generate()
+
+    started = time.perf_counter()
+    batch_candidates = planner.get_batch_candidates()
+    bundle_candidates = planner.get_bundle_candidates()
+    loaded = time.perf_counter()
+    result = planner.plan_loads(CAPACITIES, batch_candidates, bundle_candidates)
+    planned = time.perf_counter()
+
+    print(f"{len(batch_candidates)} batch candidates, {len(bundle_candidates)} bundle candidates, {len(CAPACITIES)} machines")
+    print(f"candidate queries {1000 * (loaded - started):8.1f} ms")
+    print(f"bin packing       {1000 * (planned - loaded):8.1f} ms")
+    print(f"{len(result['loads'])} loads, fill {sum(load['total_quantity'] for load in result['loads']) / sum(CAPACITIES):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -45,7 +45,8 @@ INSTALLED_APPS = [
     'djoser',
     "accounts",
     "production",
-    "wet_process"
+    "wet_process",
+    "jobs",
 ]
 
 MIDDLEWARE = [
@@ -130,8 +131,80 @@ AUTH_USER_MODEL = "accounts.User"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "accounts.authentication.StatelessJWTAuthentication",
     ),
+    "DEFAULT_PERMISSION_CLASSES": (
+        "accounts.permissions.RoleActionPermission",
+    ),
+}
+
+# Which roles (group names, sent in the JWT "roles" claim) may run which viewset action.
+# Keys are router basenames, "read" covers every GET action without its own rule and "*" means any logged in user.
+# Viewsets that are not listed here are not restricted.
+ROLE_ACTION_PERMISSIONS = {
+    "stage-name": {
+        "read": ["*"],
+    },
+    "planning": {
+        "read": ["*"],
+        "create,partial_update,bulk_import": ["admin", "planner"],
+    },
+    "received-bundles": {
+        "read": ["*"],
+        "create,destroy": ["admin", "store"],
+    },
+    "batch": {
+        "read": ["*"],
+        "create,destroy,dissolve": ["admin", "planner", "production"],
+    },
+    "batch-stage": {
+        "read": ["*"],
+        "create": ["admin", "production", "qc", "wet_process"],
+    },
+    "stage-queue": {
+        "read": ["*"],
+    },
+    "batch-stage-history": {
+        "read": ["*"],
+    },
+    "rejection": {
+        "read": ["*"],
+        "create,partial_update,destroy": ["admin", "qc"],
+    },
+    "qc-stage-summary": {
+        "read": ["*"],
+    },
+    "batch-balance": {
+        "read": ["*"],
+    },
+    "change": {
+        "read": ["*"],
+    },
+    "export": {
+        "read": ["admin", "planner"],
+    },
+    "archived-batch": {
+        "read": ["*"],
+    },
+    "trace": {
+        "read": ["*"],
+    },
+    "autocomplete": {
+        "read": ["*"],
+    },
+    "first-wash-batch": {
+        "read": ["*"],
+        "create,update,partial_update,destroy": ["admin", "wet_process"],
+        "plan": ["admin", "planner", "wet_process"],
+    },
+    "daily-report": {
+        "read": ["admin", "planner"],
+    },
+    # Who may enqueue which job is decided by the roles of its register() call
+    "job": {
+        "read": ["*"],
+        "create": ["*"],
+    },
 }
 
 # DJOSER = {
@@ -150,11 +223,50 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
     "AUTH_HEADER_TYPES": ("JWT",),
     "TOKEN_OBTAIN_SERIALIZER": "accounts.serializers.TokenObtainPairSerializer",
+    # Reads the roles again, a changed role reaches the API after at most ACCESS_TOKEN_LIFETIME
+    "TOKEN_REFRESH_SERIALIZER": "accounts.serializers.TokenRefreshSerializer",
 }
 
+# How long StatelessJWTAuthentication trusts its cached "is this user still active" answer. Saving a user clears
+# the answer only in the cache of the worker that saved it, with the default per-process LocMem cache the other
+# workers keep it until it expires. Configure a shared cache (Redis, database) in CACHES to make it immediate.
+JWT_REVOCATION_CACHE_SECONDS = 60
+
 # Cookie configuration 
 JWT_REFRESH_COOKIE_NAME = "refresh_token"
 JWT_COOKIE_SECURE = False      # True in production (HTTPS). False for local HTTP.
 JWT_COOKIE_SAMESITE = "Lax"    # or "Strict" / "None" (None requires Secure)
 JWT_COOKIE_HTTPONLY = True
 JWT_COOKIE_PATH = "/auth/jwt/"  # Adding the path means, browser will automatically sent the cookie only to this endpoint which saves us from sending the cookie to every endpoint automatically, tightens the security
+
+# Change events (productions/changes/) older than this are removed by `manage.py prune_change_events`
+CHANGE_EVENT_RETENTION_DAYS = 30
+
+# How long the response of a POST sent with an Idempotency-Key header is kept for replaying retries
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+# A key still in progress after this long is taken over by a retry. Keep it far above the request timeout of the
+# web server, a request that is only slow is rolled back when its key was taken over.
+IDEMPOTENCY_STALE_AFTER = timedelta(minutes=15)
+
+# Batches closed longer ago than this are moved to the archive tables by `manage.py archive_closed_batches`
+ARCHIVE_CLOSED_BATCHES_AFTER_DAYS = 180
+
+# Background jobs run by `manage.py run_jobs`: seconds between looks at an empty queue, the retry delay after the
+# first failed attempt (doubled for every further one, up to the max) and how long a running job may go without
+# a heartbeat before it is given to another worker
+JOB_POLL_SECONDS = 2
+JOB_RETRY_BACKOFF_SECONDS = 30
+JOB_RETRY_BACKOFF_MAX_SECONDS = 3600
+JOB_STALE_SECONDS = 600
+
+# Where the files written by jobs (background exports) are kept
+JOB_FILES_DIR = BASE_DIR / "job_files"
+
+# Shifts of the daily production report, name -> local start time. A shift runs until the next one starts and the
+# production day begins with the earliest, so a night shift running past midnight counts for the day it started.
+PRODUCTION_SHIFTS = {
+    "A": "06:00",
+    "B": "14:00",
+    "C": "22:00",
+}
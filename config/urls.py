@@ -19,8 +19,8 @@ from django.urls import path, include
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("auth/", include("djoser.urls")),
     path("", include("accounts.urls")),
     path("productions/",include("production.urls")),
     path("wet-process/",include("wet_process.urls")),
+    path("jobs/",include("jobs.urls")),
 ]
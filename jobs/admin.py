@@ -0,0 +1,10 @@
+from django.contrib import admin
+from production.admin import ScalableAdmin
+from . import models
+
+
+@admin.register(models.Job)
+class JobAdmin(ScalableAdmin):
+    list_display = ["id","name","status","attempts","progress_done","progress_total","run_after","created_by","created_at","finished_at"]
+    list_filter = ["status"]
+    search_fields = ["created_by__exact"]
@@ -0,0 +1,82 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.worker import Worker
+
+
+# Entry point of a worker process. With the spawn start method (macOS, Windows) Django has to be set up again.
+def run_process(threads, poll_seconds, burst, stop):
+    import django
+    django.setup()
+
+    # Ctrl-C reaches the whole process group, the parent decides when the children stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    Worker(threads=threads, poll_seconds=poll_seconds, burst=burst, stop=stop).run()
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs until stopped (SIGINT/SIGTERM let the running jobs finish first)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=1,
+            help="Jobs run at the same time by each process.",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Worker processes, each with --threads threads. Use more processes for CPU heavy jobs.",
+        )
+        parser.add_argument(
+            "--poll-seconds",
+            type=float,
+            default=None,
+            help="Wait between looks at the queue when nothing is due, settings.JOB_POLL_SECONDS by default.",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once no job is due instead of waiting for more.",
+        )
+
+    def handle(self, *args, **options):
+        threads = max(1, options["threads"])
+        processes = max(1, options["processes"])
+
+        if processes == 1:
+            worker = Worker(threads=threads, poll_seconds=options["poll_seconds"], burst=options["burst"])
+            self.stop_on_signal(worker.stop)
+            self.stdout.write(f"Worker {worker.name} running {threads} thread(s).")
+            worker.run()
+            return
+
+        context = multiprocessing.get_context()
+        stop = context.Event()
+        self.stop_on_signal(stop)
+
+        # Forked children must not share the parent's database connection
+        connections.close_all()
+        children = [
+            context.Process(target=run_process, args=(threads, options["poll_seconds"], options["burst"], stop))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        self.stdout.write(f"Started {processes} worker process(es) running {threads} thread(s) each.")
+
+        for child in children:
+            child.join()
+
+    def stop_on_signal(self, stop):
+        def handler(signum, frame):
+            self.stdout.write("Stopping after the running jobs.")
+            stop.set()
+
+        signal.signal(signal.SIGINT, handler)
+        signal.signal(signal.SIGTERM, handler)
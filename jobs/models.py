@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.utils import timezone
+
+
+# Files written by jobs (exports), kept out of the web root and handed out by the download action
+def job_file_storage():
+    return FileSystemStorage(location=settings.JOB_FILES_DIR)
+
+
+# A unit of background work, picked up by `manage.py run_jobs`. name is a key of jobs.registry.JOBS.
+class Job(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCEEDED, "Succeeded"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    name = models.CharField(max_length=100)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # Not picked up before this, pushed back after a failed attempt
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(null=True, blank=True)
+    progress_message = models.CharField(max_length=255, blank=True)
+
+    result = models.JSONField(null=True, blank=True)
+    file = models.FileField(upload_to="%Y/%m/%d", storage=job_file_storage, blank=True)
+    error = models.TextField(blank=True)
+
+    # The worker running the job and its last sign of life, a running job that stops beating is given to another worker
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    created_by = models.CharField(max_length=100)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker looks for queued jobs that are due
+            models.Index(fields=["status", "run_after"]),
+            models.Index(fields=["created_by", "created_at"]),
+            models.Index(fields=["created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.id} - {self.name} - {self.status}"
+
+    # Called by the job function, also counts as a heartbeat
+    def report(self, done, total=None, message=""):
+        self.progress_done = done
+        self.progress_total = total
+        self.progress_message = message[:255]
+        Job.objects.filter(id=self.id).update(
+            progress_done=done,
+            progress_total=total,
+            progress_message=self.progress_message,
+            heartbeat_at=timezone.now(),
+        )
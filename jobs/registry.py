@@ -0,0 +1,41 @@
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+from accounts.permissions import ANY_ROLE
+
+from .models import Job
+
+# name -> {"function": function(job, params) returning the JSON result, "roles": who may enqueue it from the API,
+#          "max_attempts": tries before it is failed, "validate": function(params) raising ValidationError, or None}
+JOBS = {}
+
+
+# Registers a background job, use it in the jobs.py of an app
+def register(name, roles=("admin",), max_attempts=3, validate=None):
+    def decorator(function):
+        JOBS[name] = {
+            "function": function,
+            "roles": frozenset(roles),
+            "max_attempts": max_attempts,
+            "validate": validate,
+        }
+        return function
+    return decorator
+
+# Checks the job and its params now, so a bad request is answered with a 400 instead of a failed job later
+def enqueue(name, params, user, roles=None, run_after=None):
+    definition = JOBS.get(name)
+    if definition is None:
+        raise ValidationError(f"Unknown job {name}. Choose one of {', '.join(sorted(JOBS))}.")
+
+    # roles is None for jobs enqueued by the code itself
+    if roles is not None and ANY_ROLE not in definition["roles"] and definition["roles"].isdisjoint(roles):
+        raise PermissionDenied(f"Your role is not allowed to run {name} jobs.")
+
+    if definition["validate"]:
+        definition["validate"](params)
+
+    job = Job(name=name, params=params, max_attempts=definition["max_attempts"], created_by=user)
+    if run_after:
+        job.run_after = run_after
+    job.save()
+    return job
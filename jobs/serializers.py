@@ -0,0 +1,33 @@
+from rest_framework import serializers
+
+from .models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField(method_name="get_progress", read_only=True)
+    download = serializers.SerializerMethodField(method_name="get_download", read_only=True)
+
+    class Meta:
+        model = Job
+        fields = ["id","name","params","status","run_after","attempts","max_attempts","progress","progress_done","progress_total","progress_message","result","download","error","created_at","created_by","started_at","finished_at"]
+        read_only_fields = ["status","attempts","max_attempts","progress_done","progress_total","progress_message","result","error","created_at","created_by","started_at","finished_at"]
+
+    # Percentage when the job knows how much work there is
+    def get_progress(self, job):
+        if job.status == Job.STATUS_SUCCEEDED:
+            return 100
+        if not job.progress_total:
+            return None
+        return min(100, int(100 * job.progress_done / job.progress_total))
+
+    def get_download(self, job):
+        if not job.file:
+            return None
+        request = self.context.get("request")
+        path = f"/jobs/jobs/{job.id}/download/"
+        return request.build_absolute_uri(path) if request else path
+
+    def validate_params(self, params):
+        if not isinstance(params, dict):
+            raise serializers.ValidationError("params must be an object.")
+        return params
@@ -0,0 +1,111 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .registry import JOBS, enqueue, register
+from .worker import claim_job, requeue_stale_jobs, retry_delay, run_job
+
+
+class ClaimTests(TestCase):
+    def test_job_is_claimed_once(self):
+        job = Job.objects.create(name="test", created_by="test")
+
+        first = claim_job("worker-1")
+        second = claim_job("worker-2")
+
+        self.assertEqual(first.id, job.id)
+        self.assertEqual((first.status, first.worker, first.attempts), (Job.STATUS_RUNNING, "worker-1", 1))
+        self.assertIsNone(second)
+
+    # Another worker takes the first candidate between the candidate query and the claim
+    def test_candidate_taken_by_another_worker_is_skipped(self):
+        taken = Job.objects.create(name="test", created_by="test")
+        other = Job.objects.create(name="test", created_by="test")
+        update = QuerySet.update
+
+        def other_worker_first(queryset, **changes):
+            if not Job.objects.filter(worker="worker-2").exists():
+                update(Job.objects.filter(id=taken.id), status=Job.STATUS_RUNNING, worker="worker-2")
+            return update(queryset, **changes)
+
+        with mock.patch.object(QuerySet, "update", autospec=True, side_effect=other_worker_first):
+            job = claim_job("worker-1")
+
+        self.assertEqual(job.id, other.id)
+        taken.refresh_from_db()
+        self.assertEqual((taken.worker, taken.attempts), ("worker-2", 0))
+
+    def test_job_is_not_claimed_before_run_after(self):
+        Job.objects.create(name="test", created_by="test", run_after=timezone.now() + timedelta(minutes=1))
+
+        self.assertIsNone(claim_job("worker-1"))
+
+
+@override_settings(JOB_RETRY_BACKOFF_SECONDS=30, JOB_RETRY_BACKOFF_MAX_SECONDS=100)
+class RetryTests(TestCase):
+    def setUp(self):
+        @register("test-failing", max_attempts=2)
+        def failing(job, params):
+            raise RuntimeError("boom")
+
+        self.addCleanup(JOBS.pop, "test-failing")
+
+    def test_retry_delay_doubles_up_to_the_maximum(self):
+        self.assertEqual([retry_delay(attempts).total_seconds() for attempts in (1, 2, 3, 4)], [30, 60, 100, 100])
+
+    def test_failed_job_is_retried_then_failed(self):
+        enqueue("test-failing", {}, "test")
+
+        job = claim_job("worker-1")
+        with self.assertLogs("jobs.worker", "ERROR"):
+            run_job(job)
+        job.refresh_from_db()
+
+        self.assertEqual((job.status, job.worker), (Job.STATUS_QUEUED, ""))
+        self.assertIn("boom", job.error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=25))
+
+        Job.objects.update(run_after=timezone.now())
+        with self.assertLogs("jobs.worker", "ERROR"):
+            run_job(claim_job("worker-1"))
+        job.refresh_from_db()
+
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+
+@override_settings(JOB_STALE_SECONDS=60)
+class StaleJobTests(TestCase):
+    def running(self, heartbeat_age, attempts=1):
+        return Job.objects.create(
+            name="test", created_by="test", status=Job.STATUS_RUNNING, worker="worker-1",
+            attempts=attempts, max_attempts=3, heartbeat_at=timezone.now() - heartbeat_age,
+        )
+
+    def test_stale_job_is_queued_again(self):
+        job = self.running(timedelta(seconds=61))
+
+        requeue_stale_jobs()
+        job.refresh_from_db()
+
+        self.assertEqual((job.status, job.worker), (Job.STATUS_QUEUED, ""))
+
+    def test_stale_job_without_attempts_left_fails(self):
+        job = self.running(timedelta(seconds=61), attempts=3)
+
+        requeue_stale_jobs()
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+
+    def test_beating_job_keeps_running(self):
+        job = self.running(timedelta(seconds=30))
+
+        requeue_stale_jobs()
+        job.refresh_from_db()
+
+        self.assertEqual((job.status, job.worker), (Job.STATUS_RUNNING, "worker-1"))
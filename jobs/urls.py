@@ -0,0 +1,10 @@
+from django.urls import path,include
+from rest_framework_nested.routers import DefaultRouter
+from . import views
+
+router = DefaultRouter()
+router.register("jobs", views.JobViewSet, basename="job")
+
+urlpatterns = [
+    path("",include(router.urls))
+]
@@ -0,0 +1,71 @@
+from django.http import FileResponse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet
+
+from accounts.permissions import get_roles
+from production.pagination import DefaultPagination
+from production.serializers import get_user_name
+
+from .models import Job
+from .registry import JOBS, enqueue
+from .serializers import JobSerializer
+
+
+# Enqueue a background job with POST {"name": ..., "params": {...}} and poll GET /jobs/<id>/ until it has
+# succeeded or failed. Users see their own jobs, admins see every job.
+class JobViewSet(ModelViewSet):
+    http_method_names = ["get", "post"]
+    serializer_class = JobSerializer
+    pagination_class = DefaultPagination
+
+    def get_queryset(self):
+        queryset = Job.objects.all()
+
+        if "admin" not in get_roles(self.request):
+            queryset = queryset.filter(created_by=get_user_name(self.request))
+
+        if self.action == "list":
+            # ?status=&name=
+            job_status = self.request.query_params.get("status")
+            name = self.request.query_params.get("name")
+
+            if job_status:
+                if job_status not in dict(Job.STATUS_CHOICES):
+                    raise ValidationError(f"status must be one of {', '.join(dict(Job.STATUS_CHOICES))}.")
+                queryset = queryset.filter(status=job_status)
+            if name:
+                queryset = queryset.filter(name=name)
+
+        return queryset.order_by("-created_at", "-id")
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        job = enqueue(
+            serializer.validated_data["name"],
+            serializer.validated_data.get("params", {}),
+            get_user_name(request),
+            roles=get_roles(request),
+            run_after=serializer.validated_data.get("run_after"),
+        )
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    # The jobs that can be enqueued
+    @action(detail=False, methods=["get"])
+    def types(self, request):
+        return Response([
+            {"name": name, "roles": sorted(definition["roles"]), "max_attempts": definition["max_attempts"]}
+            for name, definition in sorted(JOBS.items())
+        ])
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if not job.file:
+            raise NotFound("This job has no file to download.")
+
+        return FileResponse(job.file.open("rb"), as_attachment=True, filename=job.file.name.rsplit("/", 1)[-1])
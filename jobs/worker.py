@@ -0,0 +1,156 @@
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .registry import JOBS
+
+logger = logging.getLogger(__name__)
+
+# Queued jobs looked at per claim, another worker may take some of them first
+CLAIM_CANDIDATES = 10
+
+
+# Delay before the next try of a job that failed for the n-th time, doubled every time
+def retry_delay(attempts):
+    return timedelta(seconds=min(settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), settings.JOB_RETRY_BACKOFF_MAX_SECONDS))
+
+# Running jobs whose worker stopped beating are queued again, or failed when they have no tries left
+def requeue_stale_jobs():
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING, heartbeat_at__lt=now - timedelta(seconds=settings.JOB_STALE_SECONDS))
+
+    stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.STATUS_FAILED, error="The worker running this job stopped.", finished_at=now,
+    )
+    stale.update(status=Job.STATUS_QUEUED, worker="", run_after=now)
+
+# Takes the oldest due job. The status check in the UPDATE makes sure only one worker gets it, without row locks,
+# so it works the same on every database.
+def claim_job(worker):
+    now = timezone.now()
+    candidates = list(
+        Job.objects.filter(status=Job.STATUS_QUEUED, run_after__lte=now)
+        .order_by("run_after", "id")
+        .values_list("id", flat=True)[:CLAIM_CANDIDATES]
+    )
+
+    for job_id in candidates:
+        claimed = Job.objects.filter(id=job_id, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING,
+            worker=worker,
+            attempts=F("attempts") + 1,
+            started_at=now,
+            heartbeat_at=now,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+
+    return None
+
+def run_job(job):
+    definition = JOBS.get(job.name)
+
+    try:
+        if definition is None:
+            raise LookupError(f"No job is registered as {job.name}.")
+        result = definition["function"](job, job.params)
+
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Job %s (%s) failed on attempt %s", job.id, job.name, job.attempts)
+
+        # The failed job may have left the connection in a broken transaction
+        close_old_connections()
+
+        job.error = error
+        if definition is not None and job.attempts < job.max_attempts:
+            job.status = Job.STATUS_QUEUED
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+            job.worker = ""
+        else:
+            job.status = Job.STATUS_FAILED
+            job.finished_at = timezone.now()
+
+        job.save(update_fields=["status", "run_after", "worker", "error", "finished_at"])
+        return
+
+    job.status = Job.STATUS_SUCCEEDED
+    job.result = result
+    job.error = ""
+    job.finished_at = timezone.now()
+    if job.progress_total is not None:
+        job.progress_done = job.progress_total
+    job.save(update_fields=["status", "result", "file", "error", "finished_at", "progress_done"])
+
+
+# Runs jobs on a number of threads of this process until stop is set. With burst it returns once nothing is due.
+class Worker:
+    def __init__(self, threads=1, poll_seconds=None, burst=False, stop=None):
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.threads = threads
+        self.poll_seconds = settings.JOB_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.burst = burst
+        self.stop = stop or threading.Event()
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def work(self, thread_name):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                requeue_stale_jobs()
+                job = claim_job(thread_name)
+
+                if job is None:
+                    if self.burst:
+                        return
+                    self.stop.wait(self.poll_seconds)
+                    continue
+
+                with self.lock:
+                    self.running.add(job.id)
+                try:
+                    logger.info("Job %s (%s) started by %s", job.id, job.name, thread_name)
+                    run_job(job)
+                finally:
+                    with self.lock:
+                        self.running.discard(job.id)
+        finally:
+            connection.close()
+
+    # Keeps the heartbeat of the jobs of this process fresh, however long a single step of a job takes
+    def beat(self, done):
+        try:
+            while not done.wait(settings.JOB_STALE_SECONDS / 3):
+                with self.lock:
+                    running = list(self.running)
+                if running:
+                    Job.objects.filter(id__in=running, status=Job.STATUS_RUNNING).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+    def run(self):
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self.beat, args=(done,), daemon=True)
+        heartbeat.start()
+
+        threads = [
+            threading.Thread(target=self.work, args=(f"{self.name}/{number}",))
+            for number in range(1, self.threads + 1)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        done.set()
+        heartbeat.join()
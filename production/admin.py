@@ -1,45 +1,158 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from . import models
+from .filters import index_leading_columns
 # Register your models here.
 
+# Rows counted at most for the page links of a filtered changelist
+ADMIN_COUNT_LIMIT = 10000
+
+
+# Counting millions of rows takes longer than showing the page. An unfiltered list on PostgreSQL takes the row count
+# from the planner statistics, anything else is counted up to ADMIN_COUNT_LIMIT rows: the page links stop there and
+# the rows after it are reached by searching or filtering.
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = queryset.query
+
+        if not query.where and connections[queryset.db].vendor == "postgresql":
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            # -1 or a small number when the table was never analyzed, then a real count is cheap enough
+            if row and row[0] > ADMIN_COUNT_LIMIT:
+                return row[0]
+
+        return queryset[:ADMIN_COUNT_LIMIT].count()
+
+
+# Base of every changelist that can grow large: no full count, newest rows first through the primary key,
+# and sorting only on columns that lead an index so a page never sorts the whole table.
+# Subclasses use raw_id_fields for foreign keys (no select box with every row) and search fields with an explicit
+# __exact lookup on an indexed column. The admin default is icontains, which always scans, and startswith is a
+# case-insensitive LIKE on SQLite that can't use the index either.
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ["-pk"]
+    list_per_page = 50
+
+    def get_sortable_by(self, request):
+        indexed = index_leading_columns(self.model) | {"pk", self.model._meta.pk.name}
+        return [
+            name for name in self.get_list_display(request)
+            if name in indexed or name.removesuffix("_id") in indexed
+        ]
+
+
 @admin.register(models.StageName)
 class StageNameAdmin(admin.ModelAdmin):
     list_display = ["id","stage","last_update"]
 
+@admin.register(models.RouteTemplate)
+class RouteTemplateAdmin(ScalableAdmin):
+    list_display = ["id","content_hash","created_at"]
+    search_fields = ["content_hash__exact"]
+
 @admin.register(models.Planning)
-class PlanningAdmin(admin.ModelAdmin):
-    list_display = ["id","mpo","updated_by","last_update"]
+class PlanningAdmin(ScalableAdmin):
+    list_display = ["id","mpo","route_id","updated_by","last_update"]
+    raw_id_fields = ["route"]
+    search_fields = ["mpo__exact"]
 
 @admin.register(models.PlanningRouteStep)
-class PlanningRouteStepAdmin(admin.ModelAdmin):
-    list_display = ["id","planning","sequence","stage"]
-    ordering = ["planning","sequence","stage"]
-    search_fields = ["planning__mpo"]
-    
+class PlanningRouteStepAdmin(ScalableAdmin):
+    list_display = ["id","route_id","sequence","stage"]
+    list_select_related = ["stage"]
+    raw_id_fields = ["route"]
+    ordering = ["route","sequence"]
+    search_fields = ["route__plannings__mpo__exact"]
+
 @admin.register(models.ReceivedBundle)
-class ReceivedBundleAdmin(admin.ModelAdmin):
-    list_display = ["id","so","mpo","buyer","style","marker","bundle_no","bundle_barcode","size","shade","color","quantity","received_at","received_by","status"]   
-    
+class ReceivedBundleAdmin(ScalableAdmin):
+    list_display = ["id","so","mpo","buyer","style","marker","bundle_no","bundle_barcode","size","shade","color","quantity","received_at","received_by","status"]
+    list_filter = ["status"]
+    search_fields = ["bundle_barcode__exact","mpo__exact"]
+
 @admin.register(models.Batch)
-class BatchAdmin(admin.ModelAdmin):
-    list_display = ["id","mpo","size","color","status","updated_at","updated_by",]     
+class BatchAdmin(ScalableAdmin):
+    list_display = ["id","mpo","size","color","status","updated_at","updated_by",]
+    list_filter = ["status"]
+    raw_id_fields = ["planning"]
+    search_fields = ["id__exact","mpo__exact"]
 
 @admin.register(models.BatchBundle)
-class BatchBundleAdmin(admin.ModelAdmin):
-    list_display = ["id","batch_id","received_id"]    
-    
+class BatchBundleAdmin(ScalableAdmin):
+    list_display = ["id","batch_id","received_id"]
+    raw_id_fields = ["batch","received"]
+    search_fields = ["batch__id__exact","received__bundle_barcode__exact"]
+
 @admin.register(models.BatchStage)
-class BatchStageAdmin(admin.ModelAdmin):
-    list_display = ["batch_id","current_stage","sequence","current_status"]    
-    
+class BatchStageAdmin(ScalableAdmin):
+    list_display = ["batch_id","current_stage","sequence","current_status","version","updated_at"]
+    list_select_related = ["current_stage"]
+    list_filter = ["current_status"]
+    raw_id_fields = ["batch"]
+    search_fields = ["batch__id__exact"]
+
 @admin.register(models.BatchStageHistory)
-class BatchStageHistoryAdmin(admin.ModelAdmin):
-    list_display = ["id","batch_id","stage","sequence","entered_at","closed_at","entered_by","closed_by"] 
-    
+class BatchStageHistoryAdmin(ScalableAdmin):
+    list_display = ["id","batch_id","stage","sequence","entered_at","closed_at","entered_by","closed_by"]
+    list_select_related = ["stage"]
+    raw_id_fields = ["batch"]
+    search_fields = ["batch__id__exact"]
+
 @admin.register(models.Rejection)
-class RejectionAdmin(admin.ModelAdmin):
-    list_display = ["id", "individual_barcode", "batch_id", "stage", "reason", "rejected_at", "rejected_by"]        
-    
+class RejectionAdmin(ScalableAdmin):
+    list_display = ["id", "individual_barcode", "batch_id", "stage", "reason", "rejected_at", "rejected_by"]
+    list_select_related = ["stage"]
+    raw_id_fields = ["batch"]
+    search_fields = ["individual_barcode__exact","batch__id__exact"]
+
+@admin.register(models.BatchBalance)
+class BatchBalanceAdmin(ScalableAdmin):
+    list_display = ["batch_id","produced_quantity","rejected_quantity","washed_quantity","available_quantity","last_update"]
+    raw_id_fields = ["batch"]
+    search_fields = ["batch__id__exact"]
+
 @admin.register(models.BatchQcStageSummary)
-class BatchQcStageSummaryAdmin(admin.ModelAdmin):
-    list_display = ["id","batch_id","stage","rejection_count","last_update"]    
\ No newline at end of file
+class BatchQcStageSummaryAdmin(ScalableAdmin):
+    list_display = ["id","batch_id","stage","rejection_count","last_update"]
+    list_select_related = ["stage"]
+    raw_id_fields = ["batch"]
+    search_fields = ["batch__id__exact"]
+
+@admin.register(models.ChangeEvent)
+class ChangeEventAdmin(ScalableAdmin):
+    list_display = ["seq","entity","entity_id","action","created_at","created_by"]
+    search_fields = ["entity__exact"]
+
+@admin.register(models.IdempotencyKey)
+class IdempotencyKeyAdmin(ScalableAdmin):
+    list_display = ["id","key","user","status","response_status","created_at","expires_at"]
+    search_fields = ["user__exact"]
+
+@admin.register(models.ArchivedBatch)
+class ArchivedBatchAdmin(ScalableAdmin):
+    list_display = ["batch_id","mpo","size","color","closed_at","archived_at"]
+    search_fields = ["batch_id__exact","mpo__exact"]
+
+@admin.register(models.ArchivedBundle)
+class ArchivedBundleAdmin(ScalableAdmin):
+    list_display = ["bundle_id","bundle_barcode","mpo","archived_batch_id"]
+    raw_id_fields = ["archived_batch"]
+    search_fields = ["bundle_barcode__exact"]
+
+@admin.register(models.DailyStageSnapshot)
+class DailyStageSnapshotAdmin(ScalableAdmin):
+    list_display = ["id","day","shift","stage","batches_entered","pieces_entered","batches_closed","pieces_closed","pieces_rejected","updated_at"]
+    list_select_related = ["stage"]
+    search_fields = ["day__exact"]
+
+@admin.register(models.SnapshotWatermark)
+class SnapshotWatermarkAdmin(admin.ModelAdmin):
+    list_display = ["name","seq","updated_at"]
@@ -0,0 +1,114 @@
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from .events import build_event, snapshot
+from .models import ArchivedBatch, ArchivedBundle, Batch, BatchStageHistory, ChangeEvent, ReceivedBundle
+
+# Name written in updated_by/created_by of the rows touched by the archiving command
+ARCHIVE_USER = "archive"
+
+
+# Closed batches whose last stage was closed before the cutoff, oldest first.
+# A subquery instead of Max() so there is no GROUP BY and the rows can be locked.
+def archivable_batches(cutoff):
+    last_closed = (
+        BatchStageHistory.objects.filter(batch=OuterRef("pk"), closed_at__isnull=False)
+        .order_by("-closed_at")
+        .values("closed_at")[:1]
+    )
+    return (
+        Batch.objects.filter(status=Batch.STATUS_CLOSED)
+        .annotate(closed_at=Subquery(last_closed))
+        .filter(closed_at__lt=cutoff)
+        .order_by("id")
+    )
+
+def build_document(batch):
+    stage = getattr(batch, "stage", None)
+    balance = getattr(batch, "balance", None)
+    return {
+        "batch": snapshot(batch),
+        "planning": batch.planning.mpo,
+        "stage": snapshot(stage) if stage else None,
+        "balance": snapshot(balance) if balance else None,
+        "history": [snapshot(history) for history in batch.stage_history.all()],
+        "rejections": [snapshot(rejection) for rejection in batch.rejections.all()],
+        "qc_stage_summaries": [snapshot(summary) for summary in batch.qc_stage_summaries.all()],
+        "bundles": [batch_bundle.received.bundle_barcode for batch_bundle in batch.batch_bundles.all()],
+    }
+
+# The batch and the rows deleted with it that have change events of their own
+def cascaded_rows(batch):
+    stage = getattr(batch, "stage", None)
+    balance = getattr(batch, "balance", None)
+    return (
+        [batch]
+        + ([stage] if stage else [])
+        + list(batch.stage_history.all())
+        + list(batch.rejections.all())
+        + list(batch.qc_stage_summaries.all())
+        + ([balance] if balance else [])
+    )
+
+# Moves one chunk of batches into the archive tables and deletes them with their bundles from the production tables.
+# Every chunk is its own transaction, so an interrupted run loses nothing and the next run picks up where it stopped.
+# Returns (batches, bundles) archived.
+def archive_chunk(cutoff, chunk_size):
+    with transaction.atomic():
+        batches = list(
+            archivable_batches(cutoff)
+            .select_related("planning", "stage", "balance")
+            .prefetch_related("stage_history", "rejections", "qc_stage_summaries", "batch_bundles__received")
+            .select_for_update(of=("self",))[:chunk_size]
+        )
+
+        if not batches:
+            return 0, 0
+
+        archived = ArchivedBatch.objects.bulk_create([
+            ArchivedBatch(
+                batch_id=batch.id,
+                mpo=batch.mpo,
+                size=batch.size,
+                color=batch.color,
+                closed_at=batch.closed_at,
+                document=build_document(batch),
+            )
+            for batch in batches
+        ])
+
+        bundles = [
+            (archived_batch, batch_bundle)
+            for archived_batch, batch in zip(archived, batches)
+            for batch_bundle in batch.batch_bundles.all()
+        ]
+        ArchivedBundle.objects.bulk_create([
+            ArchivedBundle(
+                bundle_id=batch_bundle.received_id,
+                bundle_barcode=batch_bundle.received.bundle_barcode,
+                mpo=batch_bundle.received.mpo,
+                marker=batch_bundle.received.marker,
+                bundle_no=batch_bundle.received.bundle_no,
+                archived_batch=archived_batch,
+                document={**snapshot(batch_bundle.received), "added_at": batch_bundle.added_at},
+            )
+            for (archived_batch, batch_bundle) in bundles
+        ], batch_size=1000)
+
+        # Clients following productions/changes/ drop the rows like any other delete, including the rows that go
+        # with the batches
+        ChangeEvent.objects.bulk_create(
+            [
+                build_event(row, ChangeEvent.ACTION_DELETED, ARCHIVE_USER, archived=True)
+                for batch in batches
+                for row in cascaded_rows(batch)
+            ]
+            + [build_event(batch_bundle.received, ChangeEvent.ACTION_DELETED, ARCHIVE_USER, archived=True) for (_, batch_bundle) in bundles],
+            batch_size=1000,
+        )
+
+        # Batch bundles go with the bundles, the stage, history, rejections, summaries and balance with the batches
+        ReceivedBundle.objects.filter(id__in=[batch_bundle.received_id for (_, batch_bundle) in bundles]).delete()
+        Batch.objects.filter(id__in=[batch.id for batch in batches]).delete()
+
+    return len(batches), len(bundles)
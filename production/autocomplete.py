@@ -0,0 +1,109 @@
+import threading
+import time
+from bisect import bisect_left, insort
+
+from .models import ChangeEvent, Planning, ReceivedBundle
+
+# field name: (model, column) of the values offered by productions/autocomplete/
+SOURCES = {
+    "mpo": (Planning, "mpo"),
+    "so": (ReceivedBundle, "so"),
+    "style": (ReceivedBundle, "style"),
+    "buyer": (ReceivedBundle, "buyer"),
+    "marker": (ReceivedBundle, "marker"),
+}
+
+# New change events are applied at most this often, in between lookups never touch the database
+REFRESH_SECONDS = 2
+
+# Deletes carry no values in their change event, so a full rebuild now and then drops values that are gone
+REBUILD_SECONDS = 600
+
+# More new events than this at once and a rebuild is cheaper than applying them one by one
+MAX_EVENTS = 5000
+
+
+# Sorted distinct values of one column, looked up by case-insensitive prefix with bisect
+class PrefixIndex:
+    def __init__(self, values=()):
+        # (casefolded, value) pairs, one list so an insert is never seen half done by a reader
+        self.items = sorted({(value.casefold(), value) for value in values if value})
+
+    def add(self, value):
+        if not value:
+            return
+        item = (value.casefold(), value)
+        position = bisect_left(self.items, item)
+        if position == len(self.items) or self.items[position] != item:
+            insort(self.items, item, lo=position)
+
+    def search(self, prefix, limit):
+        key = prefix.casefold()
+        items = self.items
+        results = []
+
+        position = bisect_left(items, (key,))
+        while position < len(items) and len(results) < limit and items[position][0].startswith(key):
+            results.append(items[position][1])
+            position += 1
+
+        return results
+
+
+# One per worker process. The version is the seq of the last change event applied, ChangeEvent.seq goes up on every write.
+class AutocompleteIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.seq = 0
+        self.built_at = None
+        self.checked_at = 0
+
+    def rebuild(self):
+        # Read the version first, events recorded while loading get applied again, which add() ignores
+        seq = ChangeEvent.objects.order_by("-seq").values_list("seq", flat=True).first() or 0
+
+        self.indexes = {
+            field: PrefixIndex(model.objects.order_by().values_list(column, flat=True).distinct())
+            for field, (model, column) in SOURCES.items()
+        }
+        self.seq = seq
+        self.built_at = self.checked_at = time.monotonic()
+
+    def apply_changes(self):
+        entities = {model._meta.label_lower for model, _ in SOURCES.values()}
+        events = list(
+            ChangeEvent.objects.filter(seq__gt=self.seq, entity__in=entities)
+            .exclude(action=ChangeEvent.ACTION_DELETED)
+            .order_by("seq")
+            .values_list("seq", "entity", "payload")[:MAX_EVENTS]
+        )
+
+        if len(events) == MAX_EVENTS:
+            self.rebuild()
+            return
+
+        for seq, entity, payload in events:
+            for field, (model, column) in SOURCES.items():
+                if model._meta.label_lower == entity and payload and column in payload:
+                    self.indexes[field].add(payload[column])
+            self.seq = seq
+
+        self.checked_at = time.monotonic()
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.built_at is not None and now - self.checked_at < REFRESH_SECONDS:
+            return
+
+        with self.lock:
+            if self.built_at is None or now - self.built_at >= REBUILD_SECONDS:
+                self.rebuild()
+            elif now - self.checked_at >= REFRESH_SECONDS:
+                self.apply_changes()
+
+    def search(self, field, prefix, limit):
+        self.refresh()
+        return self.indexes[field].search(prefix, limit)
+
+index = AutocompleteIndex()
@@ -0,0 +1,272 @@
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from wet_process.models import FirstWashBatchSource, FirstWashBundleSource
+
+from .events import record_events
+from .models import ArchivedBatch, Batch, BatchBalance, BatchBundle, BatchQcStageSummary, BatchStage, BatchStageHistory, ChangeEvent, PlanningRouteStep, ReceivedBundle, Rejection
+
+# Name written in created_by of the change events of repaired rows
+CONSISTENCY_USER = "consistency"
+
+
+# BatchStage is the latest BatchStageHistory row of its batch: same stage and sequence, open while in and
+# closed once closed. A batch with history has a stage and a batch with a stage has history.
+def stage_matches_history():
+    entry = BatchStageHistory.objects.filter(batch_id=OuterRef("batch_id"), sequence=OuterRef("sequence"), stage_id=OuterRef("current_stage_id"))
+    later = BatchStageHistory.objects.filter(batch_id=OuterRef("batch_id"), sequence__gt=OuterRef("sequence"))
+
+    return BatchStage.objects.filter(
+        Q(current_status=BatchStage.STATUS_IN) & Exists(entry.filter(closed_at__isnull=True))
+        | Q(current_status=BatchStage.STATUS_CLOSED) & Exists(entry.filter(closed_at__isnull=False)),
+        ~Exists(later),
+        batch_id=OuterRef("pk"),
+    )
+
+def stage_violations():
+    started = Exists(BatchStage.objects.filter(batch_id=OuterRef("pk"))) | Exists(BatchStageHistory.objects.filter(batch_id=OuterRef("pk")))
+    return Batch.objects.filter(started, ~Exists(stage_matches_history()))
+
+# Rewrites the stages of these batches from their latest history row, a stage without any history is removed
+def repair_stages(batch_ids):
+    with transaction.atomic():
+        stages = BatchStage.objects.select_for_update().in_bulk(batch_ids)
+        latest = {}
+        for history in BatchStageHistory.objects.filter(batch_id__in=batch_ids).order_by("batch_id", "sequence"):
+            latest[history.batch_id] = history
+
+        removed = [stage for batch_id, stage in stages.items() if batch_id not in latest]
+        updated = []
+        created = []
+
+        for batch_id, history in latest.items():
+            stage = stages.get(batch_id) or BatchStage(batch_id=batch_id)
+            stage.current_stage_id = history.stage_id
+            stage.sequence = history.sequence
+            stage.current_status = BatchStage.STATUS_CLOSED if history.closed_at else BatchStage.STATUS_IN
+            stage.updated_at = history.closed_at or history.entered_at
+
+            if batch_id in stages:
+                stage.version += 1
+                updated.append(stage)
+            else:
+                created.append(stage)
+
+        record_events(removed, ChangeEvent.ACTION_DELETED, CONSISTENCY_USER)
+        BatchStage.objects.filter(batch_id__in=[stage.batch_id for stage in removed]).delete()
+        BatchStage.objects.bulk_update(updated, ["current_stage_id", "sequence", "current_status", "updated_at", "version"])
+        BatchStage.objects.bulk_create(created)
+        record_events(updated, ChangeEvent.ACTION_UPDATED, CONSISTENCY_USER)
+        record_events(created, ChangeEvent.ACTION_CREATED, CONSISTENCY_USER)
+
+
+# Batch.status is closed exactly when its stage is closed at the last step of its route
+def finished_stage():
+    later_step = PlanningRouteStep.objects.filter(route_id=OuterRef("batch__planning__route_id"), sequence__gt=OuterRef("sequence"))
+    return BatchStage.objects.filter(~Exists(later_step), batch_id=OuterRef("pk"), current_status=BatchStage.STATUS_CLOSED)
+
+def batch_status_violations():
+    finished = Exists(finished_stage())
+    return Batch.objects.filter(Q(status=Batch.STATUS_CLOSED) & ~finished | Q(status=Batch.STATUS_IN) & finished)
+
+def repair_batch_status(batch_ids):
+    with transaction.atomic():
+        batches = list(Batch.objects.select_for_update().filter(id__in=batch_ids).annotate(finished=Exists(finished_stage())))
+        for batch in batches:
+            batch.status = Batch.STATUS_CLOSED if batch.finished else Batch.STATUS_IN
+
+        Batch.objects.bulk_update(batches, ["status"])
+        record_events(batches, ChangeEvent.ACTION_UPDATED, CONSISTENCY_USER)
+
+
+# BatchQcStageSummary.rejection_count is the number of Rejection rows of its batch and stage, and every
+# (batch, stage) with rejections has a summary
+def summary_rejection_count():
+    return Coalesce(Subquery(
+        Rejection.objects.filter(batch_id=OuterRef("batch_id"), stage_id=OuterRef("stage_id"))
+        .order_by().values("batch_id").annotate(count=Count("id")).values("count")
+    ), 0)
+
+def summary_violations():
+    wrong = (
+        BatchQcStageSummary.objects.filter(batch_id=OuterRef("pk"))
+        .annotate(actual=summary_rejection_count())
+        .exclude(rejection_count=F("actual"))
+    )
+    missing = Rejection.objects.filter(
+        ~Exists(BatchQcStageSummary.objects.filter(batch_id=OuterRef("batch_id"), stage_id=OuterRef("stage_id"))),
+        batch_id=OuterRef("pk"),
+    )
+    return Batch.objects.filter(Exists(wrong) | Exists(missing))
+
+def repair_summaries(batch_ids):
+    with transaction.atomic():
+        summaries = list(BatchQcStageSummary.objects.select_for_update().filter(batch_id__in=batch_ids))
+        counts = {
+            (row["batch_id"], row["stage_id"]): row["count"]
+            for row in Rejection.objects.filter(batch_id__in=batch_ids).order_by().values("batch_id", "stage_id").annotate(count=Count("id"))
+        }
+
+        removed = []
+        updated = []
+        for summary in summaries:
+            count = counts.pop((summary.batch_id, summary.stage_id), 0)
+            if count == 0:
+                removed.append(summary)
+            elif count != summary.rejection_count:
+                summary.rejection_count = count
+                summary.last_update = timezone.now()
+                updated.append(summary)
+
+        created = [
+            BatchQcStageSummary(batch_id=batch_id, stage_id=stage_id, rejection_count=count)
+            for (batch_id, stage_id), count in counts.items()
+        ]
+
+        record_events(removed, ChangeEvent.ACTION_DELETED, CONSISTENCY_USER)
+        BatchQcStageSummary.objects.filter(id__in=[summary.id for summary in removed]).delete()
+        BatchQcStageSummary.objects.bulk_update(updated, ["rejection_count", "last_update"])
+        created = BatchQcStageSummary.objects.bulk_create(created)
+        record_events(updated, ChangeEvent.ACTION_UPDATED, CONSISTENCY_USER)
+        record_events(created, ChangeEvent.ACTION_CREATED, CONSISTENCY_USER)
+
+
+# BatchBalance adds up: produced is the quantity of the batch's bundles, rejected its rejections, washed what its
+# wash sources took, available what is left. Every batch has a balance.
+def balance_totals(batch):
+    return {
+        "actual_produced": Coalesce(Subquery(
+            BatchBundle.objects.filter(batch_id=OuterRef(batch))
+            .order_by().values("batch_id").annotate(total=Sum("received__quantity")).values("total")
+        ), 0),
+        "actual_rejected": Coalesce(Subquery(
+            Rejection.objects.filter(batch_id=OuterRef(batch))
+            .order_by().values("batch_id").annotate(total=Count("id")).values("total")
+        ), 0),
+        "actual_washed": Coalesce(Subquery(
+            FirstWashBatchSource.objects.filter(batch_id=OuterRef(batch))
+            .order_by().values("batch_id").annotate(total=Sum("quantity")).values("total")
+        ), 0),
+    }
+
+def balance_violations():
+    wrong = (
+        BatchBalance.objects.filter(batch_id=OuterRef("pk"))
+        .annotate(**balance_totals("batch_id"))
+        .exclude(
+            produced_quantity=F("actual_produced"),
+            rejected_quantity=F("actual_rejected"),
+            washed_quantity=F("actual_washed"),
+            available_quantity=F("actual_produced") - F("actual_rejected") - F("actual_washed"),
+        )
+    )
+    return Batch.objects.filter(~Exists(BatchBalance.objects.filter(batch_id=OuterRef("pk"))) | Exists(wrong))
+
+def repair_balances(batch_ids):
+    with transaction.atomic():
+        balances = BatchBalance.objects.select_for_update().in_bulk(batch_ids)
+        updated = []
+        created = []
+
+        for batch in Batch.objects.filter(id__in=batch_ids).annotate(**balance_totals("pk")):
+            balance = balances.get(batch.id) or BatchBalance(batch_id=batch.id)
+            balance.produced_quantity = batch.actual_produced
+            balance.rejected_quantity = batch.actual_rejected
+            balance.washed_quantity = batch.actual_washed
+            balance.available_quantity = batch.actual_produced - batch.actual_rejected - batch.actual_washed
+            balance.last_update = timezone.now()
+            (updated if batch.id in balances else created).append(balance)
+
+        BatchBalance.objects.bulk_update(updated, ["produced_quantity", "rejected_quantity", "washed_quantity", "available_quantity", "last_update"])
+        BatchBalance.objects.bulk_create(created)
+        record_events(updated, ChangeEvent.ACTION_UPDATED, CONSISTENCY_USER)
+        record_events(created, ChangeEvent.ACTION_CREATED, CONSISTENCY_USER)
+
+
+# ReceivedBundle.status is allocated exactly when the bundle is in a batch or went to a wash on its own
+def bundle_used():
+    return Exists(BatchBundle.objects.filter(received_id=OuterRef("pk"))) | Exists(FirstWashBundleSource.objects.filter(bundle_id=OuterRef("pk")))
+
+def bundle_violations():
+    used = bundle_used()
+    return ReceivedBundle.objects.filter(Q(status=ReceivedBundle.STATUS_ALLOCATED) & ~used | Q(status=ReceivedBundle.STATUS_RECEIVED) & used)
+
+def repair_bundles(bundle_ids):
+    with transaction.atomic():
+        bundles = list(ReceivedBundle.objects.select_for_update().filter(id__in=bundle_ids).annotate(used=bundle_used()))
+        for bundle in bundles:
+            bundle.status = ReceivedBundle.STATUS_ALLOCATED if bundle.used else ReceivedBundle.STATUS_RECEIVED
+
+        ReceivedBundle.objects.bulk_update(bundles, ["status"])
+        record_events(bundles, ChangeEvent.ACTION_UPDATED, CONSISTENCY_USER)
+
+
+# FirstWashBatchSource.batch has no database constraint so archived batches keep their id, every source still points
+# to a batch in Batch or ArchivedBatch. A batch deleted some other way (admin, shell) leaves its wash sources behind.
+# The wash did happen and nothing says which batch it took from, so these rows are reported and fixed by hand.
+def wash_source_violations():
+    return FirstWashBatchSource.objects.filter(
+        ~Exists(Batch.objects.filter(pk=OuterRef("batch_id"))),
+        ~Exists(ArchivedBatch.objects.filter(batch_id=OuterRef("batch_id"))),
+    )
+
+
+# name -> violations: queryset of the rows that break the invariant, repair: fixes the rows of a list of their pks,
+# or None when the check only reports. Stages come first, the batch status is checked against them.
+CHECKS = {
+    "batch-stage": {
+        "description": "BatchStage matches the latest BatchStageHistory row",
+        "violations": stage_violations,
+        "repair": repair_stages,
+    },
+    "batch-status": {
+        "description": "Batch.status is closed exactly when the last route step is closed",
+        "violations": batch_status_violations,
+        "repair": repair_batch_status,
+    },
+    "qc-summary": {
+        "description": "BatchQcStageSummary.rejection_count matches the Rejection rows",
+        "violations": summary_violations,
+        "repair": repair_summaries,
+    },
+    "batch-balance": {
+        "description": "BatchBalance matches the bundles, rejections and washes of the batch",
+        "violations": balance_violations,
+        "repair": repair_balances,
+    },
+    "bundle-status": {
+        "description": "ReceivedBundle.status is allocated exactly when the bundle is in a batch or a wash",
+        "violations": bundle_violations,
+        "repair": repair_bundles,
+    },
+    "wash-source-batch": {
+        "description": "FirstWashBatchSource.batch is a live or archived batch (report only)",
+        "violations": wash_source_violations,
+        "repair": None,
+    },
+}
+
+
+# Repairs the violating rows a chunk at a time in primary key order, a row the repair can't fix is not visited twice.
+# Returns the number of rows repaired.
+def repair_violations(check, chunk_size):
+    if check["repair"] is None:
+        return 0
+
+    repaired = 0
+    last = None
+
+    while True:
+        violations = check["violations"]().order_by("pk").values_list("pk", flat=True)
+        if last is not None:
+            violations = violations.filter(pk__gt=last)
+
+        keys = list(violations[:chunk_size])
+        if not keys:
+            return repaired
+
+        check["repair"](keys)
+        repaired += len(keys)
+        last = keys[-1]
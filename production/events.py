@@ -0,0 +1,61 @@
+from .models import BatchBalance, ChangeEvent, SnapshotWatermark, StageName
+from .stages import stage_name
+
+
+# SnapshotWatermark row with the seq of the last event deleted by the retention of `manage.py prune_change_events`.
+# A client that synced to an earlier seq has missed changes for good. Compacted events are not counted, every one of
+# them is followed by a newer event of the same row.
+PRUNED_WATERMARK = "change-event-retention"
+
+
+def snapshot(instance):
+    # Plain column values of the row, the JSON encoder of ChangeEvent.payload takes care of dates and decimals
+    data = {
+        field.attname: field.value_from_object(instance)
+        for field in instance._meta.concrete_fields
+    }
+    
+    # Stages are stored as ids, the name goes along so consumers don't have to resolve it
+    for field in instance._meta.concrete_fields:
+        if field.related_model is StageName:
+            data[field.name] = stage_name(data[field.attname])
+    
+    return data
+
+def build_event(instance, action, user, **extra):
+    if action == ChangeEvent.ACTION_DELETED:
+        payload = extra or None
+    else:
+        payload = {**snapshot(instance), **extra}
+
+    return ChangeEvent(
+        entity=instance._meta.label_lower,
+        entity_id=instance.pk,
+        action=action,
+        payload=payload,
+        created_by=user,
+    )
+
+# Must be called inside the same transaction.atomic() block as the change itself,
+# and before instance.delete() for deletions (the pk is gone afterwards)
+def record_event(instance, action, user, **extra):
+    event = build_event(instance, action, user, **extra)
+    event.save()
+    return event
+
+def record_events(instances, action, user):
+    ChangeEvent.objects.bulk_create([
+        build_event(instance, action, user)
+        for instance in instances
+    ])
+
+# Balances are changed with F() updates, so their events are built from the rows read back after the update
+def record_balance_events(batch_ids, user):
+    record_events(BatchBalance.objects.filter(batch_id__in=batch_ids), ChangeEvent.ACTION_UPDATED, user)
+
+def get_pruned_seq():
+    return SnapshotWatermark.objects.filter(name=PRUNED_WATERMARK).values_list("seq", flat=True).first() or 0
+
+def set_pruned_seq(seq):
+    SnapshotWatermark.objects.get_or_create(name=PRUNED_WATERMARK)
+    SnapshotWatermark.objects.filter(name=PRUNED_WATERMARK, seq__lt=seq).update(seq=seq)
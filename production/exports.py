@@ -0,0 +1,266 @@
+import csv
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat, Substr
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .filters import filter_date_range
+from .models import ReceivedBundle, Batch, BatchBundle, BatchStageHistory, Rejection
+
+# Rows fetched from the database per round trip, and rows written per chunk of the response
+CHUNK_SIZE = 2000
+
+# Same rule the rejection serializer uses to find the bundle of a garment
+def rejection_bundle(field):
+    bundle_barcode = Concat(Value("8220"), Substr(OuterRef("individual_barcode"), 1, 12), Value("001"))
+    return Subquery(ReceivedBundle.objects.filter(bundle_barcode=bundle_barcode).values(field)[:1])
+
+# name: queryset, the column of the date range filter (?<prefix>_after=&<prefix>_before=), and the columns in export order.
+# A column is a field path or an expression, only the requested ones end up in the SELECT.
+DATASETS = {
+    "received-bundles": {
+        "queryset": lambda: ReceivedBundle.objects.order_by("id"),
+        "date_field": "received_at",
+        "date_prefix": "received",
+        "columns": {
+            "id": "id",
+            "so": "so",
+            "mpo": "mpo",
+            "buyer": "buyer",
+            "style": "style",
+            "marker": "marker",
+            "bundle_no": "bundle_no",
+            "bundle_barcode": "bundle_barcode",
+            "size": "size",
+            "shade": "shade",
+            "color": "color",
+            "quantity": "quantity",
+            "status": "status",
+            "received_at": "received_at",
+            "received_by": "received_by",
+        },
+    },
+    "batches": {
+        "queryset": lambda: Batch.objects.order_by("id"),
+        "date_field": "updated_at",
+        "date_prefix": "updated",
+        "columns": {
+            "id": "id",
+            "mpo": "mpo",
+            "size": "size",
+            "color": "color",
+            "status": "status",
+            "current_stage": F("stage__current_stage__stage"),
+            "current_status": F("stage__current_status"),
+            "bundle_count": Coalesce(
+                Subquery(
+                    BatchBundle.objects.filter(batch=OuterRef("pk")).values("batch").annotate(total=Count("id")).values("total"),
+                    output_field=IntegerField(),
+                ),
+                0,
+            ),
+            "produced_quantity": F("balance__produced_quantity"),
+            "rejected_quantity": F("balance__rejected_quantity"),
+            "washed_quantity": F("balance__washed_quantity"),
+            "available_quantity": F("balance__available_quantity"),
+            "updated_at": "updated_at",
+            "updated_by": "updated_by",
+        },
+    },
+    "batch-stage-history": {
+        "queryset": lambda: BatchStageHistory.objects.order_by("id"),
+        "date_field": "entered_at",
+        "date_prefix": "entered",
+        "columns": {
+            "id": "id",
+            "batch": "batch_id",
+            "mpo": F("batch__mpo"),
+            "size": F("batch__size"),
+            "color": F("batch__color"),
+            "stage": F("stage__stage"),
+            "sequence": "sequence",
+            "entered_at": "entered_at",
+            "entered_by": "entered_by",
+            "closed_at": "closed_at",
+            "closed_by": "closed_by",
+        },
+    },
+    "rejections": {
+        "queryset": lambda: Rejection.objects.order_by("id"),
+        "date_field": "rejected_at",
+        "date_prefix": "rejected",
+        "columns": {
+            "id": "id",
+            "individual_barcode": "individual_barcode",
+            "batch": "batch_id",
+            "mpo": F("batch__mpo"),
+            "stage": F("stage__stage"),
+            "reason": "reason",
+            "rejected_at": "rejected_at",
+            "rejected_by": "rejected_by",
+            "bundle_barcode": rejection_bundle("bundle_barcode"),
+            "bundle_no": rejection_bundle("bundle_no"),
+            "so": rejection_bundle("so"),
+            "buyer": rejection_bundle("buyer"),
+            "style": rejection_bundle("style"),
+            "shade": rejection_bundle("shade"),
+            "bundle_size": rejection_bundle("size"),
+            "bundle_color": rejection_bundle("color"),
+        },
+    },
+}
+
+
+def format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+# Rows of the selected columns, read with a server side cursor where the database has one so memory stays flat
+def iter_rows(queryset, columns):
+    for row in queryset.values_list(*columns.values()).iterator(chunk_size=CHUNK_SIZE):
+        yield [format_value(value) for value in row]
+
+
+# File-like object that hands back whatever was written to it since the last call
+class StreamBuffer:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in self.chunks)
+        self.chunks = []
+        return data
+
+def stream_csv(header, rows):
+    buffer = StreamBuffer()
+    writer = csv.writer(buffer)
+
+    writer.writerow(header)
+    for index, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if index % CHUNK_SIZE == 0:
+            yield buffer.pop()
+
+    yield buffer.pop()
+
+
+# XLSX is a zip of XML parts. Only the sheet grows with the data, it is written through zipfile's streaming mode
+# with inline strings (no shared string table to keep in memory), and the compressed bytes are sent every CHUNK_SIZE rows.
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Export" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Control characters are not allowed in XML 1.0
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(INVALID_XML_CHARS.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def xlsx_row(values):
+    return "<row>" + "".join(xlsx_cell(value) for value in values) + "</row>"
+
+def stream_xlsx(header, rows):
+    buffer = StreamBuffer()
+
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_PARTS.items():
+            workbook.writestr(name, content)
+
+        with workbook.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(xlsx_row(header).encode())
+
+            chunk = []
+            for row in rows:
+                chunk.append(xlsx_row(row))
+                if len(chunk) == CHUNK_SIZE:
+                    sheet.write("".join(chunk).encode())
+                    chunk = []
+                    yield buffer.pop()
+
+            sheet.write("".join(chunk).encode())
+            sheet.write(b"</sheetData></worksheet>")
+
+    yield buffer.pop()
+
+FILE_TYPES = {
+    "csv": (stream_csv, "text/csv"),
+    "xlsx": (stream_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+# Reads ?file_type=, ?columns= and the date range of a dataset from request.query_params or a dict of the same keys.
+# Returns (columns, queryset, file_type).
+def prepare_export(name, params):
+    dataset = DATASETS.get(name)
+    if dataset is None:
+        raise ValidationError(f"Unknown dataset {name}. Choose one of {', '.join(DATASETS)}.")
+    
+    # ?format is taken by DRF for the renderer, so the file type has its own parameter
+    file_type = params.get("file_type") or "csv"
+    if file_type not in FILE_TYPES:
+        raise ValidationError(f"file_type must be one of {', '.join(FILE_TYPES)}.")
+    
+    columns = dataset["columns"]
+    requested = params.get("columns")
+    if requested:
+        names = [name.strip() for name in requested.split(",") if name.strip()]
+        unknown = [column for column in names if column not in columns]
+        if unknown:
+            raise ValidationError(f"Unknown column(s) {', '.join(unknown)} for {name}.")
+        columns = {column: columns[column] for column in dict.fromkeys(names)}
+    
+    queryset = filter_date_range(dataset["queryset"](), params, dataset["date_field"], dataset["date_prefix"])
+    
+    return columns, queryset, file_type
+
+def export_filename(name, file_type):
+    return f"{name}-{timezone.localdate():%Y%m%d}.{file_type}"
@@ -0,0 +1,110 @@
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+# Returns (datetime, whole_day), a plain date is read as the start of that day
+def parse_datetime_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None, False
+    
+    day = None
+    try:
+        day = parse_date(value)
+        parsed = datetime.combine(day, time.min) if day else parse_datetime(value)
+    except ValueError:
+        parsed = None
+    
+    if parsed is None:
+        raise ValidationError(f"{name} must be a date (YYYY-MM-DD) or a datetime.")
+    
+    whole_day = day is not None
+    
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed, whole_day
+
+# Filter a datetime column on ?<prefix>_after=&<prefix>_before= as a plain range so the index on the column can be used.
+# Both ends are inclusive, a plain date as the upper end covers that whole day. params is request.query_params or a dict.
+def filter_date_range(queryset, params, field, prefix):
+    after, _ = parse_datetime_param(params, f"{prefix}_after")
+    before, whole_day = parse_datetime_param(params, f"{prefix}_before")
+    
+    if after:
+        queryset = queryset.filter(**{f"{field}__gte": after})
+    
+    if before and whole_day:
+        queryset = queryset.filter(**{f"{field}__lt": before + timedelta(days=1)})
+    elif before:
+        queryset = queryset.filter(**{f"{field}__lte": before})
+    
+    return queryset
+
+
+# Columns that lead an index of the model (Meta.indexes, unique_together, unique or db_index fields).
+# A filter on one of them can always be answered by an index search.
+@lru_cache(maxsize=None)
+def index_leading_columns(model):
+    columns = set()
+    
+    for index in model._meta.indexes:
+        columns.add(index.fields[0].lstrip("-"))
+    
+    for fields in model._meta.unique_together:
+        columns.add(fields[0])
+    
+    for field in model._meta.concrete_fields:
+        if field.primary_key or field.unique or field.db_index:
+            columns.add(field.name)
+    
+    return frozenset(columns)
+
+# Exact and date range filters declared on the viewset, only accepted when one of them leads an index:
+#   exact_filter_fields = {"<query param>": "<column>"}
+#   range_filter_fields = {"<prefix>": "<datetime column>"}  (?<prefix>_after=&<prefix>_before=)
+# The other filters then narrow down the rows found through that index, so a filtered list never scans the table.
+class IndexedFilterBackend(BaseFilterBackend):
+    
+    def get_filters(self, request, view):
+        exact = {}
+        for param, column in getattr(view, "exact_filter_fields", {}).items():
+            value = request.query_params.get(param)
+            if value:
+                exact[column] = value
+        
+        ranges = {
+            prefix: column
+            for prefix, column in getattr(view, "range_filter_fields", {}).items()
+            if request.query_params.get(f"{prefix}_after") or request.query_params.get(f"{prefix}_before")
+        }
+        
+        return exact, ranges
+    
+    def filter_queryset(self, request, queryset, view):
+        exact, ranges = self.get_filters(request, view)
+        
+        if not exact and not ranges:
+            return queryset
+        
+        leading = index_leading_columns(queryset.model)
+        if leading.isdisjoint(set(exact) | set(ranges.values())):
+            params = [param for param, column in view.exact_filter_fields.items() if column in leading]
+            params += [f"{prefix}_after/{prefix}_before" for prefix, column in getattr(view, "range_filter_fields", {}).items() if column in leading]
+            raise ValidationError(f"Filter on at least one of {', '.join(params)} as well.")
+        
+        for column, value in exact.items():
+            field = queryset.model._meta.get_field(column)
+            if field.choices and value not in dict(field.choices):
+                raise ValidationError(f"{column} must be one of {', '.join(dict(field.choices))}.")
+        
+        queryset = queryset.filter(**exact)
+        
+        for prefix, column in ranges.items():
+            queryset = filter_date_range(queryset, request.query_params, column, prefix)
+        
+        return queryset
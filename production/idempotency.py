@@ -0,0 +1,99 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .exceptions import Conflict, IdempotencyKeyMismatch
+from .models import IdempotencyKey
+from .serializers import get_user_name
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+
+def get_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    raw = f"{request.method}\n{request.path}\n{body}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+# Wrap the create method of a viewset. A retried request with the same key gets the stored response back without
+# running validation again, a request arriving while the first one is still running gets 409.
+# A key still in progress after settings.IDEMPOTENCY_STALE_AFTER is taken over by the retry. If the first request was
+# only slow, it finds its key gone when it stores the response and rolls its changes back, so only one of them writes.
+def idempotent(view_method):
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        
+        # Requests without the header behave as before
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        
+        if len(key) > 100:
+            raise ValidationError(f"{IDEMPOTENCY_HEADER} must be at most 100 characters.")
+        
+        user = get_user_name(request)
+        fingerprint = get_fingerprint(request)
+        now = timezone.now()
+        
+        # An expired or abandoned key can be used again
+        IdempotencyKey.objects.filter(user=user, key=key).filter(
+            Q(expires_at__lte=now)
+            | Q(status=IdempotencyKey.STATUS_IN_PROGRESS, created_at__lte=now - settings.IDEMPOTENCY_STALE_AFTER)
+        ).delete()
+        
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    key=key,
+                    user=user,
+                    fingerprint=fingerprint,
+                    expires_at=now + settings.IDEMPOTENCY_KEY_TTL,
+                )
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            
+            if record is None:
+                raise Conflict()
+            
+            if record.fingerprint != fingerprint:
+                raise IdempotencyKeyMismatch()
+            
+            if record.status == IdempotencyKey.STATUS_IN_PROGRESS:
+                raise Conflict("A request with this Idempotency-Key is still being processed.")
+            
+            return replay(record)
+        
+        try:
+            with transaction.atomic():
+                response = view_method(self, request, *args, **kwargs)
+                
+                # Only successful responses are stored, so a request that failed validation can be corrected and retried
+                if status.is_success(response.status_code):
+                    stored = IdempotencyKey.objects.filter(pk=record.pk, status=IdempotencyKey.STATUS_IN_PROGRESS).update(
+                        status=IdempotencyKey.STATUS_COMPLETED,
+                        response_status=response.status_code,
+                        response_body=response.data,
+                    )
+                    if not stored:
+                        raise Conflict("This request took too long and a retry with the same Idempotency-Key took it over.")
+                    return response
+        except Exception:
+            record.delete()
+            raise
+        
+        record.delete()
+        return response
+    
+    return wrapper
@@ -0,0 +1,115 @@
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from jobs.registry import register
+
+from . import exports
+from .archive import archive_chunk
+from .consistency import CHECKS, repair_violations
+from .snapshots import rebuild_snapshots, update_snapshots
+
+
+def validate_export(params):
+    exports.prepare_export(params.get("dataset"), params)
+
+# Same file as productions/exports/<dataset>/, written to the job's file instead of the response.
+# params: {"dataset": ..., "file_type": ..., "columns": ..., "<prefix>_after": ..., "<prefix>_before": ...}
+@register("export", roles=("admin", "planner"), validate=validate_export)
+def export(job, params):
+    columns, queryset, file_type = exports.prepare_export(params["dataset"], params)
+    total = queryset.count()
+    job.report(0, total, f"Writing {total} rows")
+
+    def rows():
+        for index, row in enumerate(exports.iter_rows(queryset, columns), 1):
+            if index % exports.CHUNK_SIZE == 0:
+                job.report(index, total)
+            yield row
+
+    writer, _ = exports.FILE_TYPES[file_type]
+    with tempfile.TemporaryFile() as fp:
+        for chunk in writer(list(columns), rows()):
+            fp.write(chunk)
+        fp.seek(0)
+        job.file.save(exports.export_filename(params["dataset"], file_type), File(fp), save=False)
+
+    return {"rows": total}
+
+
+def validate_archive(params):
+    for name in ("days", "chunk_size"):
+        value = params.get(name)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            raise ValidationError({name: "Must be a positive integer."})
+
+# Background version of `manage.py archive_closed_batches`, params: {"days": ..., "chunk_size": ...}
+@register("archive-closed-batches", validate=validate_archive, max_attempts=1)
+def archive_closed_batches(job, params):
+    cutoff = timezone.now() - timedelta(days=params.get("days") or settings.ARCHIVE_CLOSED_BATCHES_AFTER_DAYS)
+    chunk_size = params.get("chunk_size") or 500
+    total_batches = total_bundles = 0
+
+    while True:
+        batches, bundles = archive_chunk(cutoff, chunk_size)
+        if not batches:
+            break
+
+        total_batches += batches
+        total_bundles += bundles
+        job.report(total_batches, message=f"Archived {total_batches} batches and {total_bundles} bundles")
+
+    return {"batches": total_batches, "bundles": total_bundles, "cutoff": cutoff.isoformat()}
+
+
+def validate_consistency(params):
+    checks = params.get("checks") or []
+    if not isinstance(checks, list):
+        raise ValidationError({"checks": "Must be a list."})
+    unknown = [name for name in checks if name not in CHECKS]
+    if unknown:
+        raise ValidationError({"checks": f"Unknown check(s) {', '.join(map(str, unknown))}. Choose from {', '.join(CHECKS)}."})
+
+# Background version of `manage.py check_consistency`, params: {"checks": [...], "repair": true}
+@register("check-consistency", validate=validate_consistency)
+def check_consistency(job, params):
+    names = params.get("checks") or list(CHECKS)
+    result = {}
+
+    for index, name in enumerate(names):
+        check = CHECKS[name]
+        job.report(index, len(names), f"Checking {name}")
+
+        repaired = repair_violations(check, 1000) if params.get("repair") else 0
+        violations = check["violations"]().order_by("pk").values_list("pk", flat=True)
+        result[name] = {"repaired": repaired, "violations": violations.count(), "first": list(violations[:10])}
+
+    return result
+
+
+def validate_snapshots(params):
+    since = params.get("since")
+    if since is not None:
+        if not params.get("rebuild"):
+            raise ValidationError({"since": "Only goes with rebuild."})
+        try:
+            day = parse_date(since) if isinstance(since, str) else None
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError({"since": "Must be a date (YYYY-MM-DD)."})
+
+# Background version of `manage.py update_daily_snapshots`, params: {"rebuild": true, "since": "YYYY-MM-DD"}
+@register("update-daily-snapshots", validate=validate_snapshots)
+def update_daily_snapshots(job, params):
+    if params.get("rebuild"):
+        since = parse_date(params["since"]) if params.get("since") else None
+        return {"days": rebuild_snapshots(since, report=job.report)}
+
+    events, days = update_snapshots()
+    return {"events": events, "days": days}
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from production.archive import archive_chunk
+
+
+class Command(BaseCommand):
+    help = "Move batches closed more than N days ago, with their bundles and dependent rows, into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.ARCHIVE_CLOSED_BATCHES_AFTER_DAYS,
+            help="Archive batches whose last stage was closed more than this many days ago.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Batches moved per transaction.",
+        )
+        parser.add_argument(
+            "--max-chunks",
+            type=int,
+            default=None,
+            help="Stop after this many chunks, the next run continues from there.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        total_batches = total_bundles = chunks = 0
+
+        while options["max_chunks"] is None or chunks < options["max_chunks"]:
+            batches, bundles = archive_chunk(cutoff, options["chunk_size"])
+            if not batches:
+                break
+
+            chunks += 1
+            total_batches += batches
+            total_bundles += bundles
+            self.stdout.write(f"Chunk {chunks}: archived {batches} batches and {bundles} bundles.")
+
+        self.stdout.write(f"Archived {total_batches} batches and {total_bundles} bundles closed before {cutoff:%Y-%m-%d}.")
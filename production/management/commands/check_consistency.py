@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production.consistency import CHECKS, repair_violations
+
+
+class Command(BaseCommand):
+    help = "Check the invariants between the redundant production tables with set-based queries, and optionally repair them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="append",
+            choices=list(CHECKS),
+            help="Run only this check, can be given more than once. Runs every check by default.",
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Fix the rows that break an invariant, the history, rejection, bundle and wash rows are taken as the truth. "
+                 "Checks marked report only are left alone.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows repaired per transaction.",
+        )
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=10,
+            help="Primary keys of the violating rows shown per check.",
+        )
+
+    def handle(self, *args, **options):
+        remaining = 0
+        repairable = 0
+
+        for name in options["check"] or CHECKS:
+            check = CHECKS[name]
+            started = time.perf_counter()
+
+            if options["repair"]:
+                repaired = repair_violations(check, options["chunk_size"])
+                if repaired:
+                    self.stdout.write(f"{name}: repaired {repaired} row(s).")
+
+            violations = check["violations"]().order_by("pk").values_list("pk", flat=True)
+            count = violations.count()
+            elapsed = time.perf_counter() - started
+
+            if count:
+                remaining += count
+                if check["repair"]:
+                    repairable += count
+                sample = ", ".join(map(str, violations[:options["sample"]]))
+                self.stdout.write(self.style.ERROR(f"{name}: {count} violation(s) in {elapsed:.1f} s, {check['description']}. First: {sample}"))
+            else:
+                self.stdout.write(f"{name}: ok in {elapsed:.1f} s")
+
+        if remaining:
+            raise CommandError(f"{remaining} row(s) break an invariant{', run again with --repair to fix them' if repairable and not options['repair'] else ''}.")
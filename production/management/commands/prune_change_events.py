@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from production.events import set_pruned_seq
+from production.models import ChangeEvent
+from production.snapshots import prunable_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete change events past the retention window and optionally compact superseded events. "
+        "Events the daily snapshots have not processed yet are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.CHANGE_EVENT_RETENTION_DAYS,
+            help="Keep events newer than this many days.",
+        )
+        parser.add_argument(
+            "--compact",
+            action="store_true",
+            help="Also delete events that are followed by a newer event for the same row.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        expired = prunable_events(ChangeEvent.objects.filter(created_at__lt=cutoff))
+        last = expired.aggregate(last=Max("seq"))["last"]
+        deleted, _ = expired.delete()
+        if last:
+            # Clients that synced to an earlier seq are told to load everything again
+            set_pruned_seq(last)
+        self.stdout.write(f"Deleted {deleted} events older than {options['days']} days.")
+
+        if options["compact"]:
+            # Payloads are full snapshots of the row, so only the latest event of each row is needed to sync it
+            newer = ChangeEvent.objects.filter(
+                entity=OuterRef("entity"),
+                entity_id=OuterRef("entity_id"),
+                seq__gt=OuterRef("seq"),
+            )
+            compacted, _ = prunable_events(ChangeEvent.objects.filter(Exists(newer))).delete()
+            self.stdout.write(f"Compacted {compacted} superseded events.")
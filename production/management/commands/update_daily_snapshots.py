@@ -0,0 +1,46 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production.snapshots import rebuild_snapshots, update_snapshots
+
+
+class Command(BaseCommand):
+    help = "Bring the daily stage snapshots up to date with the history and rejection changes since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recompute every day from the history and rejection tables instead of following the change events.",
+        )
+        parser.add_argument(
+            "--since",
+            default=None,
+            help="With --rebuild, first day (YYYY-MM-DD) to recompute. Days before it keep their snapshots.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Change events processed per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            since = None
+            if options["since"]:
+                try:
+                    since = date.fromisoformat(options["since"])
+                except ValueError:
+                    raise CommandError("--since must be a date (YYYY-MM-DD).")
+
+            days = rebuild_snapshots(since)
+            self.stdout.write(f"Rebuilt the snapshots of {days} days.")
+            return
+
+        if options["since"]:
+            raise CommandError("--since only goes with --rebuild.")
+
+        events, days = update_snapshots(options["chunk_size"])
+        self.stdout.write(f"Processed {events} change events, recomputed {days} days.")
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-19 13:17
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0021_receivedbundle_so'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('entity', models.CharField(max_length=100)),
+                ('entity_id', models.PositiveBigIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=10)),
+                ('payload', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('created_by', models.CharField(max_length=100)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['entity', 'entity_id', 'seq'], name='production__entity_7dc7cf_idx')],
+            },
+        ),
+    ]
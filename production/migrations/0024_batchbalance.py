@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-19 13:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0023_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchBalance',
+            fields=[
+                ('batch', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='production.batch')),
+                ('produced_quantity', models.PositiveIntegerField()),
+                ('rejected_quantity', models.PositiveIntegerField(default=0)),
+                ('washed_quantity', models.PositiveIntegerField(default=0)),
+                ('available_quantity', models.IntegerField(db_index=True)),
+                ('last_update', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def backfill_balances(apps, schema_editor):
+    Batch = apps.get_model("production", "Batch")
+    BatchBalance = apps.get_model("production", "BatchBalance")
+    FirstWashBatchSource = apps.get_model("wet_process", "FirstWashBatchSource")
+
+    produced = dict(
+        Batch.objects.annotate(quantity=Sum("batch_bundles__received__quantity")).values_list("id", "quantity")
+    )
+    rejected = dict(
+        Batch.objects.annotate(count=Count("rejections")).values_list("id", "count")
+    )
+    washed = dict(
+        FirstWashBatchSource.objects.values("batch_id").annotate(quantity=Sum("quantity")).values_list("batch_id", "quantity")
+    )
+
+    balances = []
+    for batch_id, produced_quantity in produced.items():
+        produced_quantity = produced_quantity or 0
+        rejected_quantity = rejected.get(batch_id, 0)
+        washed_quantity = washed.get(batch_id, 0)
+        balances.append(BatchBalance(
+            batch_id=batch_id,
+            produced_quantity=produced_quantity,
+            rejected_quantity=rejected_quantity,
+            washed_quantity=washed_quantity,
+            available_quantity=produced_quantity - rejected_quantity - washed_quantity,
+        ))
+
+    BatchBalance.objects.bulk_create(balances, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0024_batchbalance'),
+        ('wet_process', '0004_rename_quantity_taken_firstwashbatchsource_quantity_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+import hashlib
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def route_hash(stages):
+    return hashlib.sha256(json.dumps(list(stages)).encode()).hexdigest()
+
+
+# Give every planning the template of its current route, keeping one copy of the steps per distinct route
+def move_routes_to_templates(apps, schema_editor):
+    Planning = apps.get_model("production", "Planning")
+    PlanningRouteStep = apps.get_model("production", "PlanningRouteStep")
+    RouteTemplate = apps.get_model("production", "RouteTemplate")
+
+    steps_by_planning = {}
+    for step in PlanningRouteStep.objects.order_by("planning_id", "sequence"):
+        steps_by_planning.setdefault(step.planning_id, []).append(step)
+
+    templates = {}
+    duplicate_steps = []
+
+    for planning in Planning.objects.all():
+        steps = steps_by_planning.get(planning.id, [])
+        content_hash = route_hash(step.stage for step in steps)
+
+        if content_hash in templates:
+            duplicate_steps.extend(step.id for step in steps)
+        else:
+            templates[content_hash] = RouteTemplate.objects.create(content_hash=content_hash)
+            PlanningRouteStep.objects.filter(id__in=[step.id for step in steps]).update(route=templates[content_hash])
+
+        planning.route = templates[content_hash]
+        planning.save(update_fields=["route"])
+
+    PlanningRouteStep.objects.filter(id__in=duplicate_steps).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0025_backfill_batchbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='planning',
+            name='route',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='plannings', to='production.routetemplate'),
+        ),
+        migrations.AddField(
+            model_name='planningroutestep',
+            name='route',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='route_steps', to='production.routetemplate'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='planningroutestep',
+            unique_together=set(),
+        ),
+        migrations.RunPython(move_routes_to_templates, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='planningroutestep',
+            name='planning',
+        ),
+        migrations.AlterField(
+            model_name='planning',
+            name='route',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='plannings', to='production.routetemplate'),
+        ),
+        migrations.AlterField(
+            model_name='planningroutestep',
+            name='route',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_steps', to='production.routetemplate'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='planningroutestep',
+            unique_together={('route', 'sequence'), ('route', 'stage')},
+        ),
+    ]
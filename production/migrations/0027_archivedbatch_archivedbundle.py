@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:36
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0026_routetemplate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_id', models.PositiveBigIntegerField(unique=True)),
+                ('mpo', models.CharField(db_index=True, max_length=50)),
+                ('size', models.CharField(max_length=20)),
+                ('color', models.CharField(max_length=20)),
+                ('closed_at', models.DateTimeField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedBundle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bundle_id', models.PositiveBigIntegerField(unique=True)),
+                ('bundle_barcode', models.CharField(max_length=100, unique=True)),
+                ('mpo', models.CharField(max_length=100)),
+                ('document', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('archived_batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bundles', to='production.archivedbatch')),
+            ],
+        ),
+    ]
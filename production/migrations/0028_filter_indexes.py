@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0027_archivedbatch_archivedbundle'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(fields=['mpo', 'size', 'color'], name='production__mpo_bebf45_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(fields=['status', 'updated_at'], name='production__status_c576cd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(fields=['updated_at'], name='production__updated_cc0ad5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedbundle',
+            index=models.Index(fields=['mpo', 'size', 'color'], name='production__mpo_23400e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedbundle',
+            index=models.Index(fields=['status', 'received_at'], name='production__status_2f88a0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedbundle',
+            index=models.Index(fields=['buyer', 'style', 'received_at'], name='production__buyer_064983_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedbundle',
+            index=models.Index(fields=['style', 'received_at'], name='production__style_630fc6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedbundle',
+            index=models.Index(fields=['shade', 'received_at'], name='production__shade_8f27a9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedbundle',
+            index=models.Index(fields=['received_at'], name='production__receive_fd2693_idx'),
+        ),
+    ]
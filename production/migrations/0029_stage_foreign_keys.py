@@ -0,0 +1,90 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# (model, column) that stored the stage name as text
+STAGE_COLUMNS = [
+    ("planningroutestep", "stage"),
+    ("batchstage", "current_stage"),
+    ("batchstagehistory", "stage"),
+    ("rejection", "stage"),
+    ("batchqcstagesummary", "stage"),
+]
+
+
+# Point every row to the StageName of its text, names that were never added as a stage get one
+def names_to_ids(apps, schema_editor):
+    StageName = apps.get_model("production", "StageName")
+    stage_ids = dict(StageName.objects.values_list("stage", "id"))
+
+    for model_name, column in STAGE_COLUMNS:
+        model = apps.get_model("production", model_name)
+
+        for name in model.objects.order_by().values_list(column, flat=True).distinct():
+            if name not in stage_ids:
+                stage_ids[name] = StageName.objects.create(stage=name).id
+            model.objects.filter(**{column: name}).update(**{f"{column}_ref": stage_ids[name]})
+
+def ids_to_names(apps, schema_editor):
+    StageName = apps.get_model("production", "StageName")
+
+    for model_name, column in STAGE_COLUMNS:
+        model = apps.get_model("production", model_name)
+
+        for stage_id, name in StageName.objects.values_list("id", "stage"):
+            model.objects.filter(**{f"{column}_ref": stage_id}).update(**{column: name})
+
+
+def stage_field(null=False):
+    return models.ForeignKey(null=null, on_delete=django.db.models.deletion.PROTECT, related_name="+", to="production.stagename")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0028_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='planningroutestep',
+            unique_together={('route', 'sequence')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='batchstagehistory',
+            unique_together={('batch', 'sequence')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='batchqcstagesummary',
+            unique_together=set(),
+        ),
+    ] + [
+        migrations.AddField(model_name=model_name, name=f"{column}_ref", field=stage_field(null=True))
+        for model_name, column in STAGE_COLUMNS
+    ] + [
+        # Nullable first so that going backwards can add the text column again before filling it
+        migrations.AlterField(model_name=model_name, name=column, field=models.CharField(max_length=100, null=True))
+        for model_name, column in STAGE_COLUMNS
+    ] + [
+        migrations.RunPython(names_to_ids, ids_to_names),
+    ] + [
+        operation
+        for model_name, column in STAGE_COLUMNS
+        for operation in (
+            migrations.RemoveField(model_name=model_name, name=column),
+            migrations.RenameField(model_name=model_name, old_name=f"{column}_ref", new_name=column),
+            migrations.AlterField(model_name=model_name, name=column, field=stage_field()),
+        )
+    ] + [
+        migrations.AlterUniqueTogether(
+            name='planningroutestep',
+            unique_together={('route', 'sequence'), ('route', 'stage')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='batchstagehistory',
+            unique_together={('batch', 'sequence'), ('batch', 'stage')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='batchqcstagesummary',
+            unique_together={('batch', 'stage')},
+        ),
+    ]
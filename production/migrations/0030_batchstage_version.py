@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-19 14:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0029_stage_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchstage',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
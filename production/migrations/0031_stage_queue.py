@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-19 14:13
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# Existing stages changed when their history row was last closed or entered
+def set_updated_at(apps, schema_editor):
+    BatchStage = apps.get_model("production", "BatchStage")
+    BatchStageHistory = apps.get_model("production", "BatchStageHistory")
+
+    changed_at = BatchStageHistory.objects.filter(batch_id=OuterRef("batch_id"), sequence=OuterRef("sequence")).values(changed_at=Coalesce("closed_at", "entered_at"))[:1]
+    BatchStage.objects.update(updated_at=Coalesce(Subquery(changed_at), F("updated_at")))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0030_batchstage_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchstage',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(set_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='batchstage',
+            index=models.Index(fields=['current_status', 'sequence', 'updated_at'], name='production__current_2f622f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='planningroutestep',
+            index=models.Index(fields=['stage', 'route', 'sequence'], name='production__stage_i_70624f_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0 on 2026-10-19 16:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0031_stage_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStageSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('shift', models.CharField(max_length=20)),
+                ('batches_entered', models.PositiveIntegerField(default=0)),
+                ('pieces_entered', models.PositiveIntegerField(default=0)),
+                ('batches_closed', models.PositiveIntegerField(default=0)),
+                ('pieces_closed', models.PositiveIntegerField(default=0)),
+                ('pieces_rejected', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SnapshotWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('seq', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='batchstagehistory',
+            index=models.Index(fields=['entered_at'], name='production__entered_da6de4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batchstagehistory',
+            index=models.Index(fields=['closed_at'], name='production__closed__3414d4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rejection',
+            index=models.Index(fields=['rejected_at'], name='production__rejecte_d2d50a_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailystagesnapshot',
+            name='stage',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='production.stagename'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailystagesnapshot',
+            unique_together={('day', 'shift', 'stage')},
+        ),
+    ]
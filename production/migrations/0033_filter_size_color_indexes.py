@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-19 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0032_daily_stage_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(fields=['size', 'color'], name='production__size_9738e8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batch',
+            index=models.Index(fields=['color'], name='production__color_f22d81_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedbundle',
+            index=models.Index(fields=['size', 'color'], name='production__size_51b437_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receivedbundle',
+            index=models.Index(fields=['color'], name='production__color_75c61a_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-19 15:05
+
+import hashlib
+import json
+
+from django.db import migrations
+
+
+def route_hash(stage_ids):
+    return hashlib.sha256(json.dumps(list(stage_ids)).encode()).hexdigest()
+
+
+# Hash every template on its stage ids instead of its stage names. Templates that were created again after a stage
+# rename end up with the same hash, their plannings move to the first of them and the copies are deleted.
+def rehash_on_stage_ids(apps, schema_editor):
+    Planning = apps.get_model("production", "Planning")
+    PlanningRouteStep = apps.get_model("production", "PlanningRouteStep")
+    RouteTemplate = apps.get_model("production", "RouteTemplate")
+
+    stage_ids = {}
+    for route_id, stage_id in PlanningRouteStep.objects.order_by("route_id", "sequence").values_list("route_id", "stage_id"):
+        stage_ids.setdefault(route_id, []).append(stage_id)
+
+    keep = {}
+    for template in RouteTemplate.objects.order_by("id"):
+        content_hash = route_hash(stage_ids.get(template.id, []))
+
+        if content_hash in keep:
+            Planning.objects.filter(route=template).update(route=keep[content_hash])
+            template.delete()
+        else:
+            keep[content_hash] = template
+
+    # Two passes, a new hash may still be the old hash of another template
+    for content_hash, template in keep.items():
+        RouteTemplate.objects.filter(id=template.id).update(content_hash=f"rehash-{template.id}")
+    for content_hash, template in keep.items():
+        RouteTemplate.objects.filter(id=template.id).update(content_hash=content_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0033_filter_size_color_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rehash_on_stage_ids, migrations.RunPython.noop),
+    ]
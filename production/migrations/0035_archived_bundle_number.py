@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-19 15:12
+
+from django.db import migrations, models
+
+
+# The bundles archived so far have their marker and bundle number only in the document
+def fill_bundle_numbers(apps, schema_editor):
+    ArchivedBundle = apps.get_model("production", "ArchivedBundle")
+
+    bundles = list(ArchivedBundle.objects.only("id", "document"))
+    for bundle in bundles:
+        bundle.marker = bundle.document.get("marker") or ""
+        bundle.bundle_no = bundle.document.get("bundle_no")
+    ArchivedBundle.objects.bulk_update(bundles, ["marker", "bundle_no"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0034_route_hash_on_stage_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedbundle',
+            name='bundle_no',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedbundle',
+            name='marker',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='archivedbundle',
+            index=models.Index(fields=['mpo', 'marker', 'bundle_no'], name='production__mpo_87d756_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.core.validators import MinValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
 
 # Create your models here.
 
@@ -10,8 +11,19 @@ class StageName(models.Model):
     def __str__(self):
         return self.stage
 
+# An ordered list of stages shared by every planning that uses the same route.
+# Templates are never changed after they are created, changing the route of a planning points it to another template.
+class RouteTemplate(models.Model):
+    # sha256 of the ordered stage ids, see production.routes.route_hash
+    content_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.id}"
+
 class Planning(models.Model):
     mpo = models.CharField(max_length=100, unique=True)
+    route = models.ForeignKey(RouteTemplate, on_delete=models.PROTECT, related_name="plannings")
     updated_by = models.CharField(max_length=100)
     last_update = models.DateTimeField(auto_now=True)
 
@@ -19,23 +31,27 @@ class Planning(models.Model):
         return self.mpo
     
 class PlanningRouteStep(models.Model):
-    planning = models.ForeignKey(
-        Planning,
+    route = models.ForeignKey(
+        RouteTemplate,
         on_delete=models.CASCADE,
         related_name='route_steps'
     )
     sequence = models.PositiveIntegerField(validators=[MinValueValidator(1)])
-    stage = models.CharField(max_length=100)
+    stage = models.ForeignKey(StageName, on_delete=models.PROTECT, related_name="+")
 
     class Meta:
         unique_together = [
-            ('planning', 'sequence'),
-            ('planning', 'stage'),
+            ('route', 'sequence'),
+            ('route', 'stage'),
+        ]
+        # The stage queue starts from the steps of one stage
+        indexes = [
+            models.Index(fields=["stage", "route", "sequence"]),
         ]
         ordering = ['sequence']
 
     def __str__(self):
-        return f"{self.planning_id} - {self.sequence} - {self.stage}"
+        return f"{self.route_id} - {self.sequence} - {self.stage_id}"
 
 class ReceivedBundle(models.Model):
     STATUS_RECEIVED = "received"
@@ -67,6 +83,17 @@ class ReceivedBundle(models.Model):
 
     class Meta:
         unique_together = ["mpo", "marker","bundle_no"]
+        # Back the filters of the bundle list (production.filters.IndexedFilterBackend)
+        indexes = [
+            models.Index(fields=["mpo", "size", "color"]),
+            models.Index(fields=["status", "received_at"]),
+            models.Index(fields=["buyer", "style", "received_at"]),
+            models.Index(fields=["style", "received_at"]),
+            models.Index(fields=["shade", "received_at"]),
+            models.Index(fields=["size", "color"]),
+            models.Index(fields=["color"]),
+            models.Index(fields=["received_at"]),
+        ]
 
     def __str__(self):
         return f"{self.mpo} - {self.marker} - {self.bundle_no}"
@@ -89,6 +116,16 @@ class Batch(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.CharField(max_length=100)
     
+    class Meta:
+        # Back the filters of the batch list (production.filters.IndexedFilterBackend)
+        indexes = [
+            models.Index(fields=["mpo", "size", "color"]),
+            models.Index(fields=["status", "updated_at"]),
+            models.Index(fields=["size", "color"]),
+            models.Index(fields=["color"]),
+            models.Index(fields=["updated_at"]),
+        ]
+    
     def __str__(self):
         return f"{self.id}"
 
@@ -116,15 +153,25 @@ class BatchStage(models.Model):
         related_name="stage"
     )
 
-    current_stage = models.CharField(max_length=100)
+    current_stage = models.ForeignKey(StageName, on_delete=models.PROTECT, related_name="+")
     sequence = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     current_status = models.CharField(
         max_length=10,
         choices=STATUS_CHOICES
     )
+    # Bumped by every transition, a transition only saves when the version it was checked against is still current
+    version = models.PositiveIntegerField(default=0)
+    # Time of the last transition, a closed stage has been waiting for the next one since then
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        # Back the stage queue, the stages closed at the step before the queued stage
+        indexes = [
+            models.Index(fields=["current_status", "sequence", "updated_at"]),
+        ]
     
     def __str__(self):
-        return f"Batch {self.batch_id} - {self.current_stage}"
+        return f"Batch {self.batch_id} - {self.current_stage_id}"
     
 class BatchStageHistory(models.Model):
     batch = models.ForeignKey(
@@ -133,7 +180,7 @@ class BatchStageHistory(models.Model):
         related_name="stage_history"
     )
 
-    stage = models.CharField(max_length=100)
+    stage = models.ForeignKey(StageName, on_delete=models.PROTECT, related_name="+")
     sequence = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     entered_at = models.DateTimeField()
     closed_at = models.DateTimeField(null=True, blank=True)
@@ -146,9 +193,14 @@ class BatchStageHistory(models.Model):
             ('batch', 'stage'),
         ]
         ordering = ["entered_at"]
+        indexes = [
+            # The daily snapshots read one production day at a time
+            models.Index(fields=["entered_at"]),
+            models.Index(fields=["closed_at"]),
+        ]
     
     def __str__(self):
-        return f"Batch {self.batch_id} - {self.stage}"                   
+        return f"Batch {self.batch_id} - {self.stage_id}"                   
 
 
 class Rejection(models.Model):
@@ -176,19 +228,157 @@ class Rejection(models.Model):
     individual_barcode = models.CharField(max_length=100, unique=True)
     
     batch = models.ForeignKey(Batch, on_delete=models.CASCADE, related_name="rejections")
-    stage = models.CharField(max_length=100)
+    stage = models.ForeignKey(StageName, on_delete=models.PROTECT, related_name="+")
     reason = models.CharField(max_length=100, choices=REASON_CHOICES)
     rejected_at = models.DateTimeField(auto_now=True)
     rejected_by = models.CharField(max_length=100)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["rejected_at"]),
+        ]
+    
+# Running balance of each batch so that the quantity left for washing never needs summing the source rows.
+# available_quantity = produced_quantity - rejected_quantity - washed_quantity, kept in step with conditional updates.
+class BatchBalance(models.Model):
+    batch = models.OneToOneField(Batch, on_delete=models.CASCADE, primary_key=True, related_name="balance")
+    produced_quantity = models.PositiveIntegerField()
+    rejected_quantity = models.PositiveIntegerField(default=0)
+    washed_quantity = models.PositiveIntegerField(default=0)
+    available_quantity = models.IntegerField(db_index=True)
+    last_update = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Batch {self.batch_id} - {self.available_quantity}"
     
 # We're using BatchQcStageSummary so that we can quickly get how many rejections are there of a batch(per stage)    
 class BatchQcStageSummary(models.Model):
     batch = models.ForeignKey(Batch, on_delete=models.CASCADE, related_name="qc_stage_summaries")
-    stage = models.CharField(max_length=100)
+    stage = models.ForeignKey(StageName, on_delete=models.PROTECT, related_name="+")
     rejection_count = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     last_update = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         unique_together = [
             ('batch','stage')
-        ]
\ No newline at end of file
+        ]
+
+# Append-only log of every mutation made through the API so that clients can sync incrementally with ?since=<seq>
+class ChangeEvent(models.Model):
+    ACTION_CREATED = "created"
+    ACTION_UPDATED = "updated"
+    ACTION_DELETED = "deleted"
+
+    ACTION_CHOICES = [
+        (ACTION_CREATED, "Created"),
+        (ACTION_UPDATED, "Updated"),
+        (ACTION_DELETED, "Deleted"),
+    ]
+
+    # On SQLite the primary key is AUTOINCREMENT, so sequence numbers are never reused even after pruning
+    seq = models.BigAutoField(primary_key=True)
+    entity = models.CharField(max_length=100)
+    entity_id = models.PositiveBigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    payload = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    created_by = models.CharField(max_length=100)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["entity", "entity_id", "seq"]),
+        ]
+
+    def __str__(self):
+        return f"{self.seq} - {self.entity} {self.entity_id} {self.action}"
+
+
+# Responses of POST requests sent with an Idempotency-Key header, replayed when a handheld retries the same request
+class IdempotencyKey(models.Model):
+    STATUS_IN_PROGRESS = "in_progress"
+    STATUS_COMPLETED = "completed"
+
+    STATUS_CHOICES = [
+        (STATUS_IN_PROGRESS, "In progress"),
+        (STATUS_COMPLETED, "Completed"),
+    ]
+
+    key = models.CharField(max_length=100)
+    user = models.CharField(max_length=100)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_IN_PROGRESS)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = [("user", "key")]
+
+    def __str__(self):
+        return f"{self.user} - {self.key}"
+
+
+# Batches closed long ago, moved out of the production tables by `manage.py archive_closed_batches`.
+# The whole batch (stage, history, rejections, qc summaries, balance) is kept as one JSON document.
+class ArchivedBatch(models.Model):
+    batch_id = models.PositiveBigIntegerField(unique=True)
+    mpo = models.CharField(max_length=50, db_index=True)
+    size = models.CharField(max_length=20)
+    color = models.CharField(max_length=20)
+    closed_at = models.DateTimeField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    document = models.JSONField(encoder=DjangoJSONEncoder)
+
+    def __str__(self):
+        return f"{self.batch_id}"
+
+
+# Bundles of the archived batches, kept as rows so a bundle or garment barcode can still be looked up by index
+class ArchivedBundle(models.Model):
+    bundle_id = models.PositiveBigIntegerField(unique=True)
+    bundle_barcode = models.CharField(max_length=100, unique=True)
+    mpo = models.CharField(max_length=100)
+    marker = models.CharField(max_length=100, default="")
+    bundle_no = models.PositiveIntegerField(null=True)
+    archived_batch = models.ForeignKey(ArchivedBatch, on_delete=models.CASCADE, related_name="bundles")
+    document = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        # A bundle can't be received again once archived, see ReceivedBundleSerializer.validate
+        indexes = [models.Index(fields=["mpo", "marker", "bundle_no"])]
+
+    def __str__(self):
+        return self.bundle_barcode
+
+
+# Pieces that entered, closed and were rejected at a stage per production day and shift (settings.PRODUCTION_SHIFTS).
+# Filled in from the change events by `manage.py update_daily_snapshots`, so the daily report never reads the history.
+class DailyStageSnapshot(models.Model):
+    day = models.DateField()
+    shift = models.CharField(max_length=20)
+    stage = models.ForeignKey(StageName, on_delete=models.PROTECT, related_name="+")
+    batches_entered = models.PositiveIntegerField(default=0)
+    pieces_entered = models.PositiveIntegerField(default=0)
+    batches_closed = models.PositiveIntegerField(default=0)
+    pieces_closed = models.PositiveIntegerField(default=0)
+    pieces_rejected = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [
+            ("day", "shift", "stage"),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.shift} - {self.stage_id}"
+
+
+# How far a job that follows the change events has got, name -> seq of the last event it has taken into account
+class SnapshotWatermark(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    seq = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.seq}"
@@ -0,0 +1,70 @@
+import hashlib
+import json
+from functools import lru_cache
+
+from django.db import IntegrityError, transaction
+
+from .models import PlanningRouteStep, RouteTemplate
+from .stages import stage_id, stage_name
+
+
+# Hashed on the stage ids, a renamed stage keeps matching the templates made before the rename
+def route_hash(stages):
+    return hashlib.sha256(json.dumps([stage_id(stage) for stage in stages]).encode()).hexdigest()
+
+def create_route_steps(templates_with_stages):
+    PlanningRouteStep.objects.bulk_create([
+        PlanningRouteStep(
+            route=template,
+            sequence=index + 1,
+            stage_id=stage_id(stage),
+        )
+        for (template, stages) in templates_with_stages
+        for (index, stage) in enumerate(stages)
+    ], batch_size=1000)
+
+# The template for this ordered list of stages, created on first use
+def get_route_template(stages):
+    content_hash = route_hash(stages)
+    template = RouteTemplate.objects.filter(content_hash=content_hash).first()
+    
+    if template is None:
+        try:
+            with transaction.atomic():
+                template = RouteTemplate.objects.create(content_hash=content_hash)
+                create_route_steps([(template, stages)])
+        except IntegrityError:
+            # Another request created the same template in the meantime
+            template = RouteTemplate.objects.get(content_hash=content_hash)
+    
+    return template
+
+# Same as get_route_template for many routes at once, returns {content_hash: template}
+def get_route_templates(routes):
+    routes = {route_hash(stages): stages for stages in routes}
+    templates = RouteTemplate.objects.in_bulk(list(routes), field_name="content_hash")
+    missing = [content_hash for content_hash in routes if content_hash not in templates]
+    
+    if missing:
+        try:
+            with transaction.atomic():
+                created = RouteTemplate.objects.bulk_create([
+                    RouteTemplate(content_hash=content_hash)
+                    for content_hash in missing
+                ])
+                create_route_steps([(template, routes[template.content_hash]) for template in created])
+        except IntegrityError:
+            # Another request created some of the same templates in the meantime, take them one by one
+            created = [get_route_template(routes[content_hash]) for content_hash in missing]
+        templates.update({template.content_hash: template for template in created})
+    
+    return templates
+
+# Ordered stage ids of a template. Templates never change, so this is cached per worker for as long as it lives.
+@lru_cache(maxsize=4096)
+def get_route_stage_ids(route_id):
+    return tuple(PlanningRouteStep.objects.filter(route_id=route_id).order_by("sequence").values_list("stage_id", flat=True))
+
+# Ordered stage names of a template, named through the stage map so a rename shows up without a restart
+def get_route(route_id):
+    return tuple(stage_name(step_stage_id) for step_stage_id in get_route_stage_ids(route_id))
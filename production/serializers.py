@@ -1,7 +1,12 @@
 from .import models
+from .events import build_event, record_balance_events, record_event, record_events
+from .exceptions import Conflict
+from .routes import get_route, get_route_template, get_route_templates, route_hash
+from .stage_machine import get_stage_machine, stage_state
+from .stages import StageNameField, stage_name, unknown_stages
 from rest_framework import serializers
-from django.db import transaction
-from django.db.models import F, Max
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.utils import timezone
 
 
@@ -12,12 +17,64 @@ def get_user_name(request):
         else "system"
     )
 
+# Fetch all the objects of a list of primary keys with one IN query, every missing pk is reported in one error
+def resolve_primary_keys(queryset, pks):
+    found = queryset.in_bulk(pks)
+    missing = [pk for pk in dict.fromkeys(pks) if pk not in found]
+    
+    if missing:
+        raise serializers.ValidationError(
+            f"Invalid pk(s) {', '.join(map(str, missing))} - object does not exist."
+        )
+    
+    return found
+
+# Primary key field that only checks the type of the pk, BulkRelatedListSerializer attaches the instance.
+# Use it in item serializers whose Meta.list_serializer_class is BulkRelatedListSerializer.
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+# Resolves the BulkPrimaryKeyRelatedFields of all the items with one query per field instead of one per item
+class BulkRelatedListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        
+        for field in self.child.fields.values():
+            if not isinstance(field, BulkPrimaryKeyRelatedField) or field.read_only:
+                continue
+            
+            pks = [item[field.source] for item in items if field.source in item]
+            instances = resolve_primary_keys(field.get_queryset(), pks)
+            
+            for item in items:
+                if field.source in item:
+                    item[field.source] = instances[item[field.source]]
+        
+        return items
+
 class StageNameSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.StageName
         fields = ["id","stage","last_update"]
 
+# Stages of a route must exist and can't repeat, the route steps point to them by id
+def validate_route_stages(stages):
+    unknown = unknown_stages(stages)
+    if unknown:
+        raise serializers.ValidationError(f"Unknown stages: {', '.join(unknown)}")
+    if len(stages) != len(set(stages)):
+        raise serializers.ValidationError("A stage can't appear twice in a route.")
+    return stages
+
 class PlanningRouteStepSerializer(serializers.ModelSerializer):
+    stage = StageNameField(source="stage_id", read_only=True)
+    
     class Meta:
         model= models.PlanningRouteStep
         fields = ["id","sequence","stage"]
@@ -31,6 +88,9 @@ class UpdatePlanningSerializer(serializers.ModelSerializer):
         model= models.Planning
         fields = ["stages"]
     
+    def validate_stages(self, stages):
+        return validate_route_stages(stages)
+    
     def update(self, instance:models.Planning, validated_data):
         
         # If any of the batches of this mpo is already in the processing, we won't update the route plan  
@@ -40,28 +100,18 @@ class UpdatePlanningSerializer(serializers.ModelSerializer):
         else:
             with transaction.atomic():
                 
-                # Update the planning
+                # Point the planning to the template of the new route, the old template stays for the other plannings using it
+                instance.route = get_route_template(validated_data["stages"])
                 instance.updated_by = get_user_name(self.context["request"])
                 instance.last_update = timezone.now()
                 instance.save()
                 
-                # Delete the existing routes for this planning
-                instance.route_steps.all().delete()
-                
-                # Create new routes for this planning
-                models.PlanningRouteStep.objects.bulk_create([
-                        models.PlanningRouteStep(
-                            planning=instance,
-                            sequence = index+1,
-                            stage = stage
-                        )
-                        for (index,stage) in enumerate(validated_data["stages"])
-                    ])
+                record_event(instance, models.ChangeEvent.ACTION_UPDATED, instance.updated_by, stages=validated_data["stages"])
                 
             return instance
     
 class PlanningSerializer(serializers.ModelSerializer):
-    route_steps = PlanningRouteStepSerializer(many=True, read_only = True)
+    route_steps = PlanningRouteStepSerializer(source="route.route_steps", many=True, read_only = True)
     
     # Stages will be be sent by the client
     stages = serializers.ListField(
@@ -70,38 +120,150 @@ class PlanningSerializer(serializers.ModelSerializer):
     )
     class Meta:
         model= models.Planning
-        fields = ["id","mpo","updated_by","last_update","route_steps","stages"]
-        read_only_fields = ["updated_by"]
+        fields = ["id","mpo","route","updated_by","last_update","route_steps","stages"]
+        read_only_fields = ["route","updated_by"]
+    
+    def validate_stages(self, stages):
+        return validate_route_stages(stages)
            
     def create(self, validated_data):
         with transaction.atomic():
-            # Create Planning
+            # Create Planning with the shared template of its route
             planning = models.Planning.objects.create(
                 mpo=validated_data["mpo"],
+                route=get_route_template(validated_data["stages"]),
                 updated_by=get_user_name(self.context["request"])
             )
             
-            # Create Route Steps for the created Planning
-            models.PlanningRouteStep.objects.bulk_create([
-                models.PlanningRouteStep(
-                    planning=planning,
-                    sequence = index+1,
-                    stage = stage
-                )
-                for (index,stage) in enumerate(validated_data["stages"])
-            ])
+            record_event(planning, models.ChangeEvent.ACTION_CREATED, planning.updated_by, stages=validated_data["stages"])
             
             return planning
         
+class PlanningImportItemSerializer(serializers.Serializer):
+    mpo = serializers.CharField(max_length=100)
+    stages = serializers.ListField(
+        child=serializers.CharField(max_length=100),
+        allow_empty=False,
+    )
+
+class BulkPlanningImportSerializer(serializers.Serializer):
+    RESULT_CREATED = "created"
+    RESULT_UPDATED = "updated"
+    RESULT_UNCHANGED = "unchanged"
+    RESULT_SKIPPED = "skipped"
+    RESULT_ERROR = "error"
+    
+    plannings = PlanningImportItemSerializer(many=True, allow_empty=False, max_length=5000)
+    
+    # Returns one result per MPO, MPOs with an error are left out and the rest are still imported
+    def create(self, validated_data):
+        entries = validated_data["plannings"]
+        user = get_user_name(self.context["request"])
+        now = timezone.now()
+        results = {}
+        
+        # Every lookup below is one query for the whole import
+        all_stages = {stage for entry in entries for stage in entry["stages"]}
+        known_stages = set(models.StageName.objects.filter(stage__in=all_stages).values_list("stage", flat=True))
+        
+        mpos = [entry["mpo"] for entry in entries]
+        existing = {
+            planning.mpo: planning
+            for planning in models.Planning.objects.filter(mpo__in=mpos).select_related("route")
+        }
+        started = set(
+            models.BatchStage.objects.filter(batch__mpo__in=list(existing)).values_list("batch__mpo", flat=True).distinct()
+        )
+        
+        to_create = []
+        to_update = []
+        
+        for entry in entries:
+            mpo, stages = entry["mpo"], entry["stages"]
+            unknown = sorted(set(stages) - known_stages)
+            
+            if mpo in results:
+                results[mpo] = {"mpo": mpo, "result": self.RESULT_ERROR, "detail": "This MPO appears more than once in the import."}
+            elif unknown:
+                results[mpo] = {"mpo": mpo, "result": self.RESULT_ERROR, "detail": f"Unknown stages: {', '.join(unknown)}"}
+            elif len(stages) != len(set(stages)):
+                results[mpo] = {"mpo": mpo, "result": self.RESULT_ERROR, "detail": "A stage can't appear twice in a route."}
+            elif mpo not in existing:
+                to_create.append(entry)
+                results[mpo] = {"mpo": mpo, "result": self.RESULT_CREATED}
+            elif existing[mpo].route.content_hash == route_hash(stages):
+                results[mpo] = {"mpo": mpo, "result": self.RESULT_UNCHANGED}
+            elif mpo in started:
+                results[mpo] = {"mpo": mpo, "result": self.RESULT_SKIPPED, "detail": "One of the batches of this MPO is already in processing."}
+            else:
+                to_update.append(entry)
+                results[mpo] = {"mpo": mpo, "result": self.RESULT_UPDATED}
+        
+        # Drop the entries of MPOs that turned out to be duplicated
+        to_create = [entry for entry in to_create if results[entry["mpo"]]["result"] == self.RESULT_CREATED]
+        to_update = [entry for entry in to_update if results[entry["mpo"]]["result"] == self.RESULT_UPDATED]
+        
+        with transaction.atomic():
+            # Most MPOs share a handful of routes, so only the new distinct routes get steps inserted
+            templates = get_route_templates(entry["stages"] for entry in to_create + to_update)
+            
+            created = models.Planning.objects.bulk_create([
+                models.Planning(mpo=entry["mpo"], route=templates[route_hash(entry["stages"])], updated_by=user)
+                for entry in to_create
+            ])
+            
+            updated = [existing[entry["mpo"]] for entry in to_update]
+            for planning, entry in zip(updated, to_update):
+                planning.route = templates[route_hash(entry["stages"])]
+                planning.updated_by = user
+                planning.last_update = now
+            models.Planning.objects.bulk_update(updated, ["route", "updated_by", "last_update"])
+            
+            plannings = [(planning, entry["stages"]) for planning, entry in zip(created, to_create)]
+            plannings += [(planning, entry["stages"]) for planning, entry in zip(updated, to_update)]
+            
+            created_ids = {planning.id for planning in created}
+            models.ChangeEvent.objects.bulk_create([
+                build_event(
+                    planning,
+                    models.ChangeEvent.ACTION_CREATED if planning.id in created_ids else models.ChangeEvent.ACTION_UPDATED,
+                    user,
+                    stages=stages,
+                )
+                for (planning, stages) in plannings
+            ], batch_size=1000)
+        
+        for planning in created:
+            results[planning.mpo]["id"] = planning.id
+        for planning in updated:
+            results[planning.mpo]["id"] = planning.id
+        
+        return list(results.values())
+
 class ReceivedBundleSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.ReceivedBundle
         fields = ["id","so","mpo","buyer","style","marker","bundle_no","bundle_barcode","size","shade","color","quantity","received_at","received_by","status"]
         read_only_fields = ("received_by", "status", "received_at")
+    
+    # Archived bundles are no longer in the bundle table, but their barcode and bundle number stay taken
+    def validate(self, attrs):
+        archived = models.ArchivedBundle.objects
+        
+        if archived.filter(bundle_barcode=attrs["bundle_barcode"]).exists():
+            raise serializers.ValidationError({"bundle_barcode": "This bundle barcode belongs to an archived bundle."})
+        
+        if archived.filter(mpo=attrs["mpo"], marker=attrs["marker"], bundle_no=attrs["bundle_no"]).exists():
+            raise serializers.ValidationError("This bundle was already received and is archived.")
+        
+        return attrs
                   
     def create(self, validated_data):
         validated_data ["received_by"] = get_user_name(self.context["request"])
-        return super().create(validated_data)    
+        with transaction.atomic():
+            bundle = super().create(validated_data)
+            record_event(bundle, models.ChangeEvent.ACTION_CREATED, bundle.received_by)
+        return bundle
     
 class BatchBundleSerializer(serializers.ModelSerializer):
     quantity = serializers.SerializerMethodField(method_name="get_quantity", read_only=True)
@@ -162,27 +324,27 @@ class BatchSerializer(serializers.ModelSerializer):
         received_queryset = models.ReceivedBundle.objects.filter(id__in=scanned_ids)
 
         # Check if all the scanned bundles exist or not
-        if received_queryset.count() != len(scanned_ids):
+        try:
+            received_bundles = list(resolve_primary_keys(models.ReceivedBundle.objects.all(), scanned_ids).values())
+        except serializers.ValidationError as exc:
             raise serializers.ValidationError(
-                "One or more bundles do not exist in the received section."
+                f"One or more bundles do not exist in the received section. {exc.detail[0]}"
             )
         
         # Check if any of the bundles is allocated       
-        if received_queryset.filter(
-            status=models.ReceivedBundle.STATUS_ALLOCATED
-        ).exists():
+        allocated = [bundle.id for bundle in received_bundles if bundle.status == models.ReceivedBundle.STATUS_ALLOCATED]
+        if allocated:
             raise serializers.ValidationError(
-                "One or more bundles are already allocated."
+                f"One or more bundles are already allocated: {', '.join(map(str, allocated))}"
             )
 
         # Same MPO, Size, and Color Validation
-        first = received_queryset.first()
+        first = received_bundles[0]
 
-        if not received_queryset.filter(
-            mpo=first.mpo,
-            size=first.size,
-            color=first.color,
-        ).count() == received_queryset.count():
+        if any(
+            (bundle.mpo, bundle.size, bundle.color) != (first.mpo, first.size, first.color)
+            for bundle in received_bundles
+        ):
             raise serializers.ValidationError(
                 "All bundles must have same MPO, size, and color."
             )
@@ -211,129 +373,181 @@ class BatchSerializer(serializers.ModelSerializer):
                     batch=batch,
                     received=received_bundle
                 )
-                for received_bundle in received_queryset
+                for received_bundle in received_bundles
             ]) 
             
-            # Mark received bundles as allocated
-            received_queryset.update(
+            # Mark received bundles as allocated, only if nobody allocated them in the meantime
+            allocated_count = received_queryset.filter(
+                status=models.ReceivedBundle.STATUS_RECEIVED
+            ).update(
                 status=models.ReceivedBundle.STATUS_ALLOCATED
             )
             
+            if allocated_count != len(received_bundles):
+                raise serializers.ValidationError(
+                    "One or more bundles were allocated by another request, please try again."
+                )
+            
+            for received_bundle in received_bundles:
+                received_bundle.status = models.ReceivedBundle.STATUS_ALLOCATED
+            
+            # Open the balance of this batch
+            produced_quantity = sum(received_bundle.quantity for received_bundle in received_bundles)
+            balance = models.BatchBalance.objects.create(
+                batch=batch,
+                produced_quantity=produced_quantity,
+                available_quantity=produced_quantity,
+            )
+            
+            record_event(batch, models.ChangeEvent.ACTION_CREATED, batch.updated_by, bundles=scanned_ids)
+            record_event(balance, models.ChangeEvent.ACTION_CREATED, batch.updated_by)
+            record_events(received_bundles, models.ChangeEvent.ACTION_UPDATED, batch.updated_by)
+            
             return batch   
 
+class DissolveBatchesSerializer(serializers.Serializer):
+    batches = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=1000,
+    )
+    
+    def validate_batches(self, batch_ids):
+        batch_ids = list(dict.fromkeys(batch_ids))
+        resolve_primary_keys(models.Batch.objects.all(), batch_ids)
+        return batch_ids
+
 class BatchStageHistorySerializer(serializers.ModelSerializer):
+    stage = StageNameField(source="stage_id", read_only=True)
+    
     class Meta:
         model = models.BatchStageHistory
         fields = ["id","batch","stage","sequence","entered_at","closed_at","entered_by","closed_by"]
 
+# Another scanner moved the batch between loading its stage and saving the transition
+def stage_conflict(batch_id):
+    return Conflict(f"Batch {batch_id} was moved to another stage by a different scan, please scan again.")
+
+# Saves a transition only when the stage still has the version it was checked against. The loser of two
+# concurrent scans updates no row and gets a 409 instead of a second history row.
+def save_transition(instance:models.BatchStage, validated_data):
+    changes = {attr: value for attr, value in validated_data.items() if attr != "batch"}
+    
+    changes["updated_at"] = timezone.now()
+    
+    updated = models.BatchStage.objects.filter(batch_id=instance.batch_id, version=instance.version).update(version=F("version") + 1, **changes)
+    if not updated:
+        raise stage_conflict(instance.batch_id)
+    
+    for attr, value in changes.items():
+        setattr(instance, attr, value)
+    instance.version += 1
+
 class BatchStageSerializer(serializers.ModelSerializer):
+    current_stage = StageNameField(source="current_stage_id")
+    
     class Meta:
         model = models.BatchStage
-        fields = ["batch","current_stage","sequence","current_status"]
+        fields = ["batch","current_stage","sequence","current_status","version"]
+        read_only_fields = ["version"]
+        # One stage per batch is the primary key, a concurrent first scan is turned into a 409 by create
+        extra_kwargs = {"batch": {"validators": []}}
+    
+    # The transition is checked against the route's table before anything is written
+    def validate(self, attrs):
+        self.stage_machine = self.context.get("stage_machine") or get_stage_machine(attrs["batch"].planning.route_id)
+        self.stage_machine.check(stage_state(self.instance), (attrs["sequence"], attrs["current_status"]))
+        return attrs
             
     def update(self, instance:models.BatchStage, validated_data):        
-        # When the request is for Closed
-        if validated_data["current_status"] == "closed":
-            
-            # Is the closing for the same stage
-            if instance.sequence == validated_data["sequence"]:
-                
-                # If the same stage's status is In
-                if instance.current_status == "in":
-                    with transaction.atomic():   
-                        try:
-                            history = models.BatchStageHistory.objects.get(
-                                sequence=instance.sequence,
-                                batch=instance.batch
-                            )
-                        except models.BatchStageHistory.DoesNotExist:
-                            raise serializers.ValidationError(
-                                "It seems you didn't enter into this stage, so closing is not possible"
-                            )
-                        
-                        # Update the stage    
-                        for attr, value in validated_data.items():
-                            setattr(instance, attr, value)
-                        instance.save()
-                        
-                        # Update the stage history
-                        history.closed_at = timezone.now()
-                        history.closed_by = get_user_name(self.context["request"])
-                        history.save()
-                        
-                        # Update the batch status if it's closing for the last stage
-                        max_sequence = (instance.batch.planning.route_steps.aggregate(max_seq=Max("sequence")).get("max_seq"))
-                        
-                        if instance.sequence == max_sequence:
-                            instance.batch.status = "closed"
-                            instance.batch.save(update_fields=["status"])       
-    
-                # When the stage is already closed    
-                else:
-                    raise serializers.ValidationError(f"{instance.current_stage} is already {instance.current_status}")
-            
-            # Is the closing is for the next stage
-            elif instance.sequence < validated_data["sequence"]:
-                raise serializers.ValidationError(f"You have to complete the previous stages first. Your current stage is {instance.current_stage} and current status is {instance.current_status}")
-            
-            # When the closing is for the previous stage
-            else:    
-                raise serializers.ValidationError(f"You have already completed this stage. Your current stage is {instance.current_stage} and current status is {instance.current_status}")
+        batch = validated_data["batch"]
+        user = get_user_name(self.context["request"])
         
-        # When the request is for In
-        else:
-            # Check if it's the next stage or not
-            if instance.sequence < validated_data["sequence"]:
-                
-                # Check if it's actually the immediate next stage and if the previous stage is closed?
-                if instance.sequence + 1 == validated_data["sequence"] and instance.current_status=="closed":
-                    with transaction.atomic():
-                        for attr, value in validated_data.items():
-                            setattr(instance, attr, value)
-                        instance.save()
-                        
-                        # Create history for this stage change
-                        models.BatchStageHistory.objects.create(batch=instance.batch, stage=instance.current_stage, sequence=instance.sequence, entered_at=timezone.now(), entered_by=get_user_name(self.context["request"]))
+        with transaction.atomic():
+            # Update the stage first, it holds the row until the history is written
+            save_transition(instance, validated_data)
+            record_event(instance, models.ChangeEvent.ACTION_UPDATED, user)
+            
+            # Closing the current stage
+            if instance.current_status == models.BatchStage.STATUS_CLOSED:
+                try:
+                    history = models.BatchStageHistory.objects.get(
+                        sequence=instance.sequence,
+                        batch_id=instance.batch_id
+                    )
+                except models.BatchStageHistory.DoesNotExist:
+                    raise serializers.ValidationError(
+                        "It seems you didn't enter into this stage, so closing is not possible"
+                    )
                 
-                # When it's not the immediate next stage    
-                else:
-                    route = instance.batch.planning.route_steps.get(sequence = instance.sequence + 1)
-                    raise serializers.ValidationError(f"Your current stage is {instance.current_stage} and the current staus is {instance.current_status}. You have to close the current stage to go to the next stage, and your next stage is {route.stage}")
+                history.closed_at = timezone.now()
+                history.closed_by = user
+                history.save(update_fields=["closed_at", "closed_by"])
+                record_event(history, models.ChangeEvent.ACTION_UPDATED, user)
                 
-            # Check if it's the same stage    
-            elif instance.sequence == validated_data["sequence"]:
-                    raise serializers.ValidationError(f"You're already in {instance.current_stage} and the status is {instance.current_status}")    
+                # Update the batch status if it's closing for the last stage
+                if self.stage_machine.closes_batch((instance.sequence, instance.current_status)):
+                    batch.status = models.Batch.STATUS_CLOSED
+                    batch.save(update_fields=["status"])
+                    record_event(batch, models.ChangeEvent.ACTION_UPDATED, user)
             
-            # If it's the previous stage        
+            # Entering the next stage
             else:
-                raise serializers.ValidationError(f"You've already completed this stage, your current stage is {instance.current_stage} and the status is {instance.current_status}")
+                history = models.BatchStageHistory.objects.create(batch_id=instance.batch_id, stage_id=instance.current_stage_id, sequence=instance.sequence, entered_at=timezone.now(), entered_by=user)
+                record_event(history, models.ChangeEvent.ACTION_CREATED, user)
         
         return instance    
           
     def create(self, validated_data):
-        sequence = validated_data["sequence"]
-        current_status = validated_data ["current_status"]
-        
-        if sequence == 1 and current_status == "in":
+        try:
             with transaction.atomic(): 
                 batch_stage = models.BatchStage.objects.create(**validated_data)
                 
                 # Now create corresponding stage history
-                models.BatchStageHistory.objects.create(batch=batch_stage.batch, stage=batch_stage.current_stage,sequence=batch_stage.sequence, entered_at = timezone.now(), entered_by = get_user_name(self.context["request"]))
+                history = models.BatchStageHistory.objects.create(batch_id=batch_stage.batch_id, stage_id=batch_stage.current_stage_id,sequence=batch_stage.sequence, entered_at = timezone.now(), entered_by = get_user_name(self.context["request"]))
                 
-            return batch_stage
+                record_event(batch_stage, models.ChangeEvent.ACTION_CREATED, history.entered_by)
+                record_event(history, models.ChangeEvent.ACTION_CREATED, history.entered_by)
+        
+        # Another scan entered the first stage since the view found no stage for this batch
+        except IntegrityError:
+            raise stage_conflict(validated_data["batch"].id)
             
-        else:
-            batch = validated_data["batch"]
-            route = batch.planning.route_steps.get(sequence=1)
-            raise serializers.ValidationError(f"Please follow the route plan. Your first stage is {route.stage} and first task should be in")
+        return batch_stage
                 
+# A batch waiting in the queue of a stage, its BatchStage is closed at the step before it
+class StageQueueSerializer(serializers.ModelSerializer):
+    mpo = serializers.CharField(source="batch.mpo", read_only=True)
+    size = serializers.CharField(source="batch.size", read_only=True)
+    color = serializers.CharField(source="batch.color", read_only=True)
+    previous_stage = StageNameField(source="current_stage_id", read_only=True)
+    sequence = serializers.IntegerField(source="queue_sequence", read_only=True)
+    waiting_since = serializers.DateTimeField(source="updated_at", read_only=True)
+    waiting_seconds = serializers.SerializerMethodField(method_name="get_waiting_seconds", read_only=True)
+    
+    class Meta:
+        model = models.BatchStage
+        fields = ["batch","mpo","size","color","previous_stage","sequence","version","waiting_since","waiting_seconds"]
+    
+    def get_waiting_seconds(self, batch_stage):
+        return int((self.context["now"] - batch_stage.updated_at).total_seconds())
+
+class DailyStageSnapshotSerializer(serializers.ModelSerializer):
+    stage = StageNameField(source="stage_id", read_only=True)
+    
+    class Meta:
+        model = models.DailyStageSnapshot
+        fields = ["day","shift","stage","batches_entered","pieces_entered","batches_closed","pieces_closed","pieces_rejected"]
+
 class BatchQcStageSummarySerializer(serializers.ModelSerializer):
+    stage = StageNameField(source="stage_id", read_only=True)
+    
     class Meta:
         model = models.BatchQcStageSummary
         fields = ["id","batch","stage","rejection_count","last_update"]                
             
 class RejectionSerializer(serializers.ModelSerializer):
+    stage = StageNameField(source="stage_id")
     details = serializers.SerializerMethodField(method_name="get_details",read_only=True)
     
     class Meta:
@@ -386,9 +600,9 @@ class RejectionSerializer(serializers.ModelSerializer):
 
         # Check the batch stage and status
         try:
-            models.BatchStage.objects.get(batch=batch, current_stage=validated_data["stage"], current_status="in")      
+            models.BatchStage.objects.get(batch=batch, current_stage_id=validated_data["stage_id"], current_status="in")      
         except models.BatchStage.DoesNotExist:
-            raise serializers.ValidationError(f"The batch must be in {validated_data['stage']} and the current status should be in")
+            raise serializers.ValidationError(f"The batch must be in {stage_name(validated_data['stage_id'])} and the current status should be in")
         
         # Create Rejection and update BatchQcStageSummary
         with transaction.atomic():
@@ -397,11 +611,21 @@ class RejectionSerializer(serializers.ModelSerializer):
                 self.context["request"]
             )
 
+            # A rejected garment is no longer available for washing, the last available one may already be in a wash
+            updated = models.BatchBalance.objects.filter(batch=batch, available_quantity__gt=0).update(
+                rejected_quantity=F("rejected_quantity") + 1,
+                available_quantity=F("available_quantity") - 1,
+                last_update=timezone.now(),
+            )
+            if not updated:
+                raise serializers.ValidationError("No garment of this batch is left to reject, all of them are washed or rejected.")
+            
             rejection = models.Rejection.objects.create(**validated_data)
+            record_balance_events([batch.id], rejection.rejected_by)
 
             summary, created = models.BatchQcStageSummary.objects.get_or_create(
                 batch=rejection.batch,
-                stage=rejection.stage,
+                stage_id=rejection.stage_id,
                 defaults={
                     "rejection_count": 1,
                     "last_update": timezone.now(),
@@ -412,10 +636,20 @@ class RejectionSerializer(serializers.ModelSerializer):
                 summary.rejection_count = F("rejection_count") + 1
                 summary.last_update = timezone.now()
                 summary.save(update_fields=["rejection_count", "last_update"])
+                summary.refresh_from_db(fields=["rejection_count"])
+
+            record_event(rejection, models.ChangeEvent.ACTION_CREATED, rejection.rejected_by)
+            record_event(
+                summary,
+                models.ChangeEvent.ACTION_CREATED if created else models.ChangeEvent.ACTION_UPDATED,
+                rejection.rejected_by,
+            )
 
         return rejection  
         
 class UpdateRejectionSerializer(serializers.ModelSerializer):
+    stage = StageNameField(source="stage_id", read_only=True)
+    
     class Meta:
         model = models.Rejection
         fields = ["id","individual_barcode","batch","stage","reason","rejected_at","rejected_by"]
@@ -425,5 +659,79 @@ class UpdateRejectionSerializer(serializers.ModelSerializer):
          instance.reason = validated_data["reason"]
          instance.rejected_at = timezone.now()
          instance.rejected_by = get_user_name(self.context["request"])
-         instance.save(update_fields=["reason", "rejected_at", "rejected_by"])
-         return instance
\ No newline at end of file
+         with transaction.atomic():
+             instance.save(update_fields=["reason", "rejected_at", "rejected_by"])
+             record_event(instance, models.ChangeEvent.ACTION_UPDATED, instance.rejected_by)
+         return instance
+
+class ChangeEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.ChangeEvent
+        fields = ["seq","entity","entity_id","action","payload","created_at","created_by"]
+
+class BatchBalanceSerializer(serializers.ModelSerializer):
+    mpo = serializers.CharField(source="batch.mpo", read_only=True)
+    size = serializers.CharField(source="batch.size", read_only=True)
+    color = serializers.CharField(source="batch.color", read_only=True)
+    status = serializers.CharField(source="batch.status", read_only=True)
+    
+    class Meta:
+        model = models.BatchBalance
+        fields = ["batch","mpo","size","color","status","produced_quantity","rejected_quantity","washed_quantity","available_quantity","last_update"]
+
+class ArchivedBatchListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.ArchivedBatch
+        fields = ["batch_id","mpo","size","color","closed_at","archived_at"]
+
+class ArchivedBatchSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.ArchivedBatch
+        fields = ["batch_id","mpo","size","color","closed_at","archived_at","document"]
+
+# Trace of a garment, bundle or batch (productions/trace/). Everything below reads prefetched rows only.
+class TraceWashSourceSerializer(serializers.Serializer):
+    batch_for_first_wash = serializers.IntegerField(source="batch_for_first_wash_id")
+    shade = serializers.CharField(source="batch_for_first_wash.shade")
+    created_at = serializers.DateTimeField(source="batch_for_first_wash.created_at")
+    created_by = serializers.CharField(source="batch_for_first_wash.created_by")
+    quantity = serializers.IntegerField()
+
+class TraceBundleSerializer(ReceivedBundleSerializer):
+    wash = TraceWashSourceSerializer(source="firstwashbundlesource_set", many=True, read_only=True)
+    
+    class Meta(ReceivedBundleSerializer.Meta):
+        fields = ReceivedBundleSerializer.Meta.fields + ["wash"]
+
+class TraceRejectionSerializer(serializers.ModelSerializer):
+    stage = StageNameField(source="stage_id", read_only=True)
+    
+    class Meta:
+        model = models.Rejection
+        fields = ["id","individual_barcode","stage","reason","rejected_at","rejected_by"]
+
+class TraceBalanceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.BatchBalance
+        fields = ["produced_quantity","rejected_quantity","washed_quantity","available_quantity","last_update"]
+
+class TraceBatchSerializer(serializers.ModelSerializer):
+    planning = serializers.CharField(source="planning.mpo", read_only=True)
+    route = serializers.SerializerMethodField(method_name="get_route", read_only=True)
+    stage = BatchStageSerializer(read_only=True, allow_null=True)
+    balance = TraceBalanceSerializer(read_only=True, allow_null=True)
+    history = BatchStageHistorySerializer(source="stage_history", many=True, read_only=True)
+    rejections = TraceRejectionSerializer(many=True, read_only=True)
+    qc_stage_summaries = BatchQcStageSummarySerializer(many=True, read_only=True)
+    bundles = serializers.SerializerMethodField(method_name="get_bundles", read_only=True)
+    wash = TraceWashSourceSerializer(source="firstwashbatchsource_set", many=True, read_only=True)
+    
+    class Meta:
+        model = models.Batch
+        fields = ["id","mpo","size","color","status","planning","route","updated_at","updated_by","stage","balance","history","rejections","qc_stage_summaries","bundles","wash"]
+    
+    def get_route(self, batch):
+        return list(get_route(batch.planning.route_id))
+    
+    def get_bundles(self, batch):
+        return ReceivedBundleSerializer([batch_bundle.received for batch_bundle in batch.batch_bundles.all()], many=True).data
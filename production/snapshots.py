@@ -0,0 +1,196 @@
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Min, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import BatchStageHistory, ChangeEvent, DailyStageSnapshot, Rejection, SnapshotWatermark
+
+# Name of the SnapshotWatermark row of the daily stage snapshots
+DAILY_STAGE_WATERMARK = "daily-stage-snapshot"
+
+# Change events that move a count of the snapshots, entity -> payload fields holding the moments that are counted
+TRACKED = {
+    BatchStageHistory._meta.label_lower: ("entered_at", "closed_at"),
+    Rejection._meta.label_lower: ("rejected_at",),
+}
+
+
+# [(start, name)] of settings.PRODUCTION_SHIFTS in the order of the day
+def shift_starts():
+    return sorted((time.fromisoformat(start), name) for name, start in settings.PRODUCTION_SHIFTS.items())
+
+# Production day and shift of a moment. The day begins with the first shift, so the hours after midnight belong
+# to the last shift of the day before.
+def production_shift(moment, starts=None):
+    local = timezone.localtime(moment)
+    starts = starts or shift_starts()
+
+    if local.time() < starts[0][0]:
+        return local.date() - timedelta(days=1), starts[-1][1]
+
+    shift = starts[0][1]
+    for start, name in starts:
+        if local.time() >= start:
+            shift = name
+    return local.date(), shift
+
+def day_window(day):
+    first = shift_starts()[0][0]
+    start = timezone.make_aware(datetime.combine(day, first))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), first))
+    return start, end
+
+# Snapshot rows of one production day, read through the indexes on entered_at, closed_at and rejected_at.
+# Pieces are the produced quantity of the batch.
+def compute_day(day):
+    start, end = day_window(day)
+    starts = shift_starts()
+    counts = defaultdict(Counter)
+
+    entered = (
+        BatchStageHistory.objects.filter(entered_at__gte=start, entered_at__lt=end)
+        .order_by()
+        .values_list("stage_id", "entered_at", "batch__balance__produced_quantity")
+    )
+    for stage_id, moment, quantity in entered:
+        key = (production_shift(moment, starts)[1], stage_id)
+        counts[key]["batches_entered"] += 1
+        counts[key]["pieces_entered"] += quantity or 0
+
+    closed = (
+        BatchStageHistory.objects.filter(closed_at__gte=start, closed_at__lt=end)
+        .order_by()
+        .values_list("stage_id", "closed_at", "batch__balance__produced_quantity")
+    )
+    for stage_id, moment, quantity in closed:
+        key = (production_shift(moment, starts)[1], stage_id)
+        counts[key]["batches_closed"] += 1
+        counts[key]["pieces_closed"] += quantity or 0
+
+    rejected = Rejection.objects.filter(rejected_at__gte=start, rejected_at__lt=end).values_list("stage_id", "rejected_at")
+    for stage_id, moment in rejected:
+        counts[(production_shift(moment, starts)[1], stage_id)]["pieces_rejected"] += 1
+
+    return [
+        DailyStageSnapshot(day=day, shift=shift, stage_id=stage_id, **counter)
+        for (shift, stage_id), counter in counts.items()
+    ]
+
+# Replaces the snapshot rows of the given days, call it inside a transaction
+def rebuild_days(days):
+    rows = [row for day in sorted(days) for row in compute_day(day)]
+    DailyStageSnapshot.objects.filter(day__in=days).delete()
+    DailyStageSnapshot.objects.bulk_create(rows, batch_size=1000)
+
+def payload_days(entity, payload):
+    days = set()
+    for field in TRACKED[entity]:
+        moment = parse_datetime(payload.get(field) or "") if payload else None
+        if moment:
+            days.add(production_shift(moment)[0])
+    return days
+
+# Days whose counts the events may have changed: the days in the new payloads, and the days the row was counted
+# for before, taken from its earlier events (a delete event has no payload, an edit may move the row to another day)
+def changed_days(events):
+    days = set()
+    first_seq = {}
+
+    for seq, entity, entity_id, payload in events:
+        # Archiving takes old rows out of the production tables, the days they were counted for keep their counts
+        if payload and payload.get("archived"):
+            continue
+        days |= payload_days(entity, payload)
+        first_seq.setdefault((entity, entity_id), seq)
+
+    for entity in TRACKED:
+        ids = [entity_id for (name, entity_id) in first_seq if name == entity]
+        earlier = ChangeEvent.objects.filter(entity=entity, entity_id__in=ids, seq__lt=events[0][0]).values_list("payload", flat=True)
+        for payload in earlier:
+            days |= payload_days(entity, payload)
+
+    return days
+
+def get_watermark():
+    watermark, _ = SnapshotWatermark.objects.get_or_create(name=DAILY_STAGE_WATERMARK)
+    return watermark
+
+# The events of `queryset` that can be deleted without the snapshots missing a change. The job still needs the
+# events of tracked rows after the watermark, and the latest processed event of every live tracked row: its payload
+# holds the days the row is counted for, which are read again when the row changes next.
+def prunable_events(queryset):
+    watermark = get_watermark().seq
+    processed_later = ChangeEvent.objects.filter(
+        entity=OuterRef("entity"),
+        entity_id=OuterRef("entity_id"),
+        seq__gt=OuterRef("seq"),
+        seq__lte=watermark,
+    )
+    return queryset.exclude(
+        Q(entity__in=TRACKED)
+        & (Q(seq__gt=watermark) | ~Q(action=ChangeEvent.ACTION_DELETED) & ~Q(Exists(processed_later)))
+    )
+
+# Brings the snapshots up to date with the change events after the watermark, a chunk of events per transaction.
+# Whole days are recomputed, so an event committed after a later one was processed is picked up by the next change
+# on the same day, or by a rebuild. Returns (events, days) processed.
+def update_snapshots(chunk_size=2000):
+    last = get_watermark().seq
+    upper = ChangeEvent.objects.order_by("-seq").values_list("seq", flat=True).first() or 0
+    total_events = 0
+    total_days = set()
+
+    while last < upper:
+        events = list(
+            ChangeEvent.objects.filter(seq__gt=last, seq__lte=upper, entity__in=TRACKED)
+            .order_by("seq")
+            .values_list("seq", "entity", "entity_id", "payload")[:chunk_size]
+        )
+        # The rest of the events up to upper are about rows that don't count
+        seq = events[-1][0] if len(events) == chunk_size else upper
+
+        with transaction.atomic():
+            if events:
+                days = changed_days(events)
+                rebuild_days(days)
+                total_days |= days
+            SnapshotWatermark.objects.filter(name=DAILY_STAGE_WATERMARK, seq__lt=seq).update(seq=seq, updated_at=timezone.now())
+
+        total_events += len(events)
+        last = seq
+
+    return total_events, len(total_days)
+
+# Recomputes every day from `since` (the first day in the history and rejection tables by default) to today.
+# Days before it keep their rows, the history of archived batches is no longer there to count them again.
+# Returns the number of days rebuilt.
+def rebuild_snapshots(since=None, report=None):
+    upper = ChangeEvent.objects.order_by("-seq").values_list("seq", flat=True).first() or 0
+
+    if since is None:
+        firsts = [
+            BatchStageHistory.objects.aggregate(first=Min("entered_at"))["first"],
+            Rejection.objects.aggregate(first=Min("rejected_at"))["first"],
+        ]
+        firsts = [production_shift(first)[0] for first in firsts if first]
+        if not firsts:
+            return 0
+        since = min(firsts)
+
+    today = production_shift(timezone.now())[0]
+    days = [since + timedelta(days=offset) for offset in range((today - since).days + 1)]
+
+    for index, day in enumerate(days, 1):
+        with transaction.atomic():
+            rebuild_days([day])
+        if report:
+            report(index, len(days))
+
+    watermark = get_watermark()
+    watermark.seq = max(watermark.seq, upper)
+    watermark.save(update_fields=["seq", "updated_at"])
+    return len(days)
@@ -0,0 +1,90 @@
+from functools import lru_cache
+
+from rest_framework.exceptions import ValidationError
+
+from .models import BatchStage
+from .routes import get_route
+
+STATUSES = (BatchStage.STATUS_IN, BatchStage.STATUS_CLOSED)
+
+
+# Every (current state, requested stage and status) pair of a route compiled into a table once, so a scan is
+# checked with one dict lookup. A state is (sequence, status), None before the batch entered its first stage.
+class StageMachine:
+    def __init__(self, stages):
+        self.stages = stages
+        self.sequences = {stage: index + 1 for index, stage in enumerate(stages)}
+        self.last = (len(stages), BatchStage.STATUS_CLOSED)
+
+        steps = [(sequence, stage_status) for sequence in self.sequences.values() for stage_status in STATUSES]
+        # (state, requested) -> None when allowed, otherwise the error message
+        self.transitions = {
+            (state, requested): self.compile(state, requested)
+            for state in [None] + steps
+            for requested in steps
+        }
+
+    def compile(self, state, requested):
+        sequence, stage_status = requested
+
+        # The batch has no stage yet
+        if state is None:
+            if requested == (1, BatchStage.STATUS_IN):
+                return None
+            return f"Please follow the route plan. Your first stage is {self.stages[0]} and first task should be in"
+
+        current_sequence, current_status = state
+        current_stage = self.stages[current_sequence - 1]
+
+        # When the request is for Closed
+        if stage_status == BatchStage.STATUS_CLOSED:
+            if sequence == current_sequence:
+                if current_status == BatchStage.STATUS_IN:
+                    return None
+                return f"{current_stage} is already {current_status}"
+
+            if sequence > current_sequence:
+                return f"You have to complete the previous stages first. Your current stage is {current_stage} and current status is {current_status}"
+            return f"You have already completed this stage. Your current stage is {current_stage} and current status is {current_status}"
+
+        # When the request is for In
+        if sequence > current_sequence:
+            if sequence == current_sequence + 1 and current_status == BatchStage.STATUS_CLOSED:
+                return None
+            return f"Your current stage is {current_stage} and the current staus is {current_status}. You have to close the current stage to go to the next stage, and your next stage is {self.stages[current_sequence]}"
+
+        if sequence == current_sequence:
+            return f"You're already in {current_stage} and the status is {current_status}"
+        return f"You've already completed this stage, your current stage is {current_stage} and the status is {current_status}"
+
+    # Sequence of a stage in this route
+    def sequence(self, stage):
+        if stage not in self.sequences:
+            raise ValidationError(f"{stage} stage is not defined in the planning route.")
+        return self.sequences[stage]
+
+    def check(self, state, requested):
+        if (state, requested) not in self.transitions:
+            # The planning was given a shorter route after the batch went past its end
+            raise ValidationError("The current stage of this batch is not in its planning route anymore.")
+
+        error = self.transitions[state, requested]
+        if error:
+            raise ValidationError(error)
+
+    # Closing the last stage closes the batch
+    def closes_batch(self, requested):
+        return requested == self.last
+
+# Machines are compiled once per list of stage names, a renamed stage gets a new machine with the new name
+@lru_cache(maxsize=4096)
+def compile_stage_machine(stages):
+    return StageMachine(stages)
+
+def get_stage_machine(route_id):
+    return compile_stage_machine(get_route(route_id))
+
+def stage_state(batch_stage):
+    if batch_stage is None:
+        return None
+    return (batch_stage.sequence, batch_stage.current_status)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import serializers
+
+from .models import StageName
+
+# The map is reloaded on a miss, and at least this often so a rename made through another worker shows up
+RELOAD_SECONDS = 60
+
+
+# Stage name <-> StageName id for every stage, kept per worker. The production tables store the id,
+# the API keeps sending and receiving names, translated here without a join or a query.
+class StageMap:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.names = {}
+        self.loaded_at = None
+
+    def load(self):
+        with self.lock:
+            rows = list(StageName.objects.values_list("id", "stage"))
+            self.ids = {name: stage_id for stage_id, name in rows}
+            self.names = {stage_id: name for stage_id, name in rows}
+            self.loaded_at = time.monotonic()
+
+    def reset(self):
+        self.loaded_at = None
+
+    def lookup(self, mapping, key):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= RELOAD_SECONDS:
+            self.load()
+
+        if key not in getattr(self, mapping):
+            # Created after the last load
+            self.load()
+
+        return getattr(self, mapping).get(key)
+
+stage_map = StageMap()
+
+def stage_id(name):
+    return stage_map.lookup("ids", name)
+
+def stage_name(stage_id):
+    return stage_map.lookup("names", stage_id)
+
+# Names that are not stages, in the order given
+def unknown_stages(names):
+    return [name for name in names if stage_id(name) is None]
+
+@receiver(post_save, sender=StageName)
+@receiver(post_delete, sender=StageName)
+def reset_stage_map(sender, **kwargs):
+    stage_map.reset()
+
+
+# Reads and writes a stage foreign key as the stage name, use it with source="<field>_id"
+class StageNameField(serializers.Field):
+    default_error_messages = {
+        "invalid": "Stage name must be a string.",
+        "does_not_exist": "{name} stage doesn't exist.",
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail("invalid")
+
+        value = stage_id(data)
+        if value is None:
+            self.fail("does_not_exist", name=data)
+        return value
+
+    def to_representation(self, value):
+        return stage_name(value)
@@ -1,3 +1,683 @@
+import io
+import re
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from production import autocomplete
+from production import urls as production_urls
+from production.archive import archive_chunk
+from production.consistency import CHECKS, CONSISTENCY_USER
+from production.filters import IndexedFilterBackend, index_leading_columns
+from production.idempotency import get_fingerprint
+from production.models import (
+    ArchivedBatch, Batch, BatchBalance, BatchStage, BatchStageHistory, ChangeEvent, IdempotencyKey, Planning, ReceivedBundle, Rejection, RouteTemplate, StageName,
+)
+from production.routes import get_route, get_route_stage_ids, get_route_template, get_route_templates, route_hash
+from production.serializers import BatchStageSerializer, ReceivedBundleSerializer
+from production.snapshots import production_shift, update_snapshots
+from production.stages import stage_map
+from wet_process import urls as wet_process_urls
+from wet_process.models import FirstWashBatchSource
+
+# How a full scan of a table shows up in EXPLAIN
+FULL_SCAN = {
+    "sqlite": r"\bSCAN {table}\b(?! USING (COVERING )?INDEX)",
+    "postgresql": r"Seq Scan on {table}\b",
+}
+
+
+def sample_value(field):
+    if field.choices:
+        return field.choices[0][0]
+    return "x"
+
+# The filter combinations the backend lets through: every indexed filter alone and all exact filters together
+def filter_cases(viewset, model):
+    leading = index_leading_columns(model)
+    exact = getattr(viewset, "exact_filter_fields", {})
+    ranges = getattr(viewset, "range_filter_fields", {})
+
+    for param, column in exact.items():
+        if column in leading:
+            yield param, {column: sample_value(model._meta.get_field(column))}
+
+    for prefix, column in ranges.items():
+        if column in leading:
+            yield f"{prefix}_after", {f"{column}__gte": timezone.now()}
+
+    yield ",".join(exact), {column: sample_value(model._meta.get_field(column)) for column in exact.values()}
+
+
+# EXPLAIN every filter accepted by IndexedFilterBackend, none of them may scan the whole table
+class FilterPlanTests(TestCase):
+    def test_accepted_filters_use_an_index(self):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            self.skipTest(f"Don't know how to read query plans of {connection.vendor}.")
+
+        registry = production_urls.router.registry + wet_process_urls.router.registry
+
+        for prefix, viewset, basename in registry:
+            if IndexedFilterBackend not in getattr(viewset, "filter_backends", []):
+                continue
+
+            queryset = viewset.queryset
+            table = queryset.model._meta.db_table
+
+            for name, filters in filter_cases(viewset, queryset.model):
+                with self.subTest(f"{basename} ?{name}"), transaction.atomic():
+                    if connection.vendor == "postgresql":
+                        # Small tables make the planner prefer a sequential scan, only check that an index can be used
+                        with connection.cursor() as cursor:
+                            cursor.execute("SET LOCAL enable_seqscan = off")
+                    plan = queryset.filter(**filters).explain()
+                    self.assertIsNone(re.search(pattern.format(table=table), plan), plan)
+
+
+class BatchFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("planner", password="pw")
+        self.user.groups.add(Group.objects.get(name="planner"))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        StageName.objects.create(stage="Sewing")
+        planning = Planning.objects.create(mpo="M1", route=get_route_template(["Sewing"]), updated_by="planner")
+        self.medium = Batch.objects.create(mpo="M1", size="M", color="Blue", planning=planning, updated_by="planner")
+        self.closed = Batch.objects.create(mpo="M1", size="L", color="Blue", planning=planning, updated_by="planner", status=Batch.STATUS_CLOSED)
+
+    def ids(self, params):
+        response = self.client.get("/productions/batches/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        results = response.data["results"] if isinstance(response.data, dict) else response.data
+        return [batch["id"] for batch in results]
+
+    def test_size_alone(self):
+        self.assertEqual(self.ids({"size": "M"}), [self.medium.id])
+
+    def test_search_on_status(self):
+        self.assertEqual(self.ids({"search": "clo"}), [self.closed.id])
+
+
+class RouteTests(TestCase):
+    def setUp(self):
+        get_route_stage_ids.cache_clear()
+        stage_map.reset()
+        self.sewing = StageName.objects.create(stage="Sewing")
+        StageName.objects.create(stage="QC")
+        self.template = get_route_template(["Sewing", "QC"])
+
+    def test_rename_keeps_the_template(self):
+        self.assertEqual(get_route(self.template.id), ("Sewing", "QC"))
+
+        self.sewing.stage = "Stitching"
+        self.sewing.save()
+
+        self.assertEqual(get_route(self.template.id), ("Stitching", "QC"))
+        self.assertEqual(get_route_template(["Stitching", "QC"]), self.template)
+        self.assertEqual(RouteTemplate.objects.count(), 1)
+
+    # The template is inserted by another request between the lookup and the insert
+    def test_concurrent_insert(self):
+        with mock.patch.object(RouteTemplate.objects, "in_bulk", return_value={}):
+            templates = get_route_templates([["Sewing", "QC"], ["QC"]])
+
+        self.assertEqual(templates[self.template.content_hash], self.template)
+        self.assertEqual(get_route(templates[route_hash(["QC"])].id), ("QC",))
+        self.assertEqual(RouteTemplate.objects.count(), 2)
+
+
+# Signed in as an admin, with helpers to go through the API like the scanners do
+class ApiTestCase(TestCase):
+    def setUp(self):
+        # The per-worker caches outlive the rolled back rows of the previous test, whose ids are handed out again
+        get_route_stage_ids.cache_clear()
+        stage_map.reset()
+
+        self.user = User.objects.create_user("op", password="pw")
+        self.user.groups.add(Group.objects.get(name="admin"))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, url, data):
+        response = self.client.post(url, data, format="json")
+        self.assertIn(response.status_code, (200, 201), response.data)
+        return response.data
+
+    def bundle_data(self, **changes):
+        return {
+            "so": "S1", "mpo": "M1", "buyer": "B", "style": "ST", "marker": "MK", "bundle_no": 1,
+            "bundle_barcode": "82200000M1000001001", "size": "M", "shade": "A", "color": "Blue", "quantity": 10,
+            **changes,
+        }
+
+    # A batch of one bundle that went through the given stage statuses
+    def make_batch(self, stages, moves):
+        for name in stages:
+            StageName.objects.get_or_create(stage=name)
+        self.post("/productions/plannings/", {"mpo": "M1", "stages": stages})
+        bundle = self.post("/productions/received-bundles/", self.bundle_data())
+        batch = self.post("/productions/batches/", {"scanned_bundles": [bundle["id"]]})
+        for stage, stage_status in moves:
+            self.post("/productions/batch-stages/", {"batch": batch["id"], "current_stage": stage, "current_status": stage_status})
+        return batch
+
+
+class ArchiveTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_batch(["Sewing"], [("Sewing", "in"), ("Sewing", "closed")])
+
+        BatchStageHistory.objects.update(closed_at=timezone.now() - timedelta(days=400))
+        archive_chunk(timezone.now() - timedelta(days=365), 100)
+
+    def test_cascaded_rows_have_delete_events(self):
+        deleted = set(
+            ChangeEvent.objects.filter(action=ChangeEvent.ACTION_DELETED, payload__archived=True).values_list("entity", flat=True)
+        )
+
+        self.assertEqual(deleted, {
+            "production.batch", "production.batchstage", "production.batchstagehistory",
+            "production.batchbalance", "production.receivedbundle",
+        })
+
+    def test_archived_bundle_is_not_received_again(self):
+        same_barcode = self.client.post("/productions/received-bundles/", self.bundle_data(bundle_no=2), format="json")
+        same_number = self.client.post("/productions/received-bundles/", self.bundle_data(bundle_barcode="82200000M1000001002"), format="json")
+
+        self.assertEqual(same_barcode.status_code, 400)
+        self.assertEqual(same_number.status_code, 400)
+
+    def test_archived_batch_list_and_document(self):
+        def listed(**params):
+            response = self.client.get("/productions/archived-batches/", params)
+            self.assertEqual(response.status_code, 200, response.data)
+            return [batch["batch_id"] for batch in response.data["results"]]
+
+        batch_id = ArchivedBatch.objects.get().batch_id
+        closed = (timezone.localdate() - timedelta(days=300)).isoformat()
+
+        self.assertEqual(listed(barcode="82200000M1000001001"), [batch_id])
+        self.assertEqual(listed(barcode="0000M10000010001"), [batch_id])
+        self.assertEqual(listed(barcode="0000M10000020001"), [])
+        self.assertEqual(listed(mpo="M1", closed_before=closed), [batch_id])
+        self.assertEqual(listed(mpo="M1", closed_after=closed), [])
+        self.assertEqual(listed(mpo="M2"), [])
+
+        response = self.client.get(f"/productions/archived-batches/{batch_id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["document"]["bundles"], ["82200000M1000001001"])
+        self.assertEqual([history["closed_at"] is not None for history in response.data["document"]["history"]], [True])
+
+
+class BalanceEventTests(ApiTestCase):
+    def balance_events(self):
+        return list(ChangeEvent.objects.filter(entity="production.batchbalance").order_by("seq").values_list("action", "payload"))
+
+    def test_balance_changes_are_recorded(self):
+        batch = self.make_batch(["QC"], [("QC", "in")])
+        rejection = self.post("/productions/rejections/", {"individual_barcode": "0000M10000010001", "stage": "QC", "reason": "other"})
+        self.client.delete(f"/productions/rejections/{rejection['id']}/?stage=QC")
+
+        events = self.balance_events()
+        self.assertEqual([action for action, _ in events], [ChangeEvent.ACTION_CREATED, ChangeEvent.ACTION_UPDATED, ChangeEvent.ACTION_UPDATED])
+        self.assertEqual([payload["available_quantity"] for _, payload in events], [10, 9, 10])
+        self.assertEqual({payload["batch_id"] for _, payload in events}, {batch["id"]})
+
+    def test_rejection_needs_an_available_garment(self):
+        self.make_batch(["QC"], [("QC", "in")])
+        BatchBalance.objects.update(available_quantity=0)
+
+        response = self.client.post("/productions/rejections/", {"individual_barcode": "0000M10000010001", "stage": "QC", "reason": "other"}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Rejection.objects.exists())
+        self.assertEqual(BatchBalance.objects.get().available_quantity, 0)
+
+
+class IdempotencyTests(ApiTestCase):
+    def receive(self, key="key-1", **changes):
+        return self.client.post("/productions/received-bundles/", self.bundle_data(**changes), format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    # The key of the same request, left in progress by another worker that started `age` ago
+    def in_progress(self, age=None):
+        request = SimpleNamespace(method="POST", path="/productions/received-bundles/", data=self.bundle_data())
+        record = IdempotencyKey.objects.create(
+            key="key-1", user=self.user.username, fingerprint=get_fingerprint(request),
+            expires_at=timezone.now() + settings.IDEMPOTENCY_KEY_TTL,
+        )
+        if age:
+            IdempotencyKey.objects.filter(pk=record.pk).update(created_at=timezone.now() - age)
+
+    def test_retry_replays_the_response(self):
+        first = self.receive()
+        retry = self.receive()
+
+        self.assertEqual(first.status_code, 201, first.data)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(ReceivedBundle.objects.count(), 1)
+
+    def test_other_request_with_the_same_key(self):
+        self.receive()
+
+        self.assertEqual(self.receive(quantity=11).status_code, 422)
+
+    def test_in_progress(self):
+        self.in_progress()
+
+        self.assertEqual(self.receive().status_code, 409)
+        self.assertEqual(ReceivedBundle.objects.count(), 0)
+
+    def test_stale_key_is_taken_over(self):
+        self.in_progress(settings.IDEMPOTENCY_STALE_AFTER)
+
+        self.assertEqual(self.receive().status_code, 201)
+        self.assertEqual(ReceivedBundle.objects.count(), 1)
+
+    # The first request was only slow, its key was taken over while it ran
+    def test_taken_over_request_is_rolled_back(self):
+        create = ReceivedBundleSerializer.create
+
+        def taken_over(serializer, validated_data):
+            IdempotencyKey.objects.all().delete()
+            return create(serializer, validated_data)
+
+        with mock.patch.object(ReceivedBundleSerializer, "create", autospec=True, side_effect=taken_over):
+            response = self.receive()
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(ReceivedBundle.objects.count(), 0)
+
+
+class PruneChangeEventsTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_batch(["Sewing"], [("Sewing", "in"), ("Sewing", "closed")])
+
+    def history_events(self):
+        return list(ChangeEvent.objects.filter(entity="production.batchstagehistory").values_list("action", flat=True))
+
+    def prune(self, *args):
+        call_command("prune_change_events", *args, stdout=io.StringIO())
+
+    def test_unprocessed_events_are_kept(self):
+        self.prune("--days", "0", "--compact")
+
+        self.assertEqual(self.history_events(), [ChangeEvent.ACTION_CREATED, ChangeEvent.ACTION_UPDATED])
+
+    def test_latest_processed_event_of_a_row_is_kept(self):
+        update_snapshots()
+        self.prune("--days", "0", "--compact")
+
+        self.assertEqual(self.history_events(), [ChangeEvent.ACTION_UPDATED])
+        self.assertFalse(ChangeEvent.objects.filter(entity="production.batch").exists())
+
+
+class BatchStageVersionTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.batch = self.make_batch(["Sewing", "QC"], [("Sewing", "in")])
+
+    def scan(self, stage="Sewing", stage_status="closed", **data):
+        return self.client.post("/productions/batch-stages/", {"batch": self.batch["id"], "current_stage": stage, "current_status": stage_status, **data}, format="json")
+
+    def test_current_version(self):
+        response = self.scan(version=0)
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["version"], 1)
+
+    # The scanner last saw the batch before the Sewing close
+    def test_stale_version(self):
+        self.assertEqual(self.scan().status_code, 200)
+        response = self.scan("QC", "in", version=0)
+
+        self.assertEqual(response.status_code, 409, response.data)
+        self.assertEqual(BatchStage.objects.get().sequence, 1)
+
+    def test_invalid_version(self):
+        self.assertEqual(self.scan(version="one").status_code, 400)
+
+    # Another scan saves its transition after this one was checked, this one must not write a thing
+    def test_concurrent_transition_loses(self):
+        validate = BatchStageSerializer.validate
+
+        def moved_meanwhile(serializer, attrs):
+            attrs = validate(serializer, attrs)
+            BatchStage.objects.update(version=F("version") + 1)
+            return attrs
+
+        with mock.patch.object(BatchStageSerializer, "validate", autospec=True, side_effect=moved_meanwhile):
+            response = self.scan()
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(BatchStage.objects.get().current_status, BatchStage.STATUS_IN)
+        self.assertIsNone(BatchStageHistory.objects.get().closed_at)
+
+
+class ChangeFeedTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        StageName.objects.create(stage="Sewing")
+        self.post("/productions/plannings/", {"mpo": "M1", "stages": ["Sewing"]})
+        self.post("/productions/received-bundles/", self.bundle_data())
+
+    def changes(self, since):
+        return self.client.get("/productions/changes/", {"since": since})
+
+    def test_pruned_events_require_a_resync(self):
+        ChangeEvent.objects.update(created_at=timezone.now() - timedelta(days=settings.CHANGE_EVENT_RETENTION_DAYS + 1))
+        self.post("/productions/received-bundles/", self.bundle_data(bundle_no=2, bundle_barcode="82200000M1000002001"))
+        latest = ChangeEvent.objects.order_by("-seq").first().seq
+        self.assertEqual(self.changes(0).status_code, 200)
+
+        call_command("prune_change_events", stdout=io.StringIO())
+        response = self.changes(0)
+
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual((response.data["resync_required"], response.data["latest_seq"]), (True, latest))
+        # Following on from the last pruned event misses nothing
+        response = self.changes(latest - 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event["seq"] for event in response.data["results"]], [latest])
+
+    # Compacted events are followed by a newer event of the same row, the client still gets the whole state
+    def test_compaction_needs_no_resync(self):
+        bundle = ReceivedBundle.objects.get()
+        self.post("/productions/batches/", {"scanned_bundles": [bundle.id]})
+
+        call_command("prune_change_events", "--compact", stdout=io.StringIO())
+
+        self.assertEqual(self.changes(0).status_code, 200)
+
+
+class DissolveTests(ApiTestCase):
+    def dissolve(self, batch):
+        return self.client.post("/productions/batches/dissolve/", {"batches": [batch["id"]]}, format="json")
+
+    def test_bundles_are_received_again(self):
+        batch = self.make_batch(["Sewing"], [])
+        bundle = ReceivedBundle.objects.get()
+        self.assertEqual(bundle.status, ReceivedBundle.STATUS_ALLOCATED)
+
+        response = self.dissolve(batch)
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data, {"dissolved_batches": [batch["id"]], "released_bundles": [bundle.id]})
+        self.assertFalse(Batch.objects.exists())
+        self.assertEqual(ReceivedBundle.objects.get().status, ReceivedBundle.STATUS_RECEIVED)
+
+    def test_started_batch_is_kept(self):
+        batch = self.make_batch(["Sewing"], [("Sewing", "in")])
+
+        response = self.dissolve(batch)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("processing stage", str(response.data))
+        self.assertTrue(Batch.objects.exists())
+        self.assertEqual(ReceivedBundle.objects.get().status, ReceivedBundle.STATUS_ALLOCATED)
+
+    def test_washed_batch_is_kept(self):
+        batch = self.make_batch(["Sewing"], [])
+        self.post("/wet-process/first-wash-batches/", {"shade": "A", "batch_source": [{"batch": batch["id"], "quantity": 5}]})
+
+        response = self.dissolve(batch)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("sent to wash", str(response.data))
+        self.assertTrue(Batch.objects.exists())
+
+
+class BulkPlanningImportTests(ApiTestCase):
+    def test_result_per_mpo(self):
+        self.make_batch(["Sewing", "QC"], [("Sewing", "in")])
+        self.post("/productions/plannings/", {"mpo": "M2", "stages": ["Sewing"]})
+        self.post("/productions/plannings/", {"mpo": "M3", "stages": ["Sewing"]})
+
+        data = self.post("/productions/plannings/bulk-import/", {"plannings": [
+            {"mpo": "M1", "stages": ["QC"]},
+            {"mpo": "M2", "stages": ["Sewing"]},
+            {"mpo": "M3", "stages": ["Sewing", "QC"]},
+            {"mpo": "M4", "stages": ["QC"]},
+            {"mpo": "M5", "stages": ["Sewing"]},
+            {"mpo": "M5", "stages": ["QC"]},
+            {"mpo": "M6", "stages": ["Ironing"]},
+        ]})
+
+        results = {result["mpo"]: result["result"] for result in data["results"]}
+        self.assertEqual(results, {"M1": "skipped", "M2": "unchanged", "M3": "updated", "M4": "created", "M5": "error", "M6": "error"})
+        self.assertEqual(get_route(Planning.objects.get(mpo="M1").route_id), ("Sewing", "QC"))
+        self.assertEqual(get_route(Planning.objects.get(mpo="M3").route_id), ("Sewing", "QC"))
+        self.assertEqual(get_route(Planning.objects.get(mpo="M4").route_id), ("QC",))
+        self.assertFalse(Planning.objects.filter(mpo__in=["M5", "M6"]).exists())
+
+
+class ExportTests(ApiTestCase):
+    def export(self, dataset, **params):
+        response = self.client.get(f"/productions/exports/{dataset}/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode().splitlines()
+
+    def test_csv_columns_and_rows(self):
+        batch = self.make_batch(["QC"], [("QC", "in")])
+        self.post("/productions/rejections/", {"individual_barcode": "0000M10000010001", "stage": "QC", "reason": "other"})
+
+        self.assertEqual(self.export("batches", columns="id,current_stage,bundle_count,available_quantity"), [
+            "id,current_stage,bundle_count,available_quantity",
+            f"{batch['id']},QC,1,9",
+        ])
+        self.assertEqual(self.export("rejections", columns="batch,stage,bundle_no"), ["batch,stage,bundle_no", f"{batch['id']},QC,1"])
+
+    def test_date_range_filter(self):
+        self.post("/productions/received-bundles/", self.bundle_data())
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+
+        self.assertEqual(len(self.export("received-bundles", columns="id", received_before=tomorrow)), 2)
+        self.assertEqual(self.export("received-bundles", columns="id", received_after=tomorrow), ["id"])
+
+    def test_unknown_column(self):
+        response = self.client.get("/productions/exports/batches/", {"columns": "id,price"})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class TraceTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.batch = self.make_batch(["QC"], [("QC", "in")])
+        self.rejection = self.post("/productions/rejections/", {"individual_barcode": "0000M10000010001", "stage": "QC", "reason": "other"})
+        self.wash = self.post("/wet-process/first-wash-batches/", {"shade": "A", "batch_source": [{"batch": self.batch["id"], "quantity": 5}]})
+
+    def trace(self, **params):
+        response = self.client.get("/productions/trace/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_garment(self):
+        data = self.trace(garment="0000M10000010001")
+
+        self.assertFalse(data["archived"])
+        self.assertEqual(data["garment"]["rejection"]["id"], self.rejection["id"])
+        self.assertEqual(data["bundle"]["bundle_barcode"], "82200000M1000001001")
+        self.assertEqual(data["batch"]["id"], self.batch["id"])
+        self.assertEqual(data["batch"]["route"], ["QC"])
+        self.assertEqual(data["batch"]["balance"]["available_quantity"], 4)
+        self.assertEqual([(wash["batch_for_first_wash"], wash["quantity"]) for wash in data["batch"]["wash"]], [(self.wash["id"], 5)])
+        self.assertEqual([bundle["bundle_no"] for bundle in data["batch"]["bundles"]], [1])
+
+    def test_unbatched_bundle(self):
+        self.post("/productions/received-bundles/", self.bundle_data(bundle_no=2, bundle_barcode="82200000M1000002001"))
+
+        data = self.trace(bundle="82200000M1000002001")
+
+        self.assertEqual(data["bundle"]["bundle_no"], 2)
+        self.assertIsNone(data["batch"])
+        self.assertIsNone(data["garment"])
+
+    def test_archived_batch(self):
+        self.post("/productions/batch-stages/", {"batch": self.batch["id"], "current_stage": "QC", "current_status": "closed"})
+        BatchStageHistory.objects.update(closed_at=timezone.now() - timedelta(days=400))
+        archive_chunk(timezone.now() - timedelta(days=365), 100)
+
+        data = self.trace(garment="0000M10000010001")
+
+        self.assertTrue(data["archived"])
+        self.assertEqual(data["garment"]["rejection"]["individual_barcode"], "0000M10000010001")
+        self.assertEqual(data["batch"]["batch"]["id"], self.batch["id"])
+        self.assertEqual([wash["batch_for_first_wash"] for wash in data["batch"]["wash"]], [self.wash["id"]])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get("/productions/trace/").status_code, 400)
+        self.assertEqual(self.client.get("/productions/trace/", {"batch": 1, "bundle": "x"}).status_code, 400)
+        self.assertEqual(self.client.get("/productions/trace/", {"batch": 999}).status_code, 404)
+
+
+class StageQueueTests(ApiTestCase):
+    def queue(self, stage):
+        response = self.client.get("/productions/stage-queues/", {"stage": stage})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(row["batch"], row["previous_stage"], row["sequence"]) for row in response.data["results"]]
+
+    # A batch waits for the step after the one it closed, in the route of its own planning
+    def test_batch_waits_for_its_next_step(self):
+        first = self.make_batch(["Sewing", "QC"], [("Sewing", "in"), ("Sewing", "closed")])
+        self.post("/productions/plannings/", {"mpo": "M2", "stages": ["QC", "Sewing"]})
+        bundle = self.post("/productions/received-bundles/", self.bundle_data(mpo="M2", bundle_barcode="82200000M2000001001"))
+        second = self.post("/productions/batches/", {"scanned_bundles": [bundle["id"]]})
+        self.post("/productions/batch-stages/", {"batch": second["id"], "current_stage": "QC", "current_status": "in"})
+        self.post("/productions/batch-stages/", {"batch": second["id"], "current_stage": "QC", "current_status": "closed"})
+
+        self.assertEqual(self.queue("QC"), [(first["id"], "Sewing", 2)])
+        self.assertEqual(self.queue("Sewing"), [(second["id"], "QC", 2)])
+
+    def test_batch_in_a_stage_is_not_waiting(self):
+        self.make_batch(["Sewing", "QC"], [("Sewing", "in")])
+
+        self.assertEqual(self.queue("QC"), [])
+        self.assertEqual(self.client.get("/productions/stage-queues/", {"stage": "Ironing"}).status_code, 400)
+
+
+class ConsistencyTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.batch = self.make_batch(["Sewing", "QC"], [("Sewing", "in")])
+        self.post("/productions/received-bundles/", self.bundle_data(bundle_no=2, bundle_barcode="82200000M1000002001"))
+
+    def check(self, *args):
+        out = io.StringIO()
+        call_command("check_consistency", *args, stdout=out)
+        return out.getvalue()
+
+    def test_clean_data_passes(self):
+        self.assertEqual(len(re.findall(r": ok in", self.check())), len(CHECKS))
+
+    def test_broken_rows_are_reported_then_repaired(self):
+        BatchBalance.objects.update(available_quantity=3)
+        BatchStage.objects.update(current_status=BatchStage.STATUS_CLOSED)
+        ReceivedBundle.objects.update(status=ReceivedBundle.STATUS_ALLOCATED)
+
+        with self.assertRaisesMessage(CommandError, "3 row(s) break an invariant"):
+            self.check()
+
+        self.assertIn("batch-balance: repaired 1 row(s).", self.check("--repair"))
+        self.assertNotIn("violation", self.check())
+
+        self.assertEqual(BatchBalance.objects.get().available_quantity, 10)
+        self.assertEqual(BatchStage.objects.get().current_status, BatchStage.STATUS_IN)
+        self.assertEqual(ReceivedBundle.objects.get(bundle_no=2).status, ReceivedBundle.STATUS_RECEIVED)
+        self.assertEqual(
+            set(ChangeEvent.objects.filter(created_by=CONSISTENCY_USER).values_list("entity", flat=True)),
+            {"production.batchbalance", "production.batchstage", "production.receivedbundle"},
+        )
+
+    # The wash source keeps the id of a deleted batch, only an archived batch may be missing from the batch table
+    def test_orphaned_wash_source_is_reported(self):
+        self.post("/wet-process/first-wash-batches/", {"shade": "A", "batch_source": [{"batch": self.batch["id"], "quantity": 5}]})
+        Batch.objects.all().delete()
+
+        with self.assertRaisesMessage(CommandError, "1 row(s) break an invariant."):
+            self.check("--check", "wash-source-batch", "--repair")
+        self.assertTrue(FirstWashBatchSource.objects.exists())
+
+        ArchivedBatch.objects.create(batch_id=self.batch["id"], mpo="M1", size="M", color="Blue", closed_at=timezone.now(), document={})
+        self.assertIn("wash-source-batch: ok", self.check("--check", "wash-source-batch"))
+
+
+class DailyReportTests(ApiTestCase):
+    def report(self, **params):
+        response = self.client.get("/productions/daily-report/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_pieces_per_stage_and_shift(self):
+        self.make_batch(["QC"], [("QC", "in")])
+        self.post("/productions/rejections/", {"individual_barcode": "0000M10000010001", "stage": "QC", "reason": "other"})
+        self.post("/productions/batch-stages/", {"batch": Batch.objects.get().id, "current_stage": "QC", "current_status": "closed"})
+        update_snapshots()
+        day, shift = production_shift(BatchStageHistory.objects.get().entered_at)
+        other_shift = next(name for name in settings.PRODUCTION_SHIFTS if name != shift)
+
+        data = self.report(**{"from": day, "to": day, "stage": "QC"})
+
+        self.assertIsNotNone(data["as_of"])
+        self.assertEqual(data["results"], [{
+            "day": day.isoformat(), "shift": shift, "stage": "QC", "batches_entered": 1, "pieces_entered": 10,
+            "batches_closed": 1, "pieces_closed": 10, "pieces_rejected": 1,
+        }])
+        self.assertEqual(self.report(**{"from": day, "to": day, "shift": other_shift})["results"], [])
+        self.assertEqual(self.report(**{"from": day - timedelta(days=2), "to": day - timedelta(days=1)})["results"], [])
+
+    def test_bad_requests(self):
+        today = timezone.localdate()
+
+        self.assertEqual(self.client.get("/productions/daily-report/", {"from": today}).status_code, 400)
+        self.assertEqual(self.client.get("/productions/daily-report/", {"from": today, "to": today - timedelta(days=1)}).status_code, 400)
+        self.assertEqual(self.client.get("/productions/daily-report/", {"from": today, "to": today, "stage": "Ironing"}).status_code, 400)
+        self.assertEqual(self.client.get("/productions/daily-report/", {"from": today, "to": today, "shift": "Z"}).status_code, 400)
+
+
+class AutocompleteTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        # A fresh index per test that picks up new change events on every lookup
+        patcher = mock.patch.object(autocomplete, "index", autocomplete.AutocompleteIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(autocomplete, "REFRESH_SECONDS", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, **params):
+        response = self.client.get("/productions/autocomplete/", params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data["results"]
+
+    def test_prefix_search(self):
+        for mpo in ("M100", "m150", "M200"):
+            self.post("/productions/plannings/", {"mpo": mpo, "stages": []})
+
+        self.assertEqual(self.search(field="mpo", q="m1"), ["M100", "m150"])
+        self.assertEqual(self.search(field="mpo", q="M", limit=2), ["M100", "m150"])
+
+        # Values written after the index was built come from the change events
+        self.post("/productions/plannings/", {"mpo": "M120", "stages": []})
+        self.post("/productions/received-bundles/", self.bundle_data(buyer="Acme"))
+        self.assertEqual(self.search(field="mpo", q="m1"), ["M100", "M120", "m150"])
+        self.assertEqual(self.search(field="buyer", q="ac"), ["Acme"])
 
-# Create your tests here.
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get("/productions/autocomplete/", {"field": "size", "q": "M"}).status_code, 400)
+        self.assertEqual(self.client.get("/productions/autocomplete/", {"field": "mpo", "limit": 0}).status_code, 400)
@@ -8,9 +8,17 @@ router.register("plannings", views.PlannigViewSet, basename="planning")
 router.register("received-bundles", views.ReceivedBundleViewSet, basename="received-bundles")
 router.register("batches", views.BatchViewSet, basename="batch")
 router.register("batch-stages", views.BatchStageViewSet, basename="batch-stage")
+router.register("stage-queues", views.StageQueueViewSet, basename="stage-queue")
+router.register("daily-report", views.DailyReportViewSet, basename="daily-report")
 router.register("batch-stage-history", views.BatchStageHistoryViewSet, basename="batch-stage-history")
 router.register("rejections",views.RejectionViewSet, basename="rejection")
 router.register("qc-stage-summaries",views.BatchQcStageSummaryViewSet,basename="qc-stage-summary")
+router.register("batch-balances",views.BatchBalanceViewSet,basename="batch-balance")
+router.register("changes",views.ChangeEventViewSet,basename="change")
+router.register("exports",views.ExportViewSet,basename="export")
+router.register("archived-batches",views.ArchivedBatchViewSet,basename="archived-batch")
+router.register("trace",views.TraceViewSet,basename="trace")
+router.register("autocomplete",views.AutocompleteViewSet,basename="autocomplete")
 
 urlpatterns = [
     path("",include(router.urls))
@@ -1,31 +1,74 @@
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.viewsets import ModelViewSet, ViewSet
 from rest_framework.response import Response
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
 from django.db.models import Value
 from django.db.models.functions import Substr, Concat
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.conf import settings
 from django.db import transaction
 from django.db.models import F, OuterRef, Subquery, Prefetch
 from rest_framework import status
-from .models import Planning, ReceivedBundle, Batch, BatchBundle, BatchStage, BatchStageHistory, PlanningRouteStep, StageName, BatchQcStageSummary, Rejection
+from .models import Planning, ReceivedBundle, Batch, BatchBundle, BatchStage, BatchStageHistory, StageName, BatchQcStageSummary, Rejection, ChangeEvent, BatchBalance, ArchivedBatch, ArchivedBundle, DailyStageSnapshot, SnapshotWatermark
+from .events import get_pruned_seq, record_balance_events, record_event, record_events
+from .idempotency import idempotent
+from .exceptions import Conflict
+from .stage_machine import get_stage_machine
+from .stages import stage_id
+from wet_process.models import FirstWashBatchSource, FirstWashBundleSource
+from .filters import IndexedFilterBackend, filter_date_range
+from .pagination import DefaultPagination
+from . import exports
+from . import autocomplete
+from . import snapshots
 from . import serializers
+from accounts.permissions import get_roles
+from jobs.registry import enqueue
+from jobs.serializers import JobSerializer
 
-def create_fabricated_data(fabricated_data,route):
-    fabricated_data["sequence"] = route.sequence
+def create_fabricated_data(fabricated_data,sequence):
+    fabricated_data["sequence"] = sequence
     return fabricated_data
 
-def check_stage(batch,stage):
-    # Check if the stage is part of the planning or not
-    try:
-        route = batch.planning.route_steps.get(stage=stage)
-        return route
-    except PlanningRouteStep.DoesNotExist:
-        raise ValidationError(
-            f"{stage} stage is not defined in the planning route."
-        )
+# Delete unstarted batches and give their bundles back to the received section, with set-based queries
+def dissolve_batches(batch_ids, user):
+    with transaction.atomic():
+        started = list(BatchStage.objects.filter(batch_id__in=batch_ids).values_list("batch_id", flat=True))
+        if started:
+            raise ValidationError(
+                f"You can't delete batches {', '.join(map(str, sorted(started)))} cause they are already in processing stage"
+            )
+        
+        washed = list(Batch.objects.filter(id__in=batch_ids, firstwashbatchsource__isnull=False).values_list("id", flat=True).distinct())
+        if washed:
+            raise ValidationError(
+                f"You can't delete batches {', '.join(map(str, sorted(washed)))} cause they are already sent to wash"
+            )
+        
+        received_bundles = list(ReceivedBundle.objects.filter(batch_bundle__batch_id__in=batch_ids))
+        
+        # reset received bundle statuses
+        ReceivedBundle.objects.filter(
+            id__in=[received_bundle.id for received_bundle in received_bundles]
+        ).update(status=ReceivedBundle.STATUS_RECEIVED)
+        
+        for received_bundle in received_bundles:
+            received_bundle.status = ReceivedBundle.STATUS_RECEIVED
+        
+        record_events(received_bundles, ChangeEvent.ACTION_UPDATED, user)
+        record_events(Batch.objects.filter(id__in=batch_ids), ChangeEvent.ACTION_DELETED, user)
+        record_events(BatchBalance.objects.filter(batch_id__in=batch_ids), ChangeEvent.ACTION_DELETED, user)
+        
+        # Only delete batches that still have no stage, if a scanner started one in the meantime everything is rolled back
+        _, deleted = Batch.objects.filter(id__in=batch_ids, stage__isnull=True).delete()
+        if deleted.get(Batch._meta.label, 0) != len(batch_ids):
+            raise ValidationError("One or more batches were started by another request, please try again.")
+        
+        return received_bundles
 
 # Create your views here.
 
@@ -36,7 +79,7 @@ class StageNameViewSet(ModelViewSet):
 
 class PlannigViewSet(ModelViewSet):
     http_method_names = ["get","post","patch"]
-    queryset = Planning.objects.all().prefetch_related("route_steps").order_by("-last_update")
+    queryset = Planning.objects.all().prefetch_related("route__route_steps").order_by("-last_update")
     filter_backends = [SearchFilter]
     search_fields = ["mpo"]
     
@@ -53,11 +96,26 @@ class PlannigViewSet(ModelViewSet):
         planning = serializer.save()
         serializer = serializers.PlanningSerializer(planning)
         return Response(serializer.data)
+    
+    # Import many {mpo, stages} at once (start of a season), returns what happened to each MPO
+    @action(detail=False, methods=["post"], url_path="bulk-import")
+    def bulk_import(self, request):
+        serializer = serializers.BulkPlanningImportSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        return Response({"results": results})
        
 class ReceivedBundleViewSet(ModelViewSet):
     http_method_names = ["get","post","delete"]
     queryset = ReceivedBundle.objects.all()
     serializer_class = serializers.ReceivedBundleSerializer 
+    filter_backends = [IndexedFilterBackend]
+    exact_filter_fields = {"mpo": "mpo", "size": "size", "color": "color", "shade": "shade", "status": "status", "buyer": "buyer", "style": "style"}
+    range_filter_fields = {"received": "received_at"}
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
     
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -65,7 +123,9 @@ class ReceivedBundleViewSet(ModelViewSet):
         if instance.status == "allocated":
             raise ValidationError("You can't delete this bundle cause it's already allocated in a batch.")
         
-        instance.delete()
+        with transaction.atomic():
+            record_event(instance, ChangeEvent.ACTION_DELETED, serializers.get_user_name(request))
+            instance.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
       
     # Scan the bundle and get the received_bundle object
@@ -107,38 +167,47 @@ class ReceivedBundleViewSet(ModelViewSet):
  
 class BatchViewSet(ModelViewSet):
     http_method_names = ["get","post","delete"]
-    queryset = Batch.objects.all().select_related("planning").prefetch_related("planning__route_steps","batch_bundles__received")
+    queryset = Batch.objects.all().select_related("planning").prefetch_related("planning__route__route_steps","batch_bundles__received")
     serializer_class = serializers.BatchSerializer
-    filter_backends = [SearchFilter]
-    search_fields = ["status"] 
+    # ?search= is kept for existing clients, it matches part of the status and scans the table, ?status= uses the index
+    filter_backends = [IndexedFilterBackend, SearchFilter]
+    search_fields = ["status"]
+    exact_filter_fields = {"mpo": "mpo", "size": "size", "color": "color", "status": "status"}
+    range_filter_fields = {"updated": "updated_at"}
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
     
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         
-        try:
-            BatchStage.objects.get(batch=instance)
+        if BatchStage.objects.filter(batch=instance).exists():
             raise ValidationError("You can't delete this batch cause this batch is already in processing stage")
         
-        except BatchStage.DoesNotExist:
-            with transaction.atomic():
-                
-                # reset received bundle statuses
-                batch_bundles = instance.batch_bundles.select_related("received")
-
-                for batch_bundle in batch_bundles:
-                    received_bundle = batch_bundle.received
-                    received_bundle.status = ReceivedBundle.STATUS_RECEIVED
-                    received_bundle.save(update_fields=["status"])
-
-                instance.delete()
-            
-            return Response(status=status.HTTP_204_NO_CONTENT)    
+        dissolve_batches([instance.id], serializers.get_user_name(request))
+        return Response(status=status.HTTP_204_NO_CONTENT)    
+    
+    # Dissolve many unstarted batches in one transaction, either all of them go or none
+    @action(detail=False, methods=["post"], url_path="dissolve")
+    def dissolve(self, request):
+        serializer = serializers.DissolveBatchesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        batch_ids = serializer.validated_data["batches"]
+        
+        received_bundles = dissolve_batches(batch_ids, serializers.get_user_name(request))
+        
+        return Response({
+            "dissolved_batches": batch_ids,
+            "released_bundles": [received_bundle.id for received_bundle in received_bundles],
+        })
 
 class BatchStageViewSet(ModelViewSet):
     http_method_names = ["get","post"]
     queryset = BatchStage.objects.all()
     serializer_class = serializers.BatchStageSerializer
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         batch_id = request.data.get("batch")
         stage = request.data.get("current_stage")
@@ -148,19 +217,29 @@ class BatchStageViewSet(ModelViewSet):
             return Response({"detail": "Batch, current stage, and current_status are required."}, status=status.HTTP_400_BAD_REQUEST)
         
         # Check if batch exists
-        batch = get_object_or_404(Batch, id=batch_id)
+        batch = get_object_or_404(Batch.objects.select_related("planning"), id=batch_id)
         
-        # Check if the stage exists in the route 
-        route = check_stage(batch=batch, stage=stage)
+        # Check if the stage exists in the route, the compiled route comes from the per template cache
+        stage_machine = get_stage_machine(batch.planning.route_id)
+        sequence = stage_machine.sequence(stage)
+        context = {**self.get_serializer_context(), "stage_machine": stage_machine}
         
         # Create fabricated_data
-        fabricated_data = create_fabricated_data(fabricated_data = request.data.copy(), route=route)
+        fabricated_data = create_fabricated_data(fabricated_data = request.data.copy(), sequence=sequence)
+        
+        # The stage version the scanner last saw, optional
+        version = request.data.get("version")
+        if version is not None and (isinstance(version, bool) or not str(version).isdigit()):
+            raise ValidationError("version must be a non-negative integer.")
         
         try:
             batch_stage = BatchStage.objects.get(batch=batch)
             
+            if version is not None and int(version) != batch_stage.version:
+                raise Conflict(f"Batch {batch.id} has moved since version {version}, its stage is now at version {batch_stage.version}.")
+            
             # Update the existing batch stage
-            serializer = self.get_serializer(batch_stage, data=fabricated_data)
+            serializer = self.get_serializer(batch_stage, data=fabricated_data, context=context)
             serializer.is_valid(raise_exception=True)
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -168,11 +247,85 @@ class BatchStageViewSet(ModelViewSet):
         except BatchStage.DoesNotExist:
             
             # Create new if not exists
-            serializer = self.get_serializer(data=fabricated_data)
+            serializer = self.get_serializer(data=fabricated_data, context=context)
             serializer.is_valid(raise_exception=True)
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+# Batches waiting for a stage, longest waiting first: GET /stage-queues/?stage=<name>
+# A batch waits for a stage when its BatchStage is closed at the step just before that stage in its own route,
+# found with one join from the batch stages to the route steps of that stage on sequence + 1.
+class StageQueueViewSet(ViewSet):
+    
+    def list(self, request):
+        stage = request.query_params.get("stage", "").strip()
+        if not stage:
+            raise ValidationError("stage is required.")
+        
+        queue_stage_id = stage_id(stage)
+        if queue_stage_id is None:
+            raise ValidationError(f"{stage} stage doesn't exist.")
+        
+        queryset = (
+            BatchStage.objects.select_related("batch")
+            .filter(
+                current_status=BatchStage.STATUS_CLOSED,
+                batch__planning__route__route_steps__stage_id=queue_stage_id,
+                # Written from the step side so the index on (current_status, sequence) finds the stages of each step
+                sequence=F("batch__planning__route__route_steps__sequence") - 1,
+            )
+            .annotate(queue_sequence=F("sequence") + 1)
+            .order_by("updated_at", "batch_id")
+        )
+        
+        paginator = DefaultPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = serializers.StageQueueSerializer(page, many=True, context={"request": request, "now": timezone.now()})
+        return paginator.get_paginated_response(serializer.data)
+    
+# Pieces entered, closed and rejected per stage, production day and shift, read from the daily snapshots only.
+# ?from=&to= (YYYY-MM-DD, at most REPORT_MAX_DAYS apart), optional ?stage= and ?shift=
+class DailyReportViewSet(ViewSet):
+    REPORT_MAX_DAYS = 366
+    
+    def list(self, request):
+        days = {}
+        for name in ("from", "to"):
+            value = request.query_params.get(name, "")
+            try:
+                days[name] = parse_date(value)
+            except ValueError:
+                days[name] = None
+            if days[name] is None:
+                raise ValidationError(f"{name} must be a date (YYYY-MM-DD).")
+        
+        if days["to"] < days["from"]:
+            raise ValidationError("to must not be before from.")
+        if (days["to"] - days["from"]).days >= self.REPORT_MAX_DAYS:
+            raise ValidationError(f"The report covers at most {self.REPORT_MAX_DAYS} days.")
+        
+        queryset = DailyStageSnapshot.objects.filter(day__gte=days["from"], day__lte=days["to"])
+        
+        stage = request.query_params.get("stage", "").strip()
+        if stage:
+            report_stage_id = stage_id(stage)
+            if report_stage_id is None:
+                raise ValidationError(f"{stage} stage doesn't exist.")
+            queryset = queryset.filter(stage_id=report_stage_id)
+        
+        shift = request.query_params.get("shift", "").strip()
+        if shift:
+            if shift not in settings.PRODUCTION_SHIFTS:
+                raise ValidationError(f"shift must be one of {', '.join(settings.PRODUCTION_SHIFTS)}.")
+            queryset = queryset.filter(shift=shift)
+        
+        watermark = SnapshotWatermark.objects.filter(name=snapshots.DAILY_STAGE_WATERMARK).first()
+        return Response({
+            # Changes after this moment are not in the report yet
+            "as_of": watermark.updated_at if watermark else None,
+            "results": serializers.DailyStageSnapshotSerializer(queryset.order_by("day", "shift", "stage_id"), many=True).data,
+        })
+    
 class BatchStageHistoryViewSet(ModelViewSet):
     http_method_names = ["get"]
     serializer_class = serializers.BatchStageHistorySerializer    
@@ -212,12 +365,16 @@ class BatchQcStageSummaryViewSet(ModelViewSet):
 
         # When stage is provided in the query params
         if stage:
-            queryset = queryset.filter(stage=stage)
+            queryset = queryset.filter(stage_id=stage_id(stage))
 
         return queryset
     
 class RejectionViewSet(ModelViewSet):
     http_method_names = ["get","post","delete","patch"]
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     def get_serializer_class(self):
         if self.request.method =="PATCH":
@@ -248,24 +405,37 @@ class RejectionViewSet(ModelViewSet):
         
         # Check the batch stage and status
         try:
-            BatchStage.objects.get(batch=instance.batch, current_stage=stage, current_status="in")      
+            BatchStage.objects.get(batch=instance.batch, current_stage_id=stage_id(stage), current_status="in")      
         except BatchStage.DoesNotExist:
             raise ValidationError(f"The batch must be in {stage} and the current status should be in")
         
         with transaction.atomic():
+            user = serializers.get_user_name(request)
             summary = BatchQcStageSummary.objects.filter(
                 batch=instance.batch,
-                stage=stage
+                stage_id=stage_id(stage)
             ).first()
 
             if summary:
                 if summary.rejection_count <= 1:
+                    record_event(summary, ChangeEvent.ACTION_DELETED, user)
                     summary.delete()
                 else:
                     summary.rejection_count = F("rejection_count") - 1
                     summary.last_update = timezone.now()
                     summary.save(update_fields=["rejection_count", "last_update"])
+                    summary.refresh_from_db(fields=["rejection_count"])
+                    record_event(summary, ChangeEvent.ACTION_UPDATED, user)
+
+            # Give the garment back to the batch balance
+            BatchBalance.objects.filter(batch=instance.batch).update(
+                rejected_quantity=F("rejected_quantity") - 1,
+                available_quantity=F("available_quantity") + 1,
+                last_update=timezone.now(),
+            )
+            record_balance_events([instance.batch_id], user)
 
+            record_event(instance, ChangeEvent.ACTION_DELETED, user)
             instance.delete()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -275,8 +445,259 @@ class RejectionViewSet(ModelViewSet):
             serializer = self.get_serializer(instance, data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            return Response(serializer.data)  
+            return Response(serializer.data)
+
+
+class BatchBalanceViewSet(ModelViewSet):
+    http_method_names = ["get"]
+    serializer_class = serializers.BatchBalanceSerializer
     
+    # Batches that still have quantity left, answered from the balance table without aggregating any source rows
+    def get_queryset(self):
+        queryset = BatchBalance.objects.select_related("batch").filter(available_quantity__gt=0).order_by("batch_id")
+        
+        batch_status = self.request.query_params.get("status")
+        mpo = self.request.query_params.get("mpo")
+        
+        if batch_status:
+            queryset = queryset.filter(batch__status=batch_status)
+        
+        if mpo:
+            queryset = queryset.filter(batch__mpo=mpo)
+        
+        return queryset
+
+class ChangeEventViewSet(ModelViewSet):
+    http_method_names = ["get"]
+    queryset = ChangeEvent.objects.all().order_by("seq")
+    serializer_class = serializers.ChangeEventSerializer
+    
+    DEFAULT_LIMIT = 500
+    MAX_LIMIT = 2000
+    
+    # Returns the events after ?since=<seq> in pages, the client keeps calling with next_since until has_more is false.
+    # A since before the last pruned event gets 410 with latest_seq: the client reloads everything and follows from there.
+    def list(self, request, *args, **kwargs):
+        since = request.query_params.get("since", 0)
+        limit = request.query_params.get("limit", self.DEFAULT_LIMIT)
+        
+        try:
+            since = int(since)
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValidationError("since and limit must be integers.")
+        
+        if since < 0 or limit < 1:
+            raise ValidationError("since must be 0 or more and limit must be at least 1.")
+        
+        limit = min(limit, self.MAX_LIMIT)
+        
+        if since < get_pruned_seq():
+            # Read before the client reloads, so nothing that changes during the reload is skipped
+            latest_seq = ChangeEvent.objects.order_by("-seq").values_list("seq", flat=True).first() or 0
+            return Response({
+                "detail": "Change events after this seq were pruned, load everything again and follow the changes from latest_seq.",
+                "resync_required": True,
+                "latest_seq": latest_seq,
+            }, status=status.HTTP_410_GONE)
+        
+        # Fetch one extra row to know if there is another page
+        events = list(self.get_queryset().filter(seq__gt=since)[:limit + 1])
+        has_more = len(events) > limit
+        events = events[:limit]
+        
+        return Response({
+            "since": since,
+            "next_since": events[-1].seq if events else since,
+            "has_more": has_more,
+            "results": self.get_serializer(events, many=True).data,
+        })
+
 
 
+# Prefix suggestions for the planning and receiving screens, GET /autocomplete/?field=buyer&q=ab&limit=10
+# Answered from the per-worker sorted arrays in production.autocomplete, not from the tables.
+class AutocompleteViewSet(ViewSet):
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 50
     
+    def list(self, request):
+        field = request.query_params.get("field")
+        prefix = request.query_params.get("q", "")
+        limit = request.query_params.get("limit", self.DEFAULT_LIMIT)
+        
+        if field not in autocomplete.SOURCES:
+            raise ValidationError(f"field must be one of {', '.join(autocomplete.SOURCES)}.")
+        
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValidationError("limit must be an integer.")
+        
+        if limit < 1:
+            raise ValidationError("limit must be at least 1.")
+        
+        return Response({
+            "field": field,
+            "q": prefix,
+            "results": autocomplete.index.search(field, prefix, min(limit, self.MAX_LIMIT)),
+        })
+
+# Streams a whole dataset as CSV or XLSX, GET /exports/<dataset>/?file_type=xlsx&columns=id,mpo&<prefix>_after=&<prefix>_before=
+# The rows never sit in memory as a whole, they go from the database cursor to the response in chunks.
+class ExportViewSet(ViewSet):
+    
+    def list(self, request):
+        return Response([
+            {
+                "dataset": name,
+                "date_filters": [f"{dataset['date_prefix']}_after", f"{dataset['date_prefix']}_before"],
+                "columns": list(dataset["columns"]),
+            }
+            for name, dataset in exports.DATASETS.items()
+        ])
+    
+    # ?background=1 writes the file in a job instead, poll jobs/jobs/<id>/ and fetch it from its download link
+    def retrieve(self, request, pk=None):
+        if request.query_params.get("background") in ("1", "true"):
+            params = {**request.query_params.dict(), "dataset": pk}
+            params.pop("background")
+            job = enqueue("export", params, serializers.get_user_name(request), roles=get_roles(request))
+            return Response(JobSerializer(job, context={"request": request}).data, status=status.HTTP_202_ACCEPTED)
+        
+        columns, queryset, file_type = exports.prepare_export(pk, request.query_params)
+        
+        writer, content_type = exports.FILE_TYPES[file_type]
+        response = StreamingHttpResponse(
+            writer(list(columns), exports.iter_rows(queryset, columns)),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = f'attachment; filename="{exports.export_filename(pk, file_type)}"'
+        return response
+
+
+# Read-only search of the batches moved out by `manage.py archive_closed_batches`, /archived-batches/<original batch id>/
+class ArchivedBatchViewSet(ModelViewSet):
+    http_method_names = ["get"]
+    lookup_field = "batch_id"
+    pagination_class = DefaultPagination
+    
+    def get_serializer_class(self):
+        if self.action == "list":
+            return serializers.ArchivedBatchListSerializer
+        return serializers.ArchivedBatchSerializer
+    
+    def get_queryset(self):
+        queryset = ArchivedBatch.objects.all()
+        
+        if self.action != "list":
+            return queryset
+        
+        # ?mpo=, ?barcode= (bundle or garment barcode) and ?closed_after=&closed_before=, each one on an index
+        mpo = self.request.query_params.get("mpo")
+        barcode = self.request.query_params.get("barcode")
+        
+        if mpo:
+            queryset = queryset.filter(mpo=mpo)
+        
+        if barcode:
+            barcodes = [barcode]
+            if len(barcode) >= 12:
+                barcodes.append("8220" + barcode[0:12] + "001")
+            queryset = queryset.filter(bundles__bundle_barcode__in=barcodes).distinct()
+        
+        queryset = filter_date_range(queryset, self.request.query_params, "closed_at", "closed")
+        
+        return queryset.defer("document").order_by("-closed_at", "-batch_id")
+
+
+# Whole chain of a garment, bundle or batch in one call: GET /trace/?garment=<barcode> | ?bundle=<barcode> | ?batch=<id>
+# The number of queries does not depend on the size of the batch: at most 2 for the bundle and 7 for the batch.
+# Batches moved out by archive_closed_batches are answered from the archive.
+class TraceViewSet(ViewSet):
+    
+    def list(self, request):
+        params = {name: request.query_params.get(name, "").strip() for name in ("garment", "bundle", "batch")}
+        given = [name for name, value in params.items() if value]
+        
+        if len(given) != 1:
+            raise ValidationError("Send exactly one of garment, bundle or batch.")
+        
+        garment = params["garment"]
+        bundle_barcode = params["bundle"]
+        batch_id = params["batch"]
+        
+        if garment:
+            if len(garment) < 12:
+                raise ValidationError("garment must be a barcode with at least 12 characters.")
+            # The garment barcode carries the bundle barcode
+            bundle_barcode = "8220" + garment[0:12] + "001"
+        
+        bundle = None
+        if bundle_barcode:
+            bundle = (
+                ReceivedBundle.objects.select_related("batch_bundle")
+                .prefetch_related(Prefetch("firstwashbundlesource_set", queryset=FirstWashBundleSource.objects.select_related("batch_for_first_wash")))
+                .filter(bundle_barcode=bundle_barcode)
+                .first()
+            )
+            if bundle is None:
+                archived_bundle = ArchivedBundle.objects.select_related("archived_batch").filter(bundle_barcode=bundle_barcode).first()
+                if archived_bundle is None:
+                    raise NotFound(f"Bundle {bundle_barcode} not found.")
+                return self.archived_response(archived_bundle.archived_batch, archived_bundle, garment)
+            
+            batch_bundle = getattr(bundle, "batch_bundle", None)
+            batch_id = batch_bundle.batch_id if batch_bundle else None
+        else:
+            try:
+                batch_id = int(batch_id)
+            except ValueError:
+                raise ValidationError("batch must be an integer.")
+        
+        batch = None
+        if batch_id is not None:
+            batch = (
+                Batch.objects.select_related("planning", "stage", "balance")
+                .prefetch_related(
+                    Prefetch("stage_history", queryset=BatchStageHistory.objects.order_by("sequence", "entered_at")),
+                    Prefetch("rejections", queryset=Rejection.objects.order_by("rejected_at")),
+                    "qc_stage_summaries",
+                    Prefetch("batch_bundles", queryset=BatchBundle.objects.select_related("received").order_by("received__bundle_no")),
+                    Prefetch("firstwashbatchsource_set", queryset=FirstWashBatchSource.objects.select_related("batch_for_first_wash")),
+                )
+                .filter(id=batch_id)
+                .first()
+            )
+            if batch is None and bundle is None:
+                archived_batch = ArchivedBatch.objects.filter(batch_id=batch_id).first()
+                if archived_batch is None:
+                    raise NotFound(f"Batch {batch_id} not found.")
+                return self.archived_response(archived_batch)
+        
+        rejection = None
+        if garment and batch is not None:
+            rejection = next((item for item in batch.rejections.all() if item.individual_barcode == garment), None)
+        
+        return Response({
+            "archived": False,
+            "garment": {"barcode": garment, "rejection": serializers.TraceRejectionSerializer(rejection).data if rejection else None} if garment else None,
+            "bundle": serializers.TraceBundleSerializer(bundle).data if bundle else None,
+            "batch": serializers.TraceBatchSerializer(batch).data if batch else None,
+        })
+    
+    # Same shape from the archive document, the wash sources still live in the wet process tables
+    def archived_response(self, archived_batch, archived_bundle=None, garment=""):
+        document = archived_batch.document
+        wash = FirstWashBatchSource.objects.select_related("batch_for_first_wash").filter(batch_id=archived_batch.batch_id)
+        
+        rejection = None
+        if garment:
+            rejection = next((item for item in document["rejections"] if item["individual_barcode"] == garment), None)
+        
+        return Response({
+            "archived": True,
+            "garment": {"barcode": garment, "rejection": rejection} if garment else None,
+            "bundle": archived_bundle.document if archived_bundle else None,
+            "batch": {**document, "wash": serializers.TraceWashSourceSerializer(wash, many=True).data},
+        })
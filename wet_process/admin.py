@@ -1,15 +1,22 @@
 from django.contrib import admin
+from production.admin import ScalableAdmin
 from . import models
 # Register your models here.
 
 @admin.register(models.BatchForFirstWash)
-class BatchForFirstWashAdmin(admin.ModelAdmin):
+class BatchForFirstWashAdmin(ScalableAdmin):
     list_display = ["id","shade","created_at","created_by","total_quantity","status"]
+    search_fields = ["id__exact","shade__exact"]
 
+# Ids only, the batch of an archived source is no longer in the batch table
 @admin.register(models.FirstWashBatchSource)
-class FirstWashBatchSourceAdmin(admin.ModelAdmin):
-    list_display = ["id","batch_for_first_wash","batch","quantity"]
+class FirstWashBatchSourceAdmin(ScalableAdmin):
+    list_display = ["id","batch_for_first_wash_id","batch_id","quantity"]
+    raw_id_fields = ["batch_for_first_wash","batch"]
+    search_fields = ["batch_for_first_wash__id__exact","batch__id__exact"]
     
 @admin.register(models.FirstWashBundleSource)
-class FirstWashBundleSourceAdmin(admin.ModelAdmin):
-    list_display = ["id","batch_for_first_wash","bundle","quantity"]
\ No newline at end of file
+class FirstWashBundleSourceAdmin(ScalableAdmin):
+    list_display = ["id","batch_for_first_wash_id","bundle_id","quantity"]
+    raw_id_fields = ["batch_for_first_wash","bundle"]
+    search_fields = ["batch_for_first_wash__id__exact","bundle__bundle_barcode__exact"]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wet_process', '0004_rename_quantity_taken_firstwashbatchsource_quantity_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batchforfirstwash',
+            index=models.Index(fields=['created_at'], name='wet_process_created_08aa91_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batchforfirstwash',
+            index=models.Index(fields=['shade', 'created_at'], name='wet_process_shade_8c5e3a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='batchforfirstwash',
+            index=models.Index(fields=['status', 'created_at'], name='wet_process_status_9529d8_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0027_archivedbatch_archivedbundle'),
+        ('wet_process', '0005_batchforfirstwash_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='firstwashbatchsource',
+            name='batch',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='production.batch'),
+        ),
+    ]
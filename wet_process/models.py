@@ -8,6 +8,13 @@ class BatchForFirstWash(models.Model):
     total_quantity = models.IntegerField(default=0)
     status  = models.CharField(max_length=100,null=True,blank=True) # If it's needed later
     
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"]),
+            models.Index(fields=["shade", "created_at"]),
+            models.Index(fields=["status", "created_at"]),
+        ]
+    
     def __str__(self):
         return f"{self.id}"
 
@@ -18,9 +25,12 @@ class FirstWashBatchSource(models.Model):
         on_delete=models.CASCADE,
         related_name="source_batches"
     )
+    # No database constraint, archived batches (production.ArchivedBatch) keep their id here after leaving the batch table.
+    # check_consistency reports sources whose batch is in neither table.
     batch = models.ForeignKey(
         Batch,
-        on_delete=models.PROTECT
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
     )
     quantity = models.IntegerField()
     
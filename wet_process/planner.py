@@ -0,0 +1,154 @@
+import heapq
+from bisect import bisect_right
+
+from django.db.models import Count, Min
+
+from production.models import Batch, BatchBalance, BatchBundle, ReceivedBundle
+
+KIND_BATCH = "batch"
+KIND_BUNDLE = "bundle"
+
+
+# Closed batches with quantity left for washing according to their BatchBalance, as (batch_id, shade, quantity).
+# A batch takes the shade of its bundles, batches mixing shades are left for manual planning.
+def get_batch_candidates(shade=None):
+    available = dict(
+        BatchBalance.objects
+        .filter(batch__status=Batch.STATUS_CLOSED, available_quantity__gt=0)
+        .values_list("batch_id", "available_quantity")
+    )
+    
+    shades = (
+        BatchBundle.objects
+        .filter(batch_id__in=BatchBalance.objects.filter(
+            batch__status=Batch.STATUS_CLOSED, available_quantity__gt=0,
+        ).values("batch_id"))
+        .values("batch_id")
+        .annotate(
+            shade=Min("received__shade"),
+            shades=Count("received__shade", distinct=True),
+        )
+        .filter(shades=1)
+    )
+    if shade:
+        shades = shades.filter(shade=shade)
+    
+    return [
+        (row["batch_id"], row["shade"], available[row["batch_id"]])
+        for row in shades
+        if row["batch_id"] in available
+    ]
+
+# Received bundles that are not allocated to a batch or a wash yet, as (bundle_id, shade, quantity)
+def get_bundle_candidates(shade=None):
+    bundles = ReceivedBundle.objects.filter(status=ReceivedBundle.STATUS_RECEIVED)
+    if shade:
+        bundles = bundles.filter(shade=shade)
+    
+    return list(bundles.values_list("id", "shade", "quantity"))
+
+
+class Group:
+    def __init__(self, kind, shade):
+        self.kind = kind
+        self.shade = shade
+        self.items = []
+        self.total = 0
+
+    def add(self, item_id, quantity):
+        self.items.append((quantity, item_id))
+        self.total += quantity
+
+    # Batches can be split between loads: take the biggest ones first and cut the last one to the free space
+    def take_batches(self, capacity):
+        taken = []
+        while self.items and capacity > 0:
+            quantity, item_id = self.items[-1]
+            portion = min(quantity, capacity)
+            taken.append((item_id, portion))
+            capacity -= portion
+            self.total -= portion
+            
+            if portion == quantity:
+                self.items.pop()
+            else:
+                self.items[-1] = (quantity - portion, item_id)
+        return taken
+
+    # Bundles can't be split: repeatedly take the biggest bundle that still fits (first fit decreasing)
+    def take_bundles(self, capacity):
+        taken = []
+        while self.items and capacity > 0:
+            index = bisect_right(self.items, (capacity, float("inf"))) - 1
+            if index < 0:
+                break
+            quantity, item_id = self.items.pop(index)
+            taken.append((item_id, quantity))
+            capacity -= quantity
+            self.total -= quantity
+        return taken
+
+    def take(self, capacity):
+        if self.kind == KIND_BATCH:
+            return self.take_batches(capacity)
+        return self.take_bundles(capacity)
+
+
+def build_groups(batch_candidates, bundle_candidates):
+    groups = {}
+    for kind, candidates in ((KIND_BATCH, batch_candidates), (KIND_BUNDLE, bundle_candidates)):
+        for item_id, shade, quantity in candidates:
+            key = (kind, shade)
+            if key not in groups:
+                groups[key] = Group(kind, shade)
+            groups[key].add(item_id, quantity)
+    
+    for group in groups.values():
+        group.items.sort()
+    
+    return list(groups.values())
+
+# Fill one load per machine, biggest machine first, each with the shade group that has the most quantity waiting.
+# A load holds one shade and one kind of source, the same rule BatchForFirstWashSerializer enforces.
+def plan_loads(capacities, batch_candidates, bundle_candidates):
+    groups = build_groups(batch_candidates, bundle_candidates)
+    heap = [(-group.total, index) for index, group in enumerate(groups)]
+    heapq.heapify(heap)
+    
+    loads = []
+    machines = sorted(enumerate(capacities), key=lambda machine: -machine[1])
+    
+    for machine, capacity in machines:
+        skipped = []
+        
+        while heap:
+            _, index = heapq.heappop(heap)
+            group = groups[index]
+            taken = group.take(capacity)
+            
+            if group.total > 0:
+                # Put the group back after this machine is filled, either with the new total or untouched
+                skipped.append((-group.total, index))
+            
+            if taken:
+                loads.append({
+                    "machine": machine,
+                    "capacity": capacity,
+                    "shade": group.shade,
+                    "total_quantity": sum(quantity for _, quantity in taken),
+                    f"{group.kind}_source": [
+                        {group.kind: item_id, "quantity": quantity}
+                        for item_id, quantity in taken
+                    ],
+                })
+                break
+        
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+    
+    loads.sort(key=lambda load: load["machine"])
+    
+    return {
+        "loads": loads,
+        "unplanned_quantity": sum(group.total for group in groups),
+    }
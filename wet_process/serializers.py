@@ -1,22 +1,31 @@
 from django.db import transaction
-from production.models import Batch,ReceivedBundle
-from production.serializers import get_user_name,ReceivedBundleSerializer
+from django.db.models import F, prefetch_related_objects
+from django.utils import timezone
+from production.models import Batch,BatchBalance,ReceivedBundle,ChangeEvent
+from production.serializers import get_user_name,ReceivedBundleSerializer,BulkPrimaryKeyRelatedField,BulkRelatedListSerializer
+from production.events import record_balance_events, record_event, record_events
 from .models import BatchForFirstWash,FirstWashBatchSource,FirstWashBundleSource
 from rest_framework import serializers
 
 
 class BatchSourceItemSerializer(serializers.Serializer):
-    batch = serializers.PrimaryKeyRelatedField(
+    batch = BulkPrimaryKeyRelatedField(
         queryset=Batch.objects.all()
     )
     quantity = serializers.IntegerField(min_value=1)
     
+    class Meta:
+        list_serializer_class = BulkRelatedListSerializer
+    
 class BundleSourceItemSerializer(serializers.Serializer):
-    bundle = serializers.PrimaryKeyRelatedField(
+    bundle = BulkPrimaryKeyRelatedField(
         queryset=ReceivedBundle.objects.all()
     )
     quantity = serializers.IntegerField(min_value=1)
     
+    class Meta:
+        list_serializer_class = BulkRelatedListSerializer
+    
 class FirstWashBatchSourceSerializer(serializers.ModelSerializer):
     class Meta:
         model = FirstWashBatchSource
@@ -28,6 +37,17 @@ class FirstWashBundleSourceSerializer(serializers.ModelSerializer):
         model = FirstWashBundleSource
         fields = ["bundle","quantity"]    
     
+# Used by the list, the nested sources are only loaded for a single wash batch
+class BatchForFirstWashListSerializer(serializers.ModelSerializer):
+    batch_source_count = serializers.IntegerField(read_only=True)
+    batch_source_quantity = serializers.IntegerField(read_only=True)
+    bundle_source_count = serializers.IntegerField(read_only=True)
+    bundle_source_quantity = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = BatchForFirstWash
+        fields = ["id","shade","created_at","created_by","total_quantity","status","batch_source_count","batch_source_quantity","bundle_source_count","bundle_source_quantity"]
+    
 class BatchForFirstWashSerializer(serializers.ModelSerializer):
     source_batches = FirstWashBatchSourceSerializer(many=True,read_only=True)
     source_bundles = FirstWashBundleSourceSerializer(many=True, read_only=True)
@@ -56,6 +76,35 @@ class BatchForFirstWashSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 "You must provide either batch_source or bundle_source."
             )
+        
+        if batch_source:
+            batch_ids = [item["batch"].id for item in batch_source]
+            
+            # Duplicate batches are not allowed
+            if len(batch_ids) != len(set(batch_ids)):
+                raise serializers.ValidationError(
+                    "Duplicate batches are not allowed in batch_source."
+                )
+        
+        if bundle_source:
+            bundle_ids = [item["bundle"].id for item in bundle_source]
+            
+            # Duplicate bundles are not allowed
+            if len(bundle_ids) != len(set(bundle_ids)):
+                raise serializers.ValidationError(
+                    "Duplicate bundles are not allowed in bundle_source."
+                )
+            
+            # Report every allocated bundle at once, the bundles are already loaded by the source item serializer
+            allocated = [
+                item["bundle"].id
+                for item in bundle_source
+                if item["bundle"].status == ReceivedBundle.STATUS_ALLOCATED
+            ]
+            if allocated:
+                raise serializers.ValidationError(
+                    f"Bundles {', '.join(map(str, allocated))} are already allocated"
+                )
 
         return attrs    
         
@@ -64,47 +113,96 @@ class BatchForFirstWashSerializer(serializers.ModelSerializer):
         bundle_source_data = validated_data.pop("bundle_source", None)
 
         created_by = get_user_name(self.context["request"])
-        total_quantity = 0
+        source_data = batch_source_data or bundle_source_data
         
         with transaction.atomic():
             # create the batch
             batch_for_first_wash = BatchForFirstWash.objects.create(
                 created_by=created_by,
+                total_quantity=sum(item["quantity"] for item in source_data),
                 **validated_data
             )
 
             #  when the source is batch
             if batch_source_data:
-                total_quantity = sum(item["quantity"] for item in batch_source_data)
-
+                # Take the quantity out of each batch balance only if that much is still available
+                short = []
                 for item in batch_source_data:
-                    FirstWashBatchSource.objects.create(
+                    updated = BatchBalance.objects.filter(
+                        batch=item["batch"],
+                        available_quantity__gte=item["quantity"],
+                    ).update(
+                        washed_quantity=F("washed_quantity") + item["quantity"],
+                        available_quantity=F("available_quantity") - item["quantity"],
+                        last_update=timezone.now(),
+                    )
+                    if not updated:
+                        short.append(item["batch"].id)
+                
+                if short:
+                    raise serializers.ValidationError(
+                        f"Batches {', '.join(map(str, short))} don't have enough quantity left for this wash"
+                    )
+                record_balance_events([item["batch"].id for item in batch_source_data], created_by)
+                
+                FirstWashBatchSource.objects.bulk_create([
+                    FirstWashBatchSource(
                         batch_for_first_wash=batch_for_first_wash,
                         batch=item["batch"],
                         quantity=item["quantity"],
                     )
+                    for item in batch_source_data
+                ])
 
             # when the source is bundle
             if bundle_source_data:
-                total_quantity = sum(item["quantity"] for item in bundle_source_data)
-
-                for item in bundle_source_data:
-                    received_bundle = item["bundle"]
-                    # Check if the bundle is already allocated
-                    if received_bundle.status=="allocated":
-                        raise serializers.ValidationError(f"Bundle {received_bundle.id} is already allocated")
-                    
-                    FirstWashBundleSource.objects.create(
+                bundles = [item["bundle"] for item in bundle_source_data]
+                
+                # Flip only the bundles that are still received, if another request allocated one of them
+                # in the meantime the row count won't match and everything is rolled back
+                allocated_count = ReceivedBundle.objects.filter(
+                    id__in=[bundle.id for bundle in bundles],
+                    status=ReceivedBundle.STATUS_RECEIVED,
+                ).update(status=ReceivedBundle.STATUS_ALLOCATED)
+                
+                if allocated_count != len(bundles):
+                    raise serializers.ValidationError(
+                        "One or more bundles were allocated by another request, please try again."
+                    )
+                
+                FirstWashBundleSource.objects.bulk_create([
+                    FirstWashBundleSource(
                         batch_for_first_wash=batch_for_first_wash,
-                        bundle=received_bundle,
+                        bundle=item["bundle"],
                         quantity=item["quantity"],
                     )
-                    
-                    # update the received bundle's status
-                    received_bundle.status = "allocated"
-                    received_bundle.save(update_fields=["status"])
+                    for item in bundle_source_data
+                ])
+                
+                for bundle in bundles:
+                    bundle.status = ReceivedBundle.STATUS_ALLOCATED
+                
+                record_events(bundles, ChangeEvent.ACTION_UPDATED, created_by)
+            
+            record_event(
+                batch_for_first_wash,
+                ChangeEvent.ACTION_CREATED,
+                created_by,
+                batch_source=[{"batch": item["batch"].id, "quantity": item["quantity"]} for item in batch_source_data or []],
+                bundle_source=[{"bundle": item["bundle"].id, "quantity": item["quantity"]} for item in bundle_source_data or []],
+            )
+        
+        # Load the nested sources for the response in two queries instead of one per bundle
+        prefetch_related_objects([batch_for_first_wash], "source_batches", "source_bundles__bundle")
+
+        return batch_for_first_wash
 
-            batch_for_first_wash.total_quantity = total_quantity
-            batch_for_first_wash.save()
 
-            return batch_for_first_wash    
\ No newline at end of file
+class WashPlanSerializer(serializers.Serializer):
+    # One entry per washing machine available for this round, in pieces
+    capacities = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+    shade = serializers.CharField(required=False)
@@ -1,3 +1,139 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from production.models import BatchBalance, ChangeEvent, ReceivedBundle, StageName
+from production.tests import ApiTestCase
+
+from . import planner
+from .models import BatchForFirstWash, FirstWashBatchSource
+
+
+class FirstWashBatchTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bundle = self.post("/productions/received-bundles/", self.bundle_data())
+
+    def test_deleting_a_wash_gives_the_bundles_back(self):
+        wash = self.post("/wet-process/first-wash-batches/", {"shade": "A", "bundle_source": [{"bundle": self.bundle["id"], "quantity": 10}]})
+
+        response = self.client.delete(f"/wet-process/first-wash-batches/{wash['id']}/")
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(ReceivedBundle.objects.get().status, ReceivedBundle.STATUS_RECEIVED)
+        event = ChangeEvent.objects.filter(entity="production.receivedbundle").order_by("-seq").first()
+        self.assertEqual((event.action, event.entity_id, event.payload["status"]), (ChangeEvent.ACTION_UPDATED, self.bundle["id"], ReceivedBundle.STATUS_RECEIVED))
+
+    def test_batch_sources_take_from_the_balances(self):
+        StageName.objects.create(stage="Sewing")
+        self.post("/productions/plannings/", {"mpo": "M1", "stages": ["Sewing"]})
+        second = self.post("/productions/received-bundles/", self.bundle_data(bundle_no=2, bundle_barcode="82200000M1000002001", quantity=8))
+        batches = [self.post("/productions/batches/", {"scanned_bundles": [bundle["id"]]}) for bundle in (self.bundle, second)]
+
+        wash = self.post("/wet-process/first-wash-batches/", {"shade": "A", "batch_source": [
+            {"batch": batches[0]["id"], "quantity": 4}, {"batch": batches[1]["id"], "quantity": 8},
+        ]})
+
+        self.assertEqual(wash["total_quantity"], 12)
+        self.assertEqual(
+            sorted(FirstWashBatchSource.objects.values_list("batch_id", "quantity")),
+            [(batches[0]["id"], 4), (batches[1]["id"], 8)],
+        )
+        self.assertEqual(
+            sorted(BatchBalance.objects.values_list("batch_id", "washed_quantity", "available_quantity")),
+            [(batches[0]["id"], 4, 6), (batches[1]["id"], 8, 0)],
+        )
+        event = ChangeEvent.objects.get(entity="wet_process.batchforfirstwash")
+        self.assertEqual(event.payload["batch_source"], [{"batch": batches[0]["id"], "quantity": 4}, {"batch": batches[1]["id"], "quantity": 8}])
+
+        # The second batch has nothing left, so the whole wash is refused
+        response = self.client.post("/wet-process/first-wash-batches/", {"shade": "A", "batch_source": [
+            {"batch": batches[0]["id"], "quantity": 1}, {"batch": batches[1]["id"], "quantity": 1},
+        ]}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(BatchForFirstWash.objects.count(), 1)
+        self.assertEqual(BatchBalance.objects.get(batch_id=batches[0]["id"]).available_quantity, 6)
+
+    def test_unknown_and_allocated_sources_are_listed(self):
+        other = self.post("/productions/received-bundles/", self.bundle_data(bundle_no=2, bundle_barcode="82200000M1000002001"))
+        self.post("/wet-process/first-wash-batches/", {"shade": "A", "bundle_source": [{"bundle": other["id"], "quantity": 10}]})
+
+        response = self.client.post("/wet-process/first-wash-batches/", {"shade": "A", "bundle_source": [
+            {"bundle": self.bundle["id"], "quantity": 10}, {"bundle": 998, "quantity": 1}, {"bundle": 999, "quantity": 1},
+        ]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid pk(s) 998, 999", str(response.data))
+
+        response = self.client.post("/wet-process/first-wash-batches/", {"shade": "A", "bundle_source": [
+            {"bundle": self.bundle["id"], "quantity": 10}, {"bundle": other["id"], "quantity": 10},
+        ]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f"Bundles {other['id']} are already allocated", str(response.data))
+
+    # The sources are loaded with one IN query, more of them don't cost more queries
+    def test_source_lookups_do_not_grow_with_the_sources(self):
+        bundles = [self.bundle] + [
+            self.post("/productions/received-bundles/", self.bundle_data(bundle_no=number, bundle_barcode=f"82200000M100000{number}001"))
+            for number in (2, 3)
+        ]
+
+        def wash(bundles):
+            with CaptureQueriesContext(connection) as queries:
+                self.post("/wet-process/first-wash-batches/", {"shade": "A", "bundle_source": [{"bundle": bundle["id"], "quantity": 10} for bundle in bundles]})
+            return len(queries)
+
+        self.assertEqual(wash(bundles[:1]), wash(bundles[1:]))
+
+    def test_list_filters_and_totals(self):
+        other = self.post("/productions/received-bundles/", self.bundle_data(bundle_no=2, bundle_barcode="82200000M1000002001", shade="B", quantity=7))
+        first = self.post("/wet-process/first-wash-batches/", {"shade": "A", "bundle_source": [{"bundle": self.bundle["id"], "quantity": 10}]})
+        second = self.post("/wet-process/first-wash-batches/", {"shade": "B", "bundle_source": [{"bundle": other["id"], "quantity": 7}]})
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+
+        response = self.client.get("/wet-process/first-wash-batches/", {"page_size": 1})
+        self.assertEqual((response.data["count"], [wash["id"] for wash in response.data["results"]]), (2, [second["id"]]))
+        self.assertIsNotNone(response.data["next"])
+
+        response = self.client.get("/wet-process/first-wash-batches/", {"shade": "A"})
+        self.assertEqual(len(response.data["results"]), 1)
+        wash = response.data["results"][0]
+        self.assertEqual(wash["id"], first["id"])
+        self.assertEqual((wash["bundle_source_count"], wash["bundle_source_quantity"], wash["batch_source_count"], wash["batch_source_quantity"]), (1, 10, 0, 0))
+
+        self.assertEqual(self.client.get("/wet-process/first-wash-batches/", {"created_after": tomorrow}).data["count"], 0)
+        self.assertEqual(self.client.get("/wet-process/first-wash-batches/", {"created_before": tomorrow}).data["count"], 2)
+
+
+class WashPlanTests(ApiTestCase):
+    def test_bundles_are_packed_biggest_machine_first(self):
+        bundles = [
+            self.post("/productions/received-bundles/", self.bundle_data(bundle_no=number, bundle_barcode=f"82200000M100000{number}001", quantity=quantity))
+            for number, quantity in ((1, 10), (2, 6), (3, 5), (4, 4))
+        ]
+        self.post("/productions/received-bundles/", self.bundle_data(bundle_no=5, bundle_barcode="82200000M1000005001", shade="B", quantity=3))
+
+        data = self.post("/wet-process/first-wash-batches/plan/", {"capacities": [11, 12], "shade": "A"})
+
+        self.assertEqual(data["loads"], [
+            {"machine": 0, "capacity": 11, "shade": "A", "total_quantity": 11, "bundle_source": [
+                {"bundle": bundles[1]["id"], "quantity": 6}, {"bundle": bundles[2]["id"], "quantity": 5},
+            ]},
+            {"machine": 1, "capacity": 12, "shade": "A", "total_quantity": 10, "bundle_source": [
+                {"bundle": bundles[0]["id"], "quantity": 10},
+            ]},
+        ])
+        self.assertEqual(data["unplanned_quantity"], 4)
+        self.assertEqual(ReceivedBundle.objects.filter(status=ReceivedBundle.STATUS_ALLOCATED).count(), 0)
+
+    # Batches are cut to fill a load, bundles never are
+    def test_batches_are_split_between_loads(self):
+        result = planner.plan_loads([8, 8], [(1, "A", 10), (2, "A", 4)], [])
+
+        self.assertEqual([load["batch_source"] for load in result["loads"]], [
+            [{"batch": 1, "quantity": 8}],
+            [{"batch": 1, "quantity": 2}, {"batch": 2, "quantity": 4}],
+        ])
+        self.assertEqual(result["unplanned_quantity"], 0)
@@ -1,10 +1,95 @@
 from django.shortcuts import render
-from .models import BatchForFirstWash
-from .serializers import BatchForFirstWashSerializer
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from .models import BatchForFirstWash, FirstWashBatchSource, FirstWashBundleSource
+from .serializers import BatchForFirstWashSerializer, BatchForFirstWashListSerializer, WashPlanSerializer
+from . import planner
 from rest_framework.viewsets import ModelViewSet
+from production.idempotency import idempotent
+from production.models import BatchBalance, ChangeEvent, ReceivedBundle
+from production.events import record_balance_events, record_event, record_events
+from production.filters import filter_date_range
+from production.pagination import DefaultPagination
+from production.serializers import get_user_name
 # Create your views here.
 
+# Count and quantity of the sources of each wash batch, as correlated subqueries so both relations don't multiply each other
+def source_totals(model, prefix):
+    sources = model.objects.filter(batch_for_first_wash=OuterRef("pk")).values("batch_for_first_wash")
+    return {
+        f"{prefix}_count": Coalesce(Subquery(sources.annotate(total=Count("id")).values("total"), output_field=IntegerField()), 0),
+        f"{prefix}_quantity": Coalesce(Subquery(sources.annotate(total=Sum("quantity")).values("total"), output_field=IntegerField()), 0),
+    }
+
 class BatchForFirstWashViewSet(ModelViewSet):
-    queryset = BatchForFirstWash.objects.all().prefetch_related("source_batches","source_bundles__bundle")
     serializer_class = BatchForFirstWashSerializer
-    
\ No newline at end of file
+    pagination_class = DefaultPagination
+    
+    def get_serializer_class(self):
+        if self.action == "list":
+            return BatchForFirstWashListSerializer
+        return BatchForFirstWashSerializer
+    
+    def get_queryset(self):
+        queryset = BatchForFirstWash.objects.all()
+        
+        if self.action != "list":
+            return queryset.prefetch_related("source_batches","source_bundles__bundle")
+        
+        queryset = queryset.annotate(
+            **source_totals(FirstWashBatchSource, "batch_source"),
+            **source_totals(FirstWashBundleSource, "bundle_source"),
+        ).order_by("-created_at", "-id")
+        
+        shade = self.request.query_params.get("shade")
+        wash_status = self.request.query_params.get("status")
+        if shade:
+            queryset = queryset.filter(shade=shade)
+        
+        if wash_status:
+            queryset = queryset.filter(status=wash_status)
+        
+        # ?created_after=&created_before=
+        return filter_date_range(queryset, self.request.query_params, "created_at", "created")
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+    
+    # Deleting a wash batch gives its quantities back to the batch balances and its bundles back to the received section
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            for source in instance.source_batches.all():
+                BatchBalance.objects.filter(batch_id=source.batch_id).update(
+                    washed_quantity=F("washed_quantity") - source.quantity,
+                    available_quantity=F("available_quantity") + source.quantity,
+                    last_update=timezone.now(),
+                )
+            
+            record_balance_events([source.batch_id for source in instance.source_batches.all()], get_user_name(self.request))
+            
+            bundle_ids = [source.bundle_id for source in instance.source_bundles.all()]
+            ReceivedBundle.objects.filter(id__in=bundle_ids).update(status=ReceivedBundle.STATUS_RECEIVED)
+            record_events(ReceivedBundle.objects.filter(id__in=bundle_ids), ChangeEvent.ACTION_UPDATED, get_user_name(self.request))
+            
+            record_event(instance, ChangeEvent.ACTION_DELETED, get_user_name(self.request))
+            instance.delete()
+    
+    # Propose wash loads for the given machine capacities, nothing is saved.
+    # Each proposed load can be posted back as is to create the BatchForFirstWash.
+    @action(detail=False, methods=["post"], url_path="plan")
+    def plan(self, request):
+        serializer = WashPlanSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        shade = serializer.validated_data.get("shade")
+        
+        result = planner.plan_loads(
+            serializer.validated_data["capacities"],
+            planner.get_batch_candidates(shade),
+            planner.get_bundle_candidates(shade),
+        )
+        return Response(result)